@@ -1,12 +1,18 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response
 import os
 import sys
+import time
 import logging
 from datetime import datetime
 
 # Thêm src folder vào path để import Load_ggdrive
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
-from Load_ggdrive import download_pdf_from_drive
+from tracing import registry, render_metrics, set_trace_id, reset_trace_id, get_trace_id
+from lazy import lazy_import
+from file_index import DataDirIndex
+
+# Google API client chỉ nạp khi gọi /download → /health, /files, /metrics khởi động nhanh
+Load_ggdrive = lazy_import("Load_ggdrive")
 
 # Cấu hình logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] - %(message)s")
@@ -15,6 +21,30 @@ logger = logging.getLogger(__name__)
 # Khởi tạo Flask app
 app = Flask(__name__)
 
+@app.before_request
+def start_trace():
+    """Gắn trace ID cho request (nhận từ header X-Request-ID nếu client gửi lên)"""
+    g.trace_token = set_trace_id(request.headers.get('X-Request-ID'))
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def finish_trace(response):
+    elapsed = time.perf_counter() - g.get('request_start', time.perf_counter())
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    registry.observe("http_request_duration_seconds", elapsed, method=request.method, endpoint=endpoint)
+    registry.inc("http_requests_total", method=request.method, endpoint=endpoint, status=response.status_code)
+    response.headers['X-Request-ID'] = get_trace_id()
+    return response
+
+@app.teardown_request
+def reset_trace(exc):
+    token = g.pop('trace_token', None)
+    if token is not None:
+        reset_trace_id(token)
+
+# Cache danh sách file trong data/ (dùng chung giữa các request của worker)
+data_index = DataDirIndex(data_dir="data")
+
 @app.route('/', methods=['GET'])
 def home():
     """Trang chủ API"""
@@ -25,7 +55,8 @@ def home():
             "GET /": "Trang chủ API",
             "POST /download": "Tải file từ Google Drive",
             "GET /health": "Kiểm tra trạng thái API",
-            "GET /files": "Liệt kê files trong thư mục data"
+            "GET /files": "Liệt kê files trong thư mục data (phân trang: limit, cursor)",
+            "GET /metrics": "Metrics định dạng Prometheus"
         },
         "author": "RAG System",
         "timestamp": datetime.now().isoformat()
@@ -98,7 +129,7 @@ def download_file():
         logger.info(f"🔄 API Request: Tải file_id={file_id}, file_name={file_name}")
         
         # Gọi function download
-        downloaded_path = download_pdf_from_drive(file_id, file_name)
+        downloaded_path = Load_ggdrive.download_pdf_from_drive(file_id, file_name)
         
         if downloaded_path:
             # Lấy thông tin file
@@ -132,39 +163,58 @@ def download_file():
 
 @app.route('/files', methods=['GET'])
 def list_files():
-    """Liệt kê tất cả files trong thư mục data"""
+    """
+    Liệt kê files trong thư mục data (có cache, phân trang theo cursor)
+    
+    Query params:
+        limit: số file mỗi trang (mặc định 100, tối đa 1000)
+        cursor: next_cursor của trang trước
+        pdf_only: true/false
+        q: lọc theo tên file
+        indexed: true/false - lọc theo trạng thái đã ingest
+    Response: count = số file khớp filter, total = tổng số file trong data/
+    """
     try:
-        data_dir = "data"
-        
-        if not os.path.exists(data_dir):
+        if not data_index.exists():
             return jsonify({
                 "files": [],
                 "count": 0,
+                "total": 0,
                 "message": "Thư mục data không tồn tại"
             })
         
-        # Lấy tất cả files
-        all_files = []
-        for file_name in os.listdir(data_dir):
-            file_path = os.path.join(data_dir, file_name)
-            if os.path.isfile(file_path):
-                file_stat = os.stat(file_path)
-                all_files.append({
-                    "name": file_name,
-                    "size_mb": round(file_stat.st_size / (1024 * 1024), 2),
-                    "modified_time": datetime.fromtimestamp(file_stat.st_mtime).isoformat(),
-                    "is_pdf": file_name.lower().endswith('.pdf')
-                })
+        try:
+            limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+        except ValueError:
+            return jsonify({
+                "error": "Invalid limit",
+                "message": "limit phải là số nguyên"
+            }), 400
         
-        # Sắp xếp theo thời gian modified
-        all_files.sort(key=lambda x: x['modified_time'], reverse=True)
+        indexed_arg = request.args.get('indexed')
+        indexed = None if indexed_arg is None else indexed_arg.lower() == 'true'
         
-        pdf_count = sum(1 for f in all_files if f['is_pdf'])
+        try:
+            result = data_index.list_files(
+                limit=limit,
+                cursor=request.args.get('cursor'),
+                pdf_only=request.args.get('pdf_only', 'false').lower() == 'true',
+                name_contains=request.args.get('q'),
+                indexed=indexed,
+            )
+        except (ValueError, TypeError):
+            return jsonify({
+                "error": "Invalid cursor",
+                "message": "cursor không hợp lệ"
+            }), 400
         
         return jsonify({
-            "files": all_files,
-            "count": len(all_files),
-            "pdf_count": pdf_count,
+            "files": result["files"],
+            "count": result["matched"],
+            "total": result["total"],
+            "pdf_count": result["pdf_count"],
+            "returned": len(result["files"]),
+            "next_cursor": result["next_cursor"],
             "timestamp": datetime.now().isoformat()
         })
         
@@ -175,13 +225,22 @@ def list_files():
             "message": str(e)
         }), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Xuất histogram/counter theo stage ở định dạng Prometheus (chỉ của process Flask này).
+    ETL, query CLI và batch query ghi metrics của chúng ra METRICS_TEXTFILE_DIR/<process>.prom
+    (textfile collector của node_exporter)
+    """
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.errorhandler(404)
 def not_found(error):
     """Handler cho 404 errors"""
     return jsonify({
         "error": "Not Found",
         "message": "API endpoint không tồn tại",
-        "available_endpoints": ["/", "/download", "/health", "/files"]
+        "available_endpoints": ["/", "/download", "/health", "/files", "/metrics"]
     }), 404
 
 @app.errorhandler(500)
@@ -199,6 +258,7 @@ if __name__ == '__main__':
     logger.info("   POST /download - Tải file từ Google Drive")
     logger.info("   GET  /health - Kiểm tra trạng thái")
     logger.info("   GET  /files - Liệt kê files trong data/")
+    logger.info("   GET  /metrics - Prometheus metrics")
     
     # Chạy Flask app
     app.run(
@@ -0,0 +1,317 @@
+"""
+Batch query: trả lời / đánh giá nhiều câu hỏi từ file JSONL.
+
+Input: mỗi dòng {"id": ..., "query": "..."} (hoặc "question"); các trường khác (vd. "expected")
+được giữ nguyên trong output, dưới khóa "input", để chấm điểm.
+Output: mỗi dòng một kết quả {id, query, answer, contexts, timings_ms, trace_id, error, input}.
+Chạy lại với cùng --output sẽ bỏ qua các id đã xong (không lỗi) → resume được sau khi bị ngắt;
+id bị lỗi được chạy lại, dòng sau cùng của mỗi id là kết quả mới nhất.
+
+Ví dụ:
+    python batch_query.py --input eval/questions.jsonl --output output/eval_answers.jsonl --concurrency 8
+    python batch_query.py --input eval/questions.jsonl --output output/eval_retrieval.jsonl --no-answer
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Callable, Iterable, Optional
+
+from main import (
+    build_retriever, build_metadata_filters, diversify_candidates, cohere_rerank, rag_agent_answer, generate_queries,
+    MMR_TOP_K, MMR_LAMBDA,
+    BaseRetriever, QueryFusionRetriever, MetadataFilters,
+)
+from tracing import span, count_items, trace_context, new_trace_id, write_metrics_textfile
+from docstore import hydrate_nodes
+from ratelimit import request_priority, BULK
+from lazy import lazy_import
+
+QueryBundle = lazy_import("llama_index.core.schema", "QueryBundle")
+embedding = lazy_import("embedding")
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] - %(message)s")
+logger = logging.getLogger(__name__)
+
+STAGES = ("expand", "embed", "retrieve", "rerank", "answer")
+
+# ----------- Input / resume -----------
+def load_queries(path: str) -> List[Dict[str, Any]]:
+    """Đọc JSONL câu hỏi; id mặc định là số dòng (bắt đầu từ 1)"""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            query = record.get("query") or record.get("question")
+            if not query:
+                logger.warning(f"⚠️ Dòng {line_no} không có 'query' → bỏ qua")
+                continue
+            record["id"] = str(record.get("id", line_no))
+            record["query"] = query
+            records.append(record)
+    return records
+
+def completed_ids(output_path: str) -> set:
+    """Các id đã có kết quả không lỗi trong file output (bỏ qua dòng cuối bị ghi dở)"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("error"):
+                done.discard(record["id"])
+            else:
+                done.add(record["id"])
+    return done
+
+# ----------- Stages -----------
+def _map(executor: ThreadPoolExecutor, fn: Callable, items: Iterable) -> list:
+    """executor.map giữ contextvars (trace ID, priority) của thread gọi"""
+    # copy_context() phải chạy ở thread gọi: trong worker nó chỉ copy context rỗng của thread pool
+    items = list(items)
+    contexts = [contextvars.copy_context() for _ in items]
+    return list(executor.map(lambda ctx, item: ctx.run(fn, item), contexts, items))
+
+class _Item:
+    """Trạng thái một câu hỏi qua các stage"""
+
+    def __init__(self, record: Dict[str, Any]):
+        self.record = record
+        self.trace_id = new_trace_id()
+        self.bundles: list = []
+        self.nodes: list = []
+        self.answer = None
+        self.timings: Dict[str, float] = {}
+        self.error = None
+
+    def run_stage(self, stage: str, fn: Callable):
+        if self.error:
+            return
+        start = time.perf_counter()
+        with trace_context(self.trace_id):
+            try:
+                with span(f"batch_{stage}"):
+                    fn(self)
+            except Exception as e:
+                self.error = f"{stage}: {type(e).__name__}: {e}"
+                logger.warning(f"⚠️ Query {self.record['id']} lỗi ở stage {stage}: {e}")
+        self.timings[stage] = round((time.perf_counter() - start) * 1000, 2)
+
+def run_batch(
+    records: List[Dict[str, Any]],
+    fusion: QueryFusionRetriever,
+    dense_retriever: BaseRetriever,
+    embed_model,
+    executor: ThreadPoolExecutor,
+    similarity_top_k: int,
+    rerank_top_k: int,
+    answer: bool,
+    mmr_top_k: int = 0,
+    mmr_lambda: float = MMR_LAMBDA,
+) -> List[_Item]:
+    """
+    Chạy một batch câu hỏi qua từng stage; mỗi stage chạy song song tối đa `concurrency` câu,
+    riêng embedding gom mọi query (kể cả các cách hỏi sinh thêm) của batch vào một lần gọi.
+    """
+    items = [_Item(r) for r in records]
+
+    def expand(item: _Item):
+        query = item.record["query"]
+        item.bundles = [QueryBundle(query)]
+        if fusion.num_queries > 1:
+            item.bundles.extend(generate_queries(fusion, query))
+
+    _map(executor, lambda it: it.run_stage("expand", expand), items)
+
+    # Embed tất cả query của batch trong một lần gọi (text-embedding-3 dùng chung model cho query/text)
+    pending = [it for it in items if not it.error]
+    strings = [b.query_str for it in pending for b in it.bundles]
+    start = time.perf_counter()
+    try:
+        with span("batch_embed", queries=len(strings)):
+            embeddings = embed_model.get_text_embedding_batch(strings) if strings else []
+        count_items("batch_embed", len(strings))
+        offset = 0
+        for it in pending:
+            for bundle in it.bundles:
+                bundle.embedding = embeddings[offset]
+                offset += 1
+    except Exception as e:
+        for it in pending:
+            it.error = f"embed: {type(e).__name__}: {e}"
+        logger.error(f"❌ Embed batch lỗi: {e}")
+    embed_ms = round((time.perf_counter() - start) * 1000, 2)
+    for it in pending:
+        it.timings["embed"] = embed_ms
+
+    def retrieve(item: _Item):
+        results = {(b.query_str, 0): dense_retriever.retrieve(b) for b in item.bundles}
+        nodes = diversify_candidates(fusion._simple_fusion(results)[:similarity_top_k], mmr_top_k, mmr_lambda)
+        item.nodes = hydrate_nodes(nodes)
+
+    def rerank(item: _Item):
+        item.nodes = cohere_rerank(item.record["query"], item.nodes, top_k=rerank_top_k)
+
+    def generate(item: _Item):
+        item.answer = str(rag_agent_answer(item.record["query"], item.nodes))
+
+    stages = [("retrieve", retrieve), ("rerank", rerank)]
+    if answer:
+        stages.append(("answer", generate))
+    for stage, fn in stages:
+        _map(executor, lambda it: it.run_stage(stage, fn), items)
+    return items
+
+def _result_record(item: _Item) -> Dict[str, Any]:
+    contexts = [
+        {
+            "id": n.node.node_id,
+            "score": n.score,
+            "source_file": n.node.metadata.get("source_file"),
+            "page": n.node.metadata.get("page"),
+            "text": n.node.get_content(),
+        }
+        for n in item.nodes
+    ]
+    timings = dict(item.timings)
+    timings["total"] = round(sum(timings.values()), 2)
+    # Trường của input để riêng: eval set thường có sẵn "answer"/"contexts" tham chiếu, không được đè kết quả
+    extra = {k: v for k, v in item.record.items() if k not in ("id", "query")}
+    return {
+        "id": item.record["id"],
+        "query": item.record["query"],
+        "answer": item.answer,
+        "contexts": contexts,
+        "timings_ms": timings,
+        "trace_id": item.trace_id,
+        "error": item.error,
+        "input": extra,
+    }
+
+# ----------- Entry point -----------
+def batch_query(
+    input_path: str,
+    output_path: str,
+    batch_size: int = 32,
+    concurrency: int = 8,
+    similarity_top_k: int = 10,
+    rerank_top_k: int = 5,
+    answer: bool = True,
+    namespaces: Optional[List[str]] = None,
+    filters: Optional[MetadataFilters] = None,
+    mmr_top_k: int = MMR_TOP_K,
+    mmr_lambda: float = MMR_LAMBDA,
+) -> Dict[str, Any]:
+    """
+    Trả lời / đánh giá mọi câu hỏi trong input_path, ghi kết quả dần vào output_path (JSONL)
+    Args:
+        batch_size: Số câu hỏi mỗi batch (embedding gom theo batch)
+        concurrency: Số câu hỏi xử lý song song trong mỗi stage
+        answer: False = chỉ retrieve + rerank (đánh giá retrieval)
+        namespaces: Namespace (một hoặc nhiều) để tìm kiếm, None = mặc định
+        filters: Filter metadata áp cho mọi câu hỏi (main.build_metadata_filters)
+        mmr_top_k: Số candidate đa dạng giữ lại trước rerank (0 = tắt, tối thiểu rerank_top_k)
+        mmr_lambda: Cân bằng liên quan (1.0) / đa dạng (0.0) của MMR
+    Returns:
+        Dict: tổng kết (queries, skipped, errors, seconds, qps, p50/p95 theo stage)
+    """
+    records = load_queries(input_path)
+    done = completed_ids(output_path)
+    todo = [r for r in records if r["id"] not in done]
+    logger.info(f"📋 {len(records)} câu hỏi, {len(records) - len(todo)} đã xong → chạy {len(todo)}")
+
+    dense_retriever = build_retriever(namespaces, similarity_top_k=similarity_top_k, filters=filters)
+    fusion = QueryFusionRetriever(
+        [dense_retriever],
+        retriever_weights=[1.0],
+        num_queries=3,
+        similarity_top_k=similarity_top_k,
+        use_async=False,
+    )
+    embed_model = embedding.get_embed_model(embed_batch_size=max(batch_size * fusion.num_queries, 100))
+
+    mmr_top_k = mmr_top_k and max(mmr_top_k, rerank_top_k)
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    stage_timings: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    errors = 0
+    start = time.perf_counter()
+    with request_priority(BULK), ThreadPoolExecutor(max_workers=concurrency) as executor, \
+            open(output_path, "a", encoding="utf-8") as out:
+        for batch_start in range(0, len(todo), batch_size):
+            batch = todo[batch_start:batch_start + batch_size]
+            items = run_batch(
+                batch, fusion, dense_retriever, embed_model, executor, similarity_top_k, rerank_top_k, answer,
+                mmr_top_k=mmr_top_k, mmr_lambda=mmr_lambda,
+            )
+            for item in items:
+                out.write(json.dumps(_result_record(item), ensure_ascii=False) + "\n")
+                errors += bool(item.error)
+                for stage, ms in item.timings.items():
+                    stage_timings[stage].append(ms)
+            # flush sau mỗi batch → bị ngắt thì chỉ mất batch đang chạy
+            out.flush()
+            logger.info(f"✅ {min(batch_start + batch_size, len(todo))}/{len(todo)} câu hỏi ({errors} lỗi)")
+    elapsed = time.perf_counter() - start
+
+    def pct(values: List[float], p: float) -> float:
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] if ordered else 0.0
+
+    summary = {
+        "queries": len(todo),
+        "skipped": len(records) - len(todo),
+        "errors": errors,
+        "seconds": round(elapsed, 2),
+        "qps": round(len(todo) / elapsed, 2) if elapsed and todo else 0.0,
+        "stages_ms": {
+            stage: {"p50": pct(values, 50), "p95": pct(values, 95)}
+            for stage, values in stage_timings.items() if values
+        },
+    }
+    logger.info(f"📊 Batch query xong: {json.dumps(summary, ensure_ascii=False)}")
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch query từ file JSONL (resume được)")
+    parser.add_argument("--input", required=True, help="File JSONL câu hỏi")
+    parser.add_argument("--output", required=True, help="File JSONL kết quả (append, resume theo id)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--similarity-top-k", type=int, default=10)
+    parser.add_argument("--rerank-top-k", type=int, default=5)
+    parser.add_argument("--mmr-top-k", type=int, default=MMR_TOP_K, help="Số candidate giữ lại sau MMR (0 = tắt)")
+    parser.add_argument("--mmr-lambda", type=float, default=MMR_LAMBDA)
+    parser.add_argument("--no-answer", action="store_true", help="Chỉ retrieve + rerank, không gọi LLM trả lời")
+    parser.add_argument("--namespace", nargs="+", default=None, help="Một hoặc nhiều namespace")
+    parser.add_argument("--source-file", nargs="+", default=None, help="Chỉ tìm trong các file PDF này")
+    parser.add_argument("--page-min", type=int, default=None)
+    parser.add_argument("--page-max", type=int, default=None)
+    parser.add_argument("--chunk-type", nargs="+", default=None, choices=["text", "table"])
+    args = parser.parse_args()
+
+    try:
+        batch_query(
+            args.input,
+            args.output,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            similarity_top_k=args.similarity_top_k,
+            rerank_top_k=args.rerank_top_k,
+            answer=not args.no_answer,
+            namespaces=args.namespace,
+            filters=build_metadata_filters(args.source_file, args.page_min, args.page_max, args.chunk_type),
+            mmr_top_k=args.mmr_top_k,
+            mmr_lambda=args.mmr_lambda,
+        )
+    finally:
+        write_metrics_textfile("batch_query")
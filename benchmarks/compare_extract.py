@@ -0,0 +1,148 @@
+"""
+So sánh các extract engine (pymupdf vs pdfplumber): pages/s cho text và bảng, số trang đi qua
+từng đường (pymupdf / pdfplumber / OCR), và chất lượng text so với engine tham chiếu (pdfplumber).
+
+Chất lượng:
+    word_f1       - F1 trên bag-of-words của từng trang (nội dung có bị mất/thừa không)
+    order_ratio   - difflib ratio trên chuỗi từ (thứ tự đọc có giữ được không)
+    tables        - số bảng tìm được
+
+Ví dụ:
+    python benchmarks/compare_extract.py --docs 2 --pages 50
+    python benchmarks/compare_extract.py --pdf data/a.pdf data/b.pdf --real-ocr
+"""
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import difflib
+from collections import Counter
+from datetime import datetime
+from typing import List, Dict, Any
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import FakeTesseract, _Service
+from synthetic_pdf import generate_corpus
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] - %(message)s")
+logger = logging.getLogger(__name__)
+
+REFERENCE_ENGINE = "pdfplumber"
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+def _words(text: str) -> List[str]:
+    return _WORD_RE.findall(text.lower())
+
+def word_f1(candidate: str, reference: str) -> float:
+    cand, ref = Counter(_words(candidate)), Counter(_words(reference))
+    if not cand and not ref:
+        return 1.0
+    overlap = sum((cand & ref).values())
+    if not overlap:
+        return 0.0
+    precision, recall = overlap / sum(cand.values()), overlap / sum(ref.values())
+    return 2 * precision * recall / (precision + recall)
+
+def order_ratio(candidate: str, reference: str) -> float:
+    return difflib.SequenceMatcher(None, _words(candidate), _words(reference), autojunk=False).ratio()
+
+def run_engine(pdf_paths: List[str], engine: str) -> Dict[str, Any]:
+    """Extract text + bảng của mọi PDF bằng một engine (tắt cache extract và OCR, tuần tự để đo đúng)"""
+    import extract
+
+    pages: Dict[tuple, str] = {}
+    routes: Counter = Counter()
+    text_s = tables_s = 0.0
+    n_tables = 0
+    for path in pdf_paths:
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.perf_counter()
+            docs = extract.extract_text_with_fallback(
+                path, output_txt=os.path.join(tmp, "out.txt"), cache_dir=None, workers=1, engine=engine,
+                ocr_cache_dir=None,
+            )
+            text_s += time.perf_counter() - start
+        for doc in docs:
+            pages[(path, doc["page_labels"][0])] = doc["text"]
+        # Đếm đường đi từng trang bằng đúng logic của worker
+        with extract.fitz.open(path) as pdf:
+            total = pdf.page_count
+        for result in extract._extract_page_range(path, 1, total, engine, ocr_cache_dir=None):
+            routes[result["engine"]] += 1
+        start = time.perf_counter()
+        n_tables += len(extract.extract_tables_from_pdf(path, cache_dir=None, engine=engine))
+        tables_s += time.perf_counter() - start
+    n_pages = len(pages)
+    return {
+        "pages": n_pages,
+        "routes": dict(routes),
+        "text_seconds": round(text_s, 3),
+        "text_pages_per_s": round(n_pages / text_s, 2) if text_s else 0.0,
+        "tables_seconds": round(tables_s, 3),
+        "tables_pages_per_s": round(n_pages / tables_s, 2) if tables_s else 0.0,
+        "tables": n_tables,
+        "_pages": pages,
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="So sánh tốc độ và chất lượng các extract engine")
+    parser.add_argument("--pdf", nargs="*", help="PDF thật để so sánh (mặc định sinh corpus tổng hợp)")
+    parser.add_argument("--docs", type=int, default=2)
+    parser.add_argument("--pages", type=int, default=30, help="Số trang mỗi PDF tổng hợp")
+    parser.add_argument("--ocr-latency-ms", type=float, default=0.0)
+    parser.add_argument("--real-ocr", action="store_true", help="Dùng Tesseract thật thay vì fake")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="File JSON kết quả (mặc định benchmarks/results/extract_<timestamp>.json)")
+    args = parser.parse_args()
+
+    import extract
+
+    if not args.real_ocr:
+        extract.pytesseract = FakeTesseract(_Service("ocr", args.ocr_latency_ms, 0.0, args.seed))
+
+    with tempfile.TemporaryDirectory(prefix="rag_extract_bench_") as workdir:
+        pdf_paths = args.pdf or list(
+            generate_corpus(os.path.join(workdir, "data"), docs=args.docs, pages_per_doc=args.pages, seed=args.seed)
+        )
+        runs = {engine: run_engine(pdf_paths, engine) for engine in extract.EXTRACT_ENGINES}
+
+    reference = runs[REFERENCE_ENGINE].pop("_pages")
+    for engine, run in runs.items():
+        pages = run.pop("_pages", reference)
+        f1 = [word_f1(pages.get(key, ""), ref) for key, ref in reference.items()]
+        ratio = [order_ratio(pages.get(key, ""), ref) for key, ref in reference.items()]
+        run["quality_vs_" + REFERENCE_ENGINE] = {
+            "word_f1_mean": round(sum(f1) / len(f1), 4) if f1 else 0.0,
+            "word_f1_min": round(min(f1), 4) if f1 else 0.0,
+            "order_ratio_mean": round(sum(ratio) / len(ratio), 4) if ratio else 0.0,
+        }
+        speedup = runs[REFERENCE_ENGINE]["text_seconds"] / run["text_seconds"] if run["text_seconds"] else 0.0
+        logger.info(
+            f"📊 {engine:10s} text {run['text_pages_per_s']:8.2f} trang/s (x{speedup:.1f}), "
+            f"bảng {run['tables_pages_per_s']:8.2f} trang/s, {run['tables']} bảng, "
+            f"F1={run['quality_vs_' + REFERENCE_ENGINE]['word_f1_mean']:.4f}, routes={run['routes']}"
+        )
+
+    results = {
+        "timestamp": datetime.now().isoformat(),
+        "config": vars(args),
+        "engines": runs,
+    }
+    output = args.output or os.path.join(
+        ROOT_DIR, "benchmarks", "results", f"extract_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    logger.info(f"✅ Đã ghi kết quả so sánh vào: {output}")
+    print(json.dumps(runs, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,351 @@
+"""
+Stand-in cục bộ, deterministic cho OpenAI embeddings/LLM, Pinecone, Cohere và Tesseract.
+Mỗi fake có latency cấu hình được và tỉ lệ lỗi (failure injection) để benchmark offline.
+"""
+import re
+import math
+import time
+import random
+import hashlib
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+from llama_index.core import Settings
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.llms import CustomLLM, CompletionResponse, CompletionResponseGen, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+from pinecone.models.vectors.responses import ListResponse, ListItem, Pagination
+
+@dataclass
+class FakeConfig:
+    """Latency (ms) và tỉ lệ lỗi cho từng service giả lập"""
+    embed_latency_ms: float = 50.0
+    llm_latency_ms: float = 400.0
+    pinecone_latency_ms: float = 30.0
+    rerank_latency_ms: float = 120.0
+    ocr_latency_ms: float = 800.0
+    failure_rate: float = 0.0
+    # Giới hạn requests/phút phía "server" cho mỗi service (0 = không giới hạn) → trả 429 khi vượt
+    server_rpm: float = 0.0
+    dimension: int = 1536
+    seed: int = 42
+
+class InjectedFailure(RuntimeError):
+    """Lỗi giả lập (tương đương 429/5xx từ API thật)"""
+
+class FakeRateLimitError(RuntimeError):
+    """429 giả lập khi vượt server_rpm"""
+    status_code = 429
+
+class _Service:
+    """Latency + failure injection dùng chung cho mọi fake"""
+
+    def __init__(self, name: str, latency_ms: float, failure_rate: float, seed: int, server_rpm: float = 0.0):
+        self.name = name
+        self.latency_s = latency_ms / 1000.0
+        self.failure_rate = failure_rate
+        self.server_rpm = server_rpm
+        self._rng = random.Random(f"{seed}-{name}")
+        self._lock = threading.Lock()
+        self._window: List[float] = []
+        self.calls = 0
+        self.failures = 0
+        self.throttled = 0
+
+    def call(self):
+        with self._lock:
+            self.calls += 1
+            if self.server_rpm:
+                # Cửa sổ trượt 1 giây, tương đương server_rpm / 60 request mỗi giây
+                now = time.monotonic()
+                self._window = [t for t in self._window if now - t < 1.0]
+                if len(self._window) >= max(1, int(self.server_rpm / 60.0)):
+                    self.throttled += 1
+                    raise FakeRateLimitError(f"{self.name}: 429 Too Many Requests")
+                self._window.append(now)
+            fail = self._rng.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        if fail:
+            raise InjectedFailure(f"{self.name}: injected failure (429 Too Many Requests)")
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+def hashed_embedding(text: str, dimension: int) -> List[float]:
+    """Bag-of-words băm vào `dimension` bucket rồi chuẩn hóa L2 → similarity có ý nghĩa, deterministic"""
+    vec = [0.0] * dimension
+    for token in _TOKEN_RE.findall(text.lower()):
+        h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+        vec[h % dimension] += 1.0 if (h >> 63) & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+# ----------- OpenAI Embedding -----------
+class FakeEmbedding(BaseEmbedding):
+    """Thay thế OpenAIEmbedding: một round trip (latency) cho mỗi lần gọi, kể cả gọi batch"""
+
+    dimension: int = 1536
+    _service: Any = PrivateAttr()
+
+    def __init__(self, service: _Service, dimension: int = 1536, **kwargs: Any):
+        super().__init__(model_name="fake-embedding", dimension=dimension, **kwargs)
+        self._service = service
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        self._service.call()
+        return hashed_embedding(query, self.dimension)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        self._service.call()
+        return hashed_embedding(text, self.dimension)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        self._service.call()
+        return [hashed_embedding(t, self.dimension) for t in texts]
+
+# ----------- OpenAI LLM -----------
+class FakeLLM(CustomLLM):
+    """Thay thế OpenAI LLM: sinh paraphrase cho QueryFusionRetriever và câu trả lời cố định"""
+
+    _service: Any = PrivateAttr()
+
+    def __init__(self, service: _Service, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._service = service
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name="fake-llm")
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        self._service.call()
+        match = re.search(r"Query:\s*(.+)", prompt)
+        if match and "Queries:" in prompt:
+            query = match.group(1).strip()
+            return CompletionResponse(text="\n".join(f"{query} (cách hỏi {i})" for i in range(1, 4)))
+        words = _TOKEN_RE.findall(prompt)
+        return CompletionResponse(text="Câu trả lời giả lập: " + " ".join(words[:40]))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        response = self.complete(prompt, formatted=formatted, **kwargs)
+        yield response
+
+# ----------- Pinecone -----------
+_FILTER_OPS = {
+    "$eq": lambda a, b: a == b,
+    "$ne": lambda a, b: a != b,
+    "$gt": lambda a, b: a is not None and a > b,
+    "$gte": lambda a, b: a is not None and a >= b,
+    "$lt": lambda a, b: a is not None and a < b,
+    "$lte": lambda a, b: a is not None and a <= b,
+    "$in": lambda a, b: a in b,
+    "$nin": lambda a, b: a not in b,
+}
+
+def matches_filter(metadata: Dict[str, Any], flt: Dict[str, Any]) -> bool:
+    """Đánh giá filter metadata theo cú pháp Pinecone ($and/$or, $eq, $in, $gte, ...)"""
+    for key, cond in (flt or {}).items():
+        if key == "$and":
+            if not all(matches_filter(metadata, sub) for sub in cond):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, sub) for sub in cond):
+                return False
+        elif isinstance(cond, dict):
+            if not all(_FILTER_OPS[op](metadata.get(key), value) for op, value in cond.items()):
+                return False
+        elif metadata.get(key) != cond:
+            return False
+    return True
+
+class FakePineconeIndex:
+    """Brute-force cosine search trong bộ nhớ, hỗ trợ namespace"""
+
+    def __init__(self, service: _Service):
+        self._service = service
+        self._lock = threading.Lock()
+        self.namespaces: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.dimension = None
+
+    def upsert(self, vectors: List[Dict[str, Any]], namespace: str = "", **kwargs):
+        self._service.call()
+        with self._lock:
+            store = self.namespaces.setdefault(namespace, {})
+            for v in vectors:
+                store[v["id"]] = {"values": list(v["values"]), "metadata": dict(v.get("metadata") or {})}
+        return SimpleNamespace(upserted_count=len(vectors))
+
+    def query(self, vector: List[float], top_k: int = 10, namespace: str = "", include_values: bool = False,
+              include_metadata: bool = False, filter: Dict[str, Any] = None, **kwargs):
+        self._service.call()
+        with self._lock:
+            items = list(self.namespaces.get(namespace, {}).items())
+        scored = []
+        for vid, item in items:
+            if filter and not matches_filter(item["metadata"], filter):
+                continue
+            score = sum(a * b for a, b in zip(vector, item["values"]))
+            scored.append((score, vid, item))
+        scored.sort(key=lambda x: x[0], reverse=True)
+        matches = [
+            SimpleNamespace(
+                id=vid,
+                score=score,
+                values=item["values"] if include_values else [],
+                metadata=item["metadata"] if include_metadata else {},
+                sparse_values=None,
+            )
+            for score, vid, item in scored[:top_k]
+        ]
+        return SimpleNamespace(matches=matches, namespace=namespace)
+
+    def list(self, namespace: str = "", limit: int = 100, prefix: str = "", **kwargs):
+        """Giống Index.list của Pinecone SDK: sinh từng trang ListResponse (vectors = [ListItem(id=...)])"""
+        with self._lock:
+            ids = sorted(vid for vid in self.namespaces.get(namespace, {}) if vid.startswith(prefix))
+        for start in range(0, len(ids), limit):
+            self._service.call()
+            more = start + limit < len(ids)
+            yield ListResponse(
+                vectors=[ListItem(id=vid) for vid in ids[start:start + limit]],
+                pagination=Pagination(next=str(start + limit)) if more else None,
+                namespace=namespace,
+            )
+
+    def fetch(self, ids: List[str], namespace: str = "", **kwargs):
+        self._service.call()
+        with self._lock:
+            store = self.namespaces.get(namespace, {})
+            vectors = {
+                vid: SimpleNamespace(id=vid, values=list(store[vid]["values"]), metadata=dict(store[vid]["metadata"]))
+                for vid in ids if vid in store
+            }
+        return SimpleNamespace(vectors=vectors, namespace=namespace)
+
+    def describe_index_stats(self, **kwargs):
+        with self._lock:
+            return {"namespaces": {ns: {"vector_count": len(v)} for ns, v in self.namespaces.items()}}
+
+    def vector_count(self, namespace: str) -> int:
+        with self._lock:
+            return len(self.namespaces.get(namespace, {}))
+
+class FakePinecone:
+    """Thay thế pinecone.Pinecone; mọi client dùng chung một registry index trong process"""
+
+    _indexes: Dict[str, FakePineconeIndex] = {}
+    _service: _Service = None
+
+    def __init__(self, api_key: str = None, **kwargs):
+        pass
+
+    def list_indexes(self):
+        names = list(self._indexes.keys())
+        return SimpleNamespace(names=lambda: names)
+
+    def create_index(self, name: str, dimension: int, metric: str = "cosine", **kwargs):
+        self._indexes.setdefault(name, FakePineconeIndex(self._service)).dimension = dimension
+
+    def describe_index(self, name: str):
+        return SimpleNamespace(name=name, dimension=self._indexes[name].dimension)
+
+    def Index(self, name: str, **kwargs) -> FakePineconeIndex:
+        return self._indexes.setdefault(name, FakePineconeIndex(self._service))
+
+# ----------- Cohere -----------
+class FakeCohereClient:
+    """Thay thế cohere.Client: rerank theo tỉ lệ token trùng với query"""
+
+    _service: _Service = None
+
+    def __init__(self, api_key: str = None, **kwargs):
+        pass
+
+    def rerank(self, query: str, documents: List[str], top_n: int = 5, model: str = None, **kwargs):
+        self._service.call()
+        q_tokens = set(_TOKEN_RE.findall(query.lower()))
+        results = []
+        for i, doc in enumerate(documents):
+            d_tokens = set(_TOKEN_RE.findall(doc.lower()))
+            score = len(q_tokens & d_tokens) / (len(q_tokens) or 1)
+            results.append(SimpleNamespace(index=i, relevance_score=score))
+        results.sort(key=lambda r: r.relevance_score, reverse=True)
+        return SimpleNamespace(results=results[:top_n])
+
+# ----------- Tesseract -----------
+class FakeTesseract:
+    """Thay thế module pytesseract: trả về text cố định sau `ocr_latency_ms`"""
+
+    def __init__(self, service: _Service):
+        self._service = service
+
+    def image_to_string(self, image, lang: str = None, **kwargs) -> str:
+        self._service.call()
+        return f"Văn bản OCR giả lập cho ảnh {image.width}x{image.height}"
+
+@contextmanager
+def install_fakes(config: FakeConfig, fake_ocr: bool = True):
+    """
+    Thay các client thật trong extract/transform/load/main bằng fake trong phạm vi `with`.
+    Yields:
+        Dict[str, _Service]: bộ đếm calls/failures theo service
+    """
+    import extract
+    import embedding
+    import load
+    import main
+
+    services = {
+        "embedding": _Service("embedding", config.embed_latency_ms, config.failure_rate, config.seed, config.server_rpm),
+        "llm": _Service("llm", config.llm_latency_ms, config.failure_rate, config.seed, config.server_rpm),
+        "pinecone": _Service("pinecone", config.pinecone_latency_ms, config.failure_rate, config.seed, config.server_rpm),
+        "rerank": _Service("rerank", config.rerank_latency_ms, config.failure_rate, config.seed, config.server_rpm),
+        "ocr": _Service("ocr", config.ocr_latency_ms, 0.0, config.seed),
+    }
+    FakePinecone._indexes = {}
+    FakePinecone._service = services["pinecone"]
+    FakeCohereClient._service = services["rerank"]
+
+    def embedding_factory(*args, **kwargs):
+        # Giữ embed_batch_size/dimensions như client thật để số round trip và kích thước vector đúng
+        return FakeEmbedding(
+            services["embedding"],
+            dimension=kwargs.get("dimensions") or config.dimension,
+            embed_batch_size=kwargs.get("embed_batch_size", 100),
+        )
+
+    def llm_factory(*args, **kwargs):
+        return FakeLLM(services["llm"])
+
+    patches = [
+        (embedding, "OpenAIEmbedding", embedding_factory),
+        (load, "Pinecone", FakePinecone),
+        (main, "OpenAI", llm_factory),
+        (main, "pinecone", SimpleNamespace(Pinecone=FakePinecone)),
+        (main, "cohere", SimpleNamespace(Client=FakeCohereClient)),
+    ]
+    if fake_ocr:
+        patches.append((extract, "pytesseract", FakeTesseract(services["ocr"])))
+
+    originals = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    original_llm = Settings._llm
+    for module, name, value in patches:
+        setattr(module, name, value)
+    Settings.llm = llm_factory()
+    try:
+        yield services
+    finally:
+        for module, name, value in originals:
+            setattr(module, name, value)
+        Settings._llm = original_llm
@@ -0,0 +1,112 @@
+"""
+Đo thời gian khởi động (cold start) của các entry point và module import nặng nhất.
+Mỗi entry point được import trong một process mới với `python -X importtime`, lặp lại --runs lần.
+
+Ví dụ:
+    python benchmarks/import_profile.py
+    python benchmarks/import_profile.py --entry main app --runs 5 --top 15
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import statistics
+import subprocess
+from datetime import datetime
+from typing import List, Dict, Any
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] - %(message)s")
+logger = logging.getLogger(__name__)
+
+ENTRY_POINTS = {
+    "main": "import main",
+    "app": "import app",
+    "pipeline": "import sys; sys.path.insert(0, 'src'); import pipeline",
+    "batch_query": "import batch_query",
+}
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    """Parse output `-X importtime`: 'import time: self [us] | cumulative | module'"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+            modules.append({
+                # Bỏ 1 khoảng trắng sau "|"; phần thụt lề còn lại thể hiện độ sâu trong cây import
+                "module": name.rstrip()[1:],
+                "self_ms": int(self_us) / 1000.0,
+                "cumulative_ms": int(cumulative_us) / 1000.0,
+            })
+        except ValueError:
+            continue
+    return modules
+
+def profile_entry(code: str, runs: int, top: int) -> Dict[str, Any]:
+    wall_ms = []
+    modules: List[Dict[str, Any]] = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=ROOT_DIR, capture_output=True, text=True,
+        )
+        wall_ms.append((time.perf_counter() - start) * 1000.0)
+        if proc.returncode != 0:
+            error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "unknown error"
+            return {"error": error}
+        modules = parse_importtime(proc.stderr)
+    # Module top-level (không thụt lề) và các import trực tiếp của chúng (thụt 2 khoảng trắng)
+    top_level = [m for m in modules if not m["module"].startswith(" ")]
+    direct = [m for m in modules if m["module"].startswith("  ") and not m["module"].startswith("   ")]
+    heaviest = sorted(modules, key=lambda m: m["self_ms"], reverse=True)[:top]
+    return {
+        "wall_ms_median": round(statistics.median(wall_ms), 1),
+        "wall_ms_min": round(min(wall_ms), 1),
+        "import_ms": round(sum(m["cumulative_ms"] for m in top_level), 1),
+        "modules_loaded": len(modules),
+        "direct_imports": sorted(
+            ({"module": m["module"].strip(), "cumulative_ms": round(m["cumulative_ms"], 1)} for m in direct),
+            key=lambda m: m["cumulative_ms"], reverse=True,
+        )[:top],
+        "heaviest_self": [
+            {"module": m["module"].strip(), "self_ms": round(m["self_ms"], 1)} for m in heaviest
+        ],
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Profile thời gian import của các entry point")
+    parser.add_argument("--entry", nargs="+", default=list(ENTRY_POINTS), choices=list(ENTRY_POINTS))
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--output", default=None, help="File JSON kết quả (mặc định benchmarks/results/import_<timestamp>.json)")
+    args = parser.parse_args()
+
+    results = {"timestamp": datetime.now().isoformat(), "python": sys.version.split()[0], "entries": {}}
+    for name in args.entry:
+        report = profile_entry(ENTRY_POINTS[name], args.runs, args.top)
+        results["entries"][name] = report
+        if "error" in report:
+            logger.warning(f"⚠️ {name}: import lỗi ({report['error']})")
+            continue
+        heaviest = ", ".join(f"{m['module']} {m['cumulative_ms']:.0f}ms" for m in report["direct_imports"][:3])
+        logger.info(
+            f"⏱️ {name:12s} cold start {report['wall_ms_median']:7.1f} ms (import {report['import_ms']:.1f} ms, "
+            f"{report['modules_loaded']} modules) - nặng nhất: {heaviest}"
+        )
+
+    output = args.output or os.path.join(
+        ROOT_DIR, "benchmarks", "results", f"import_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    logger.info(f"✅ Đã ghi import profile vào: {output}")
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,221 @@
+"""
+Benchmark offline cho ETL throughput và query latency.
+Dùng fake cho OpenAI/Pinecone/Cohere/Tesseract (benchmarks/fakes.py) và PDF tổng hợp (benchmarks/synthetic_pdf.py).
+
+Ví dụ:
+    python benchmarks/run_benchmarks.py --docs 3 --pages 20 --queries 50 --failure-rate 0.02
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+from typing import List, Dict, Any
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import FakeConfig, install_fakes, FakePinecone
+from synthetic_pdf import generate_corpus, _VOCAB
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] - %(message)s")
+logger = logging.getLogger(__name__)
+
+BENCH_NAMESPACE = "bench"
+
+def percentile(values: List[float], pct: float) -> float:
+    """Percentile theo nearest-rank (values không cần sort trước)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100.0 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+def latency_summary(latencies_s: List[float]) -> Dict[str, float]:
+    ms = [x * 1000.0 for x in latencies_s]
+    return {
+        "count": len(ms),
+        "mean_ms": round(sum(ms) / len(ms), 2) if ms else 0.0,
+        "p50_ms": round(percentile(ms, 50), 2),
+        "p95_ms": round(percentile(ms, 95), 2),
+        "p99_ms": round(percentile(ms, 99), 2),
+        "max_ms": round(max(ms), 2) if ms else 0.0,
+    }
+
+def bench_etl(workdir: str, docs: int, pages: int, max_tokens: int, seed: int) -> Dict[str, Any]:
+    """Chạy pipeline_etl trên corpus tổng hợp, đo pages/s và chunks/s"""
+    import pipeline
+
+    corpus = generate_corpus(os.path.join(workdir, "data"), docs=docs, pages_per_doc=pages, seed=seed)
+    page_kinds: Dict[str, int] = {}
+    for counts in corpus.values():
+        for kind, n in counts.items():
+            page_kinds[kind] = page_kinds.get(kind, 0) + n
+
+    # Đếm số chunks thực sự được đẩy sang bước load
+    uploaded = {"chunks": 0}
+    original_upsert = pipeline.upsert_chunks_to_pinecone
+
+    def counting_upsert(chunks, **kwargs):
+        uploaded["chunks"] += len(chunks)
+        return original_upsert(chunks, **kwargs)
+
+    pipeline.upsert_chunks_to_pinecone = counting_upsert
+    try:
+        start = time.perf_counter()
+        pipeline.pipeline_etl(pdf_paths=list(corpus.keys()), max_tokens=max_tokens, namespace=BENCH_NAMESPACE)
+        elapsed = time.perf_counter() - start
+    finally:
+        pipeline.upsert_chunks_to_pinecone = original_upsert
+
+    total_pages = sum(page_kinds.values())
+    return {
+        "docs": docs,
+        "pages": total_pages,
+        "page_kinds": page_kinds,
+        "chunks": uploaded["chunks"],
+        "seconds": round(elapsed, 3),
+        "pages_per_s": round(total_pages / elapsed, 3) if elapsed else 0.0,
+        "chunks_per_s": round(uploaded["chunks"] / elapsed, 3) if elapsed else 0.0,
+    }
+
+def bench_query(
+    n_queries: int, similarity_top_k: int, rerank_top_k: int, seed: int, mmr_top_k: int = 0, tier: str = "thorough"
+) -> Dict[str, Any]:
+    """Chạy tuần tự retrieve (theo tier) + rag_agent_answer, đo p50/p95/p99, QPS và số query theo path"""
+    import main
+    import pipeline
+
+    rng = random.Random(seed)
+    queries = [" ".join(rng.choice(_VOCAB) for _ in range(rng.randint(3, 12))) for _ in range(n_queries)]
+
+    retrieve_lat, answer_lat, total_lat = [], [], []
+    path_lat: Dict[str, List[float]] = {}
+    errors = 0
+    original_index_name = main.INDEX_NAME
+    # main đọc tên index từ env, pipeline ghi vào INDEX_NAME cố định → query đúng index mà bench_etl vừa ghi
+    main.INDEX_NAME = pipeline.INDEX_NAME
+    try:
+        start_all = time.perf_counter()
+        for q in queries:
+            t0 = time.perf_counter()
+            try:
+                nodes, route = main.retrieve_with_route(
+                    q, similarity_top_k=similarity_top_k, rerank_top_k=rerank_top_k, namespaces=BENCH_NAMESPACE,
+                    mmr_top_k=mmr_top_k, tier=tier,
+                )
+                t1 = time.perf_counter()
+                main.rag_agent_answer(q, nodes)
+                t2 = time.perf_counter()
+            except Exception as e:
+                errors += 1
+                logger.warning(f"⚠️ Query lỗi: {e}")
+                continue
+            retrieve_lat.append(t1 - t0)
+            answer_lat.append(t2 - t1)
+            total_lat.append(t2 - t0)
+            path_lat.setdefault(route["path"], []).append(t1 - t0)
+        elapsed = time.perf_counter() - start_all
+    finally:
+        main.INDEX_NAME = original_index_name
+
+    return {
+        "queries": n_queries,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "qps": round(len(total_lat) / elapsed, 3) if elapsed else 0.0,
+        "retrieve": latency_summary(retrieve_lat),
+        "answer": latency_summary(answer_lat),
+        "end_to_end": latency_summary(total_lat),
+        "tier": tier,
+        "paths": {path: {"queries": len(lat), "retrieve": latency_summary(lat)} for path, lat in sorted(path_lat.items())},
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Offline benchmark cho ETL và query")
+    parser.add_argument("--docs", type=int, default=2)
+    parser.add_argument("--pages", type=int, default=10, help="Số trang mỗi PDF")
+    parser.add_argument("--max-tokens", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--similarity-top-k", type=int, default=10)
+    parser.add_argument("--rerank-top-k", type=int, default=5)
+    parser.add_argument("--mmr-top-k", type=int, default=0, help="Số candidate giữ lại sau MMR trước rerank (0 = tắt)")
+    parser.add_argument("--tier", default="thorough", choices=["fast", "balanced", "thorough"],
+                        help="Tier ngân sách độ trễ của query (thorough = luôn fusion + rerank)")
+    parser.add_argument("--embed-latency-ms", type=float, default=50.0)
+    parser.add_argument("--llm-latency-ms", type=float, default=400.0)
+    parser.add_argument("--pinecone-latency-ms", type=float, default=30.0)
+    parser.add_argument("--rerank-latency-ms", type=float, default=120.0)
+    parser.add_argument("--ocr-latency-ms", type=float, default=800.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--server-rpm", type=float, default=0.0, help="Giới hạn requests/phút của fake service (trả 429 khi vượt)")
+    parser.add_argument("--real-ocr", action="store_true", help="Dùng Tesseract thật thay vì fake")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skip-etl", action="store_true")
+    parser.add_argument("--skip-query", action="store_true")
+    parser.add_argument("--output", default=None, help="File JSON kết quả (mặc định benchmarks/results/<timestamp>.json)")
+    args = parser.parse_args()
+
+    config = FakeConfig(
+        embed_latency_ms=args.embed_latency_ms,
+        llm_latency_ms=args.llm_latency_ms,
+        pinecone_latency_ms=args.pinecone_latency_ms,
+        rerank_latency_ms=args.rerank_latency_ms,
+        ocr_latency_ms=args.ocr_latency_ms,
+        failure_rate=args.failure_rate,
+        server_rpm=args.server_rpm,
+        seed=args.seed,
+    )
+    output = args.output or os.path.join(
+        ROOT_DIR, "benchmarks", "results", f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+
+    results: Dict[str, Any] = {
+        "timestamp": datetime.now().isoformat(),
+        "config": {**vars(args), "output": output},
+        "environment": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+    }
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="rag_bench_") as workdir, install_fakes(config, fake_ocr=not args.real_ocr) as services:
+        # pipeline ghi output/ theo đường dẫn tương đối → chạy trong thư mục tạm
+        os.chdir(workdir)
+        try:
+            if not args.skip_etl:
+                logger.info("🚀 Benchmark ETL...")
+                results["etl"] = bench_etl(workdir, args.docs, args.pages, args.max_tokens, args.seed)
+            if not args.skip_query:
+                import pipeline
+                index = FakePinecone().Index(pipeline.INDEX_NAME)
+                if not index.vector_count(BENCH_NAMESPACE):
+                    logger.warning("⚠️ Namespace benchmark rỗng (đã bỏ qua ETL?) → kết quả query không có ý nghĩa")
+                logger.info("🚀 Benchmark query...")
+                results["query"] = bench_query(
+                    args.queries, args.similarity_top_k, args.rerank_top_k, args.seed, mmr_top_k=args.mmr_top_k,
+                    tier=args.tier,
+                )
+        finally:
+            os.chdir(cwd)
+        results["service_calls"] = {
+            name: {"calls": s.calls, "failures": s.failures, "throttled": s.throttled} for name, s in services.items()
+        }
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    logger.info(f"✅ Đã ghi kết quả benchmark vào: {output}")
+    print(json.dumps({k: results.get(k) for k in ("etl", "query")}, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,91 @@
+"""
+Sinh PDF tổng hợp cho benchmark: trang text, trang có bảng kẻ ô và trang scan (chỉ có ảnh, không có text layer).
+"""
+import os
+import random
+from typing import List, Dict
+
+import fitz  # PyMuPDF
+
+PAGE_KINDS = ("text", "table", "scanned")
+
+_VOCAB = (
+    "bảo hiểm hưu trí doanh nghiệp quyền lợi phí đóng hợp đồng người được bảo hiểm thời hạn "
+    "chi trả tử vong thương tật sức khỏe quỹ đầu tư lãi suất cam kết thuế thu nhập nhân viên "
+    "giải pháp phúc lợi công ty dịch vụ khách hàng sản phẩm điều khoản miễn trừ"
+).split()
+
+def _paragraphs(rng: random.Random, n_paragraphs: int = 4, words_per_paragraph: int = 80) -> List[str]:
+    paragraphs = []
+    for _ in range(n_paragraphs):
+        words = [rng.choice(_VOCAB) for _ in range(words_per_paragraph)]
+        sentences = [" ".join(words[i:i + 12]).capitalize() + "." for i in range(0, len(words), 12)]
+        paragraphs.append(" ".join(sentences))
+    return paragraphs
+
+def _draw_text_page(page: fitz.Page, rng: random.Random, page_num: int):
+    page.insert_text((50, 50), f"Tài liệu benchmark - Trang {page_num}", fontsize=14)
+    rect = fitz.Rect(50, 80, page.rect.width - 50, page.rect.height - 50)
+    page.insert_textbox(rect, "\n\n".join(_paragraphs(rng)), fontsize=10)
+
+def _draw_table_page(page: fitz.Page, rng: random.Random, page_num: int, rows: int = 8, cols: int = 4):
+    page.insert_text((50, 50), f"Bảng quyền lợi - Trang {page_num}", fontsize=14)
+    x0, y0, cell_w, cell_h = 50, 80, 120, 24
+    for r in range(rows + 1):
+        page.draw_line((x0, y0 + r * cell_h), (x0 + cols * cell_w, y0 + r * cell_h))
+    for c in range(cols + 1):
+        page.draw_line((x0 + c * cell_w, y0), (x0 + c * cell_w, y0 + rows * cell_h))
+    for r in range(rows):
+        for c in range(cols):
+            text = f"Cột {c + 1}" if r == 0 else f"{rng.choice(_VOCAB)} {rng.randint(1, 999)}"
+            page.insert_text((x0 + c * cell_w + 4, y0 + r * cell_h + 16), text, fontsize=9)
+
+def _draw_scanned_page(page: fitz.Page, rng: random.Random, page_num: int):
+    # Render một trang text ra ảnh rồi chèn ảnh vào → trang không có text layer
+    tmp = fitz.open()
+    tmp_page = tmp.new_page()
+    _draw_text_page(tmp_page, rng, page_num)
+    pix = tmp_page.get_pixmap(dpi=150)
+    page.insert_image(page.rect, stream=pix.tobytes("png"))
+    tmp.close()
+
+def generate_pdf(path: str, pages: int, mix: Dict[str, float] = None, seed: int = 0) -> Dict[str, int]:
+    """
+    Sinh một file PDF tổng hợp
+    Args:
+        path: Đường dẫn file output
+        pages: Số trang
+        mix: Tỉ lệ các loại trang, ví dụ {"text": 0.7, "table": 0.2, "scanned": 0.1}
+        seed: Seed để kết quả deterministic
+    Returns:
+        Dict: số trang theo từng loại
+    """
+    mix = mix or {"text": 0.7, "table": 0.2, "scanned": 0.1}
+    rng = random.Random(seed)
+    kinds = list(mix.keys())
+    weights = [mix[k] for k in kinds]
+    counts = {k: 0 for k in PAGE_KINDS}
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    doc = fitz.open()
+    for page_num in range(1, pages + 1):
+        kind = rng.choices(kinds, weights=weights)[0]
+        page = doc.new_page()
+        if kind == "table":
+            _draw_table_page(page, rng, page_num)
+        elif kind == "scanned":
+            _draw_scanned_page(page, rng, page_num)
+        else:
+            _draw_text_page(page, rng, page_num)
+        counts[kind] += 1
+    doc.save(path)
+    doc.close()
+    return counts
+
+def generate_corpus(out_dir: str, docs: int, pages_per_doc: int, mix: Dict[str, float] = None, seed: int = 0) -> Dict[str, Dict[str, int]]:
+    """Sinh `docs` file PDF trong `out_dir`; trả về {path: số trang theo loại}"""
+    corpus = {}
+    for i in range(docs):
+        path = os.path.join(out_dir, f"synthetic_{i:03d}.pdf")
+        corpus[path] = generate_pdf(path, pages_per_doc, mix=mix, seed=seed + i)
+    return corpus
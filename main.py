@@ -2,21 +2,56 @@
 
 import logging
 import os
+import sys
+from typing import List, Optional, Union
 from dotenv import load_dotenv
-import pinecone
-import cohere
-from llama_index.embeddings.openai import OpenAIEmbedding
-from llama_index.vector_stores.pinecone import PineconeVectorStore
-from llama_index.core import StorageContext, VectorStoreIndex
-from llama_index.core.schema import NodeWithScore
-from llama_index.core.retrievers import VectorIndexRetriever, QueryFusionRetriever
-from llama_index.llms.openai import OpenAI
 
+sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
+from lazy import lazy_import, warm_up
+from tracing import span, count_items, record_token_usage, trace_context, registry, write_metrics_textfile
+from docstore import hydrate_nodes
+from ratelimit import RateLimitedIndex, rate_limited_call, estimate_tokens
+
+# SDK/llama_index chỉ được import khi dùng lần đầu → khởi động nhanh (xem benchmarks/import_profile.py)
+pinecone = lazy_import("pinecone")
+cohere = lazy_import("cohere")
+PineconeVectorStore = lazy_import("llama_index.vector_stores.pinecone", "PineconeVectorStore")
+StorageContext = lazy_import("llama_index.core", "StorageContext")
+VectorStoreIndex = lazy_import("llama_index.core", "VectorStoreIndex")
+NodeWithScore = lazy_import("llama_index.core.schema", "NodeWithScore")
+BaseRetriever = lazy_import("llama_index.core.retrievers", "BaseRetriever")
+VectorIndexRetriever = lazy_import("llama_index.core.retrievers", "VectorIndexRetriever")
+QueryFusionRetriever = lazy_import("llama_index.core.retrievers", "QueryFusionRetriever")
+QueryBundle = lazy_import("llama_index.core.schema", "QueryBundle")
+MetadataFilters = lazy_import("llama_index.core.vector_stores", "MetadataFilters")
+MetadataFilter = lazy_import("llama_index.core.vector_stores", "MetadataFilter")
+FilterOperator = lazy_import("llama_index.core.vector_stores", "FilterOperator")
+OpenAI = lazy_import("llama_index.llms.openai", "OpenAI")
+embedding = lazy_import("embedding")
+retrieval = lazy_import("retrieval")
 
 load_dotenv()
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 INDEX_NAME = os.getenv("PINECONE_INDEX_NAME")
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
+DEFAULT_NAMESPACE = "default"
+# MMR trước rerank: giữ MMR_TOP_K candidate đa dạng (0 = tắt), MMR_LAMBDA cân bằng liên quan/đa dạng
+MMR_TOP_K = int(os.getenv("MMR_TOP_K", "0"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+
+# Tier theo ngân sách độ trễ: bỏ fusion / rerank khi top-1 dense đủ cao hoặc cách xa top-2.
+# Bỏ stage khi score top-1 >= *_score hoặc (top-1 - top-2) >= *_gap; ghi đè bằng env QUERY_TIER_<TIER>_<KEY>
+# (_ALWAYS = luôn bỏ stage, kể cả khi dense không trả kết quả; _NEVER = luôn chạy stage).
+# Mặc định "thorough" cho tới khi ngưỡng của fast/balanced được hiệu chỉnh trên dữ liệu thật.
+QUERY_TIER = os.getenv("QUERY_TIER", "thorough")
+_ALWAYS = float("-inf")
+_NEVER = float("inf")
+QUERY_TIERS = {
+    "fast": {"fusion_score": _ALWAYS, "fusion_gap": _ALWAYS, "rerank_score": 0.6, "rerank_gap": 0.08},
+    "balanced": {"fusion_score": 0.6, "fusion_gap": 0.1, "rerank_score": 0.75, "rerank_gap": 0.15},
+    "thorough": {"fusion_score": _NEVER, "fusion_gap": _NEVER, "rerank_score": _NEVER, "rerank_gap": _NEVER},
+}
+registry.describe("rag_query_path_total", "Số query theo tier và đường đi (dense / fusion, có / không rerank)")
 
 logging.basicConfig(
     level=logging.INFO,
@@ -24,11 +59,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def get_index() -> VectorStoreIndex:
+def get_index(namespace: str = DEFAULT_NAMESPACE) -> VectorStoreIndex:
     pc = pinecone.Pinecone(api_key=PINECONE_API_KEY)
-    pinecone_index = pc.Index(INDEX_NAME)
-    embed_model = OpenAIEmbedding(model="text-embedding-3-small")
-    vector_store = PineconeVectorStore(pinecone_index=pinecone_index,namespace="default")
+    # query Pinecone đi qua limiter dùng chung (requests/min, concurrency thích nghi)
+    # MatchValuesIndex giữ lại vector của match cho bước MMR
+    pinecone_index = retrieval.MatchValuesIndex(RateLimitedIndex(pc.Index(INDEX_NAME)))
+    embed_model = embedding.get_embed_model()
+    vector_store = PineconeVectorStore(pinecone_index=pinecone_index,namespace=namespace)
     storage_context = StorageContext.from_defaults(vector_store=vector_store)
     index = VectorStoreIndex.from_vector_store(
         vector_store=vector_store,
@@ -37,17 +74,94 @@ def get_index() -> VectorStoreIndex:
     )
     return index
 
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    return [value] if isinstance(value, (str, int)) else list(value)
+
+def build_metadata_filters(
+    source_files: Union[str, List[str], None] = None,
+    page_min: Optional[int] = None,
+    page_max: Optional[int] = None,
+    chunk_types: Union[str, List[str], None] = None,
+) -> Optional[MetadataFilters]:
+    """
+    Filter metadata đẩy xuống query Pinecone (chỉ chấm điểm vector thỏa điều kiện)
+    Args:
+        source_files: Tên file PDF (một hoặc nhiều)
+        page_min, page_max: Chunk giao với khoảng trang [page_min, page_max] (chunk trải page..page_end)
+        chunk_types: "text" và/hoặc "table"
+    Returns:
+        MetadataFilters hoặc None nếu không có điều kiện
+    """
+    filters = []
+    for key, values in (("source_file", _as_list(source_files)), ("chunk_type", _as_list(chunk_types))):
+        if len(values) == 1:
+            filters.append(MetadataFilter(key=key, value=values[0], operator=FilterOperator.EQ))
+        elif values:
+            filters.append(MetadataFilter(key=key, value=values, operator=FilterOperator.IN))
+    if page_min is not None:
+        filters.append(MetadataFilter(key="page_end", value=int(page_min), operator=FilterOperator.GTE))
+    if page_max is not None:
+        filters.append(MetadataFilter(key="page", value=int(page_max), operator=FilterOperator.LTE))
+    return MetadataFilters(filters=filters) if filters else None
+
+def build_retriever(
+    namespaces: Union[str, List[str], None] = None,
+    similarity_top_k: int = 10,
+    filters: Optional[MetadataFilters] = None,
+) -> BaseRetriever:
+    """Dense retriever cho một hoặc nhiều namespace (mặc định DEFAULT_NAMESPACE), có filter metadata"""
+    namespaces = _as_list(namespaces) or [DEFAULT_NAMESPACE]
+    retrievers = {
+        namespace: VectorIndexRetriever(index=get_index(namespace), similarity_top_k=similarity_top_k, filters=filters)
+        for namespace in dict.fromkeys(namespaces)
+    }
+    if len(retrievers) == 1:
+        return next(iter(retrievers.values()))
+    return retrieval.MultiNamespaceRetriever(retrievers, similarity_top_k=similarity_top_k)
+
+def diversify_candidates(nodes: list, mmr_top_k: int = MMR_TOP_K, mmr_lambda: float = MMR_LAMBDA) -> list:
+    """Gắn vector trả về từ Pinecone vào node, rồi lọc MMR còn mmr_top_k candidate (0 = giữ nguyên)"""
+    nodes = retrieval.attach_embeddings(nodes)
+    if not mmr_top_k or len(nodes) <= mmr_top_k:
+        return nodes
+    with span("mmr", candidates=len(nodes)):
+        selected = retrieval.mmr_select(nodes, mmr_top_k, lambda_mult=mmr_lambda)
+    count_items("mmr", len(nodes))
+    logger.info(f"🧮 MMR giữ {len(selected)}/{len(nodes)} candidates đa dạng trước rerank")
+    return selected
+
+def generate_queries(fusion_retriever, query: str) -> list:
+    """
+    Sinh num_queries - 1 cách hỏi khác cho query (một lần gọi LLM), như QueryFusionRetriever._get_queries
+    nhưng qua limiter openai/chat, có span "query_generation" và ghi token usage
+    """
+    num_queries = fusion_retriever.num_queries - 1
+    prompt = fusion_retriever.query_gen_prompt.format(num_queries=num_queries, query=query)
+    with span("query_generation", num_queries=num_queries):
+        response = rate_limited_call(
+            "openai", "chat", fusion_retriever._llm.complete, prompt, tokens=estimate_tokens(prompt) + 256
+        )
+    record_token_usage("query_generation", response)
+    # LLM có thể bọc code block hoặc trả nhiều dòng hơn yêu cầu → mỗi dòng một query, cắt bớt
+    queries = [q.strip() for q in response.text.strip("`").split("\n") if q.strip()]
+    return [QueryBundle(q) for q in queries[:num_queries]]
+
 def cohere_rerank(query: str, nodes: list, top_k: int = 5) -> list:
     if not nodes:
         return []
     co = cohere.Client(api_key=COHERE_API_KEY)
     docs = [n.node.get_content() for n in nodes]
-    results = co.rerank(
-        query=query,
-        documents=docs,
-        top_n=top_k,
-        model="rerank-multilingual-v3.0"
-    )
+    with span("rerank", documents=len(docs)):
+        results = rate_limited_call(
+            "cohere", "rerank", co.rerank,
+            query=query,
+            documents=docs,
+            top_n=top_k,
+            model="rerank-multilingual-v3.0"
+        )
+    count_items("rerank", len(docs))
     reranked_nodes = []
     for r in results.results:
         idx = r.index
@@ -59,9 +173,48 @@ def cohere_rerank(query: str, nodes: list, top_k: int = 5) -> list:
         )
     return reranked_nodes
 
-def multiquery_retrieve(query: str, similarity_top_k: int = 10, rerank_top_k: int = 5) -> list:
-    index = get_index()
-    dense_retriever = VectorIndexRetriever(index=index, similarity_top_k=similarity_top_k)
+def tier_thresholds(tier: str) -> dict:
+    """Ngưỡng bỏ fusion/rerank của tier (QUERY_TIERS + env QUERY_TIER_<TIER>_<KEY>)"""
+    if tier not in QUERY_TIERS:
+        raise ValueError(f"Query tier không hỗ trợ: {tier} (chọn một trong {tuple(QUERY_TIERS)})")
+    return {
+        key: float(os.getenv(f"QUERY_TIER_{tier.upper()}_{key.upper()}", default))
+        for key, default in QUERY_TIERS[tier].items()
+    }
+
+def _confident(nodes: list, score_threshold: float, gap_threshold: float) -> tuple:
+    """(đủ tự tin để bỏ stage?, top-1, khoảng cách top-1 với top-2)"""
+    scores = sorted((n.score or 0.0 for n in nodes), reverse=True)
+    if not scores:
+        return score_threshold == _ALWAYS, 0.0, 0.0
+    top1 = scores[0]
+    gap = top1 - scores[1] if len(scores) > 1 else 0.0
+    return top1 >= score_threshold or gap >= gap_threshold, top1, gap
+
+def retrieve_with_route(
+    query: str,
+    similarity_top_k: int = 10,
+    rerank_top_k: int = 5,
+    namespaces: Union[str, List[str], None] = None,
+    filters: Optional[MetadataFilters] = None,
+    mmr_top_k: int = MMR_TOP_K,
+    mmr_lambda: float = MMR_LAMBDA,
+    tier: str = QUERY_TIER,
+) -> tuple:
+    """
+    Dense retrieve → (multi-query fusion) → (MMR + Cohere rerank), bỏ bớt stage theo tier
+    Args:
+        namespaces: Namespace hoặc danh sách namespace (None = DEFAULT_NAMESPACE), nhiều namespace query song song
+        filters: Filter metadata (build_metadata_filters) đẩy xuống Pinecone
+        mmr_top_k: Số candidate đa dạng giữ lại trước rerank (0 = tắt, tối thiểu rerank_top_k)
+        mmr_lambda: 1.0 = chỉ theo độ liên quan, 0.0 = chỉ theo độ đa dạng
+        tier: "fast" (không bao giờ fusion) | "balanced" | "thorough" (luôn chạy đủ fusion + rerank)
+    Returns:
+        (top_nodes, route) - route: {"tier", "path", "fusion", "rerank", "top1", "gap"}
+    """
+    thresholds = tier_thresholds(tier)
+    with span("get_index", namespaces=namespaces):
+        dense_retriever = build_retriever(namespaces, similarity_top_k=similarity_top_k, filters=filters)
     multiquery_retriever = QueryFusionRetriever(
         [dense_retriever],
         retriever_weights=[1.0],
@@ -69,35 +222,96 @@ def multiquery_retrieve(query: str, similarity_top_k: int = 10, rerank_top_k: in
         similarity_top_k=similarity_top_k,
         use_async=False
     )
-    logger.info("👉 Đang retrieve dữ liệu (Multi-query dense)...")
-    candidate_nodes = multiquery_retriever.retrieve(query)
+    logger.info("👉 Đang retrieve dữ liệu (dense)...")
+    with span("retrieve_dense"):
+        dense_nodes = dense_retriever.retrieve(query)
+    count_items("retrieve_dense", len(dense_nodes))
+    skip_fusion, top1, gap = _confident(dense_nodes, thresholds["fusion_score"], thresholds["fusion_gap"])
+    if skip_fusion:
+        candidate_nodes = dense_nodes
+    else:
+        # Giống QueryFusionRetriever.retrieve nhưng dùng lại kết quả dense của câu hỏi gốc
+        logger.info("👉 Đang retrieve dữ liệu (Multi-query dense)...")
+        with span("retrieve_fused"):
+            results = {(query, 0): dense_nodes}
+            for bundle in generate_queries(multiquery_retriever, query):
+                results[(bundle.query_str, 0)] = dense_retriever.retrieve(bundle)
+            candidate_nodes = multiquery_retriever._simple_fusion(results)[:similarity_top_k]
+        count_items("retrieve_fused", len(candidate_nodes))
+    skip_rerank = _confident(candidate_nodes, thresholds["rerank_score"], thresholds["rerank_gap"])[0]
+    if skip_rerank:
+        candidate_nodes = retrieval.attach_embeddings(candidate_nodes)[:rerank_top_k]
+    else:
+        # MMR trước khi hydrate → không lấy text cho các chunk gần trùng bị loại
+        candidate_nodes = diversify_candidates(candidate_nodes, mmr_top_k and max(mmr_top_k, rerank_top_k), mmr_lambda)
+    # Vector metadata gọn (slim) không chứa text → lấy text theo lô từ docstore local
+    candidate_nodes = hydrate_nodes(candidate_nodes)
     logger.info(f"✅ Lấy được {len(candidate_nodes)} candidates từ Pinecone.")
-    top_nodes = cohere_rerank(query, candidate_nodes, top_k=rerank_top_k)
-    logger.info(f"✅ Sau rerank giữ lại {len(top_nodes)} nodes liên quan nhất.")
-    return top_nodes
+    if skip_rerank:
+        top_nodes = candidate_nodes
+    else:
+        top_nodes = cohere_rerank(query, candidate_nodes, top_k=rerank_top_k)
+        logger.info(f"✅ Sau rerank giữ lại {len(top_nodes)} nodes liên quan nhất.")
+
+    path = ("dense" if skip_fusion else "fusion") + ("" if skip_rerank else "+rerank")
+    registry.inc("rag_query_path_total", tier=tier, path=path)
+    logger.info(f"🛣️ Tier {tier}: path={path} (top1={top1:.3f}, gap={gap:.3f})")
+    route = {
+        "tier": tier,
+        "path": path,
+        "fusion": not skip_fusion,
+        "rerank": not skip_rerank,
+        "top1": round(top1, 4),
+        "gap": round(gap, 4),
+    }
+    return top_nodes, route
+
+def multiquery_retrieve(
+    query: str,
+    similarity_top_k: int = 10,
+    rerank_top_k: int = 5,
+    namespaces: Union[str, List[str], None] = None,
+    filters: Optional[MetadataFilters] = None,
+    mmr_top_k: int = MMR_TOP_K,
+    mmr_lambda: float = MMR_LAMBDA,
+    tier: str = QUERY_TIER,
+) -> list:
+    """Như retrieve_with_route nhưng chỉ trả về top nodes"""
+    return retrieve_with_route(
+        query, similarity_top_k, rerank_top_k, namespaces, filters, mmr_top_k, mmr_lambda, tier
+    )[0]
 
 def rag_agent_answer(query: str, top_nodes: list) -> str:
     """
     Sử dụng LLM để tổng hợp câu trả lời cuối cùng từ các top-k nodes.
     """
-    llm = OpenAI(model="gpt-4.1-mini", api_key=os.getenv("OPENAI_API_KEY"))
+    llm = OpenAI(model="gpt-4.1-mini", api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
     context = "\n\n".join([n.node.get_content() for n in top_nodes])
     prompt = f"Dựa trên các đoạn sau, hãy trả lời câu hỏi: '{query}'\n\n{context}"
-    response = llm.complete(prompt)
+    with span("completion", context_nodes=len(top_nodes)):
+        # tokens/min tính cả phần output dự kiến
+        response = rate_limited_call("openai", "chat", llm.complete, prompt, tokens=estimate_tokens(prompt) + 1024)
+    record_token_usage("completion", response)
     return response
 
 if __name__ == "__main__":
+    # Nạp SDK trong lúc chờ người dùng gõ câu hỏi đầu tiên
+    warm_up(pinecone, cohere, PineconeVectorStore, VectorStoreIndex, QueryFusionRetriever, OpenAI, embedding)
     while True:
         user_query = input("\nNhập câu hỏi (gõ 'exit' để thoát): ")
         if user_query.strip().lower() == "exit":
             print("Kết thúc phiên hỏi đáp.")
             break
-        results = multiquery_retrieve(user_query, similarity_top_k=10, rerank_top_k=5)
-        print(f"\n📌 Query: {user_query}")
-        for i, n in enumerate(results, 1):
-            print(f"--- Top {i} ---")
-            print(n.node.get_content()[:300], "...")
-        # AI Agent RAG tổng hợp câu trả lời cuối cùng
-        final_answer = rag_agent_answer(user_query, results)
+        with trace_context() as trace_id:
+            logger.info(f"🔎 Trace {trace_id}")
+            results = multiquery_retrieve(user_query, similarity_top_k=10, rerank_top_k=5)
+            print(f"\n📌 Query: {user_query}")
+            for i, n in enumerate(results, 1):
+                print(f"--- Top {i} ---")
+                print(n.node.get_content()[:300], "...")
+            # AI Agent RAG tổng hợp câu trả lời cuối cùng
+            final_answer = rag_agent_answer(user_query, results)
         print("\n🔎 Câu trả lời tổng hợp bởi AI Agent:")
         print(final_answer)
+        # Phiên hỏi đáp chạy lâu → cập nhật metrics textfile sau mỗi câu hỏi
+        write_metrics_textfile("query")
@@ -0,0 +1,217 @@
+import os
+import json
+import uuid
+import logging
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+from lazy import lazy_import
+
+# numpy chỉ cần khi ghi/đọc vector → không làm chậm khởi động pipeline
+np = lazy_import("numpy")
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] - %(message)s")
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIR = os.getenv("INGEST_CHECKPOINT_DIR", os.path.join("output", "runs"))
+WAL_NAME = "wal.jsonl"
+
+def _json_default(value: Any) -> Any:
+    # numpy scalar (page, table_index từ DataFrame.attrs) → kiểu Python
+    return value.item() if hasattr(value, "item") else str(value)
+
+class IngestCheckpoint:
+    """
+    Write-ahead log cho một lần chạy pipeline_etl: <checkpoint_dir>/<run_id>/wal.jsonl.
+    Mỗi bước tốn kém được ghi (flush + fsync) ngay khi xong, resume đọc lại log và bỏ qua phần đã làm:
+      run        - tham số của lần chạy (resume chạy lại đúng tham số này)
+      extracted  - trang + table chunks của một PDF
+      chunks     - danh sách chunk cuối cùng sau clean/split/dedupe
+      embedded   - ID của một lô embedding, vector nằm trong embed-<n>.npy cùng thư mục
+      upserted   - ID của một lô đã upsert thành công
+      error      - lỗi của một bước (extract một file, transform) để tra cứu; resume không dùng tới
+      done       - đã upsert hết và cập nhật manifest (kèm số file / chunk / vector)
+    Dòng cuối bị ghi dở (process bị kill) được bỏ qua. Khi done, WAL được thu gọn còn run + done.
+    """
+
+    def __init__(self, run_dir: str):
+        self.run_dir = run_dir
+        self.run_id = os.path.basename(os.path.normpath(run_dir))
+        self.params: Dict[str, Any] = {}
+        self._run_record: Dict[str, Any] = {}
+        self.extracted: Dict[str, Dict[str, Any]] = {}
+        self.chunks: Optional[List[Dict[str, Any]]] = None
+        self.done = False
+        self._embedded: Dict[str, tuple] = {}
+        self._upserted: set = set()
+        self._embed_files = 0
+        self._arrays: Dict[str, "np.ndarray"] = {}
+        self._replay()
+        self._truncate_partial_line()
+        self._wal = open(os.path.join(run_dir, WAL_NAME), "a", encoding="utf-8")
+
+    # ----------- Tạo / mở -----------
+    @classmethod
+    def create(cls, params: Dict[str, Any], checkpoint_dir: str = CHECKPOINT_DIR) -> "IngestCheckpoint":
+        run_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        run_dir = os.path.join(checkpoint_dir, run_id)
+        os.makedirs(run_dir, exist_ok=True)
+        checkpoint = cls(run_dir)
+        checkpoint._run_record = {"type": "run", "params": params, "started_at": datetime.now().isoformat()}
+        checkpoint._append(checkpoint._run_record)
+        checkpoint.params = params
+        logger.info(f"📒 Checkpoint ingest: {run_dir}")
+        return checkpoint
+
+    @classmethod
+    def open(cls, run_id: str, checkpoint_dir: str = CHECKPOINT_DIR) -> "IngestCheckpoint":
+        run_dir = os.path.join(checkpoint_dir, run_id)
+        if not os.path.exists(os.path.join(run_dir, WAL_NAME)):
+            raise FileNotFoundError(f"Không tìm thấy checkpoint run {run_id} trong {checkpoint_dir}")
+        checkpoint = cls(run_dir)
+        logger.info(
+            f"♻️ Resume run {run_id}: {len(checkpoint.extracted)} file đã extract, "
+            f"chunks {'đã' if checkpoint.chunks is not None else 'chưa'} split, "
+            f"{len(checkpoint._embedded)} vectors đã embed, {len(checkpoint._upserted)} đã upsert"
+        )
+        return checkpoint
+
+    def _replay(self):
+        path = os.path.join(self.run_dir, WAL_NAME)
+        if not os.path.exists(path):
+            return
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"⚠️ Bỏ qua dòng WAL ghi dở trong {path}")
+                    continue
+                kind = record["type"]
+                if kind == "run":
+                    self.params = record["params"]
+                    self._run_record = record
+                elif kind == "extracted":
+                    self.extracted[record["source_file"]] = record
+                elif kind == "chunks":
+                    self.chunks = record["chunks"]
+                elif kind == "embedded":
+                    for row, vid in enumerate(record["ids"]):
+                        self._embedded[vid] = (record["file"], row)
+                    self._embed_files += 1
+                elif kind == "upserted":
+                    self._upserted.update(record["ids"])
+                elif kind == "done":
+                    self.done = True
+
+    def _truncate_partial_line(self):
+        """Cắt dòng cuối ghi dở để bản ghi tiếp theo bắt đầu trên dòng mới"""
+        path = os.path.join(self.run_dir, WAL_NAME)
+        if not os.path.exists(path):
+            return
+        with open(path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def _append(self, record: Dict[str, Any]):
+        # Chưa fsync xong thì bước đó coi như chưa làm → resume làm lại, không bao giờ bỏ sót
+        self._wal.write(json.dumps(record, ensure_ascii=False, default=_json_default) + "\n")
+        self._wal.flush()
+        os.fsync(self._wal.fileno())
+
+    def close(self):
+        self._wal.close()
+
+    # ----------- Extract / transform -----------
+    def record_extracted(self, source_file: str, docs: List[Dict[str, Any]], table_chunks: List[Dict[str, Any]]):
+        record = {"type": "extracted", "source_file": source_file, "docs": docs, "table_chunks": table_chunks}
+        self._append(record)
+        self.extracted[source_file] = record
+
+    def record_chunks(self, chunks: List[Dict[str, Any]]):
+        self._append({"type": "chunks", "chunks": chunks})
+        self.chunks = chunks
+
+    def record_error(self, stage: str, error: str, **details):
+        self._append({"type": "error", "stage": stage, "error": error, "at": datetime.now().isoformat(), **details})
+
+    # ----------- Embed / upsert -----------
+    def embeddings_for(self, ids: List[str]) -> Optional[List[List[float]]]:
+        """Vector đã embed của cả lô ids, None nếu còn thiếu bất kỳ ID nào"""
+        if not all(vid in self._embedded for vid in ids):
+            return None
+        vectors = []
+        for vid in ids:
+            name, row = self._embedded[vid]
+            if name not in self._arrays:
+                self._arrays[name] = np.load(os.path.join(self.run_dir, name), mmap_mode="r")
+            vectors.append(self._arrays[name][row].tolist())
+        return vectors
+
+    def record_embeddings(self, ids: List[str], embeddings: List[List[float]]):
+        name = f"embed-{self._embed_files:05d}.npy"
+        with open(os.path.join(self.run_dir, name), "wb") as f:
+            np.save(f, np.asarray(embeddings, dtype=np.float32))
+            f.flush()
+            os.fsync(f.fileno())
+        self._append({"type": "embedded", "file": name, "ids": ids})
+        self._embed_files += 1
+        for row, vid in enumerate(ids):
+            self._embedded[vid] = (name, row)
+
+    def is_upserted(self, vector_id: str) -> bool:
+        return vector_id in self._upserted
+
+    def record_upserted(self, ids: List[str]):
+        self._append({"type": "upserted", "ids": ids})
+        self._upserted.update(ids)
+
+    def mark_done(self):
+        """
+        Đánh dấu run hoàn tất, xóa vector tạm và thu gọn WAL còn bản ghi run + done
+        (text trang/chunk chỉ cần cho resume → không giữ lại, tránh WAL chiếm dung lượng ~ corpus mỗi lần chạy)
+        """
+        done = {
+            "type": "done",
+            "finished_at": datetime.now().isoformat(),
+            "files": len(self.extracted),
+            "chunks": len(self.chunks or []),
+            "vectors": len(self._upserted),
+        }
+        # Ghi done vào WAL đầy đủ trước → bị kill trong lúc thu gọn thì run vẫn được coi là xong
+        self._append(done)
+        self.done = True
+        self._wal.close()
+        path = os.path.join(self.run_dir, WAL_NAME)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in (self._run_record, done):
+                f.write(json.dumps(record, ensure_ascii=False, default=_json_default) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self._wal = open(path, "a", encoding="utf-8")
+        self.extracted.clear()
+        self.chunks = None
+        self._embedded.clear()
+        self._arrays.clear()
+        for name in os.listdir(self.run_dir):
+            if name.startswith("embed-") and name.endswith(".npy"):
+                os.remove(os.path.join(self.run_dir, name))
+
+def latest_unfinished_run(checkpoint_dir: str = CHECKPOINT_DIR) -> Optional[str]:
+    """run_id mới nhất chưa có bản ghi done (run_id bắt đầu bằng timestamp → sắp xếp theo tên)"""
+    if not os.path.isdir(checkpoint_dir):
+        return None
+    for run_id in sorted(os.listdir(checkpoint_dir), reverse=True):
+        path = os.path.join(checkpoint_dir, run_id, WAL_NAME)
+        if not os.path.exists(path):
+            continue
+        # Bản ghi done (nhỏ) luôn là dòng cuối → chỉ cần đọc phần đuôi file
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 4096))
+            finished = b'"type": "done"' in f.read()
+        if not finished:
+            return run_id
+    return None
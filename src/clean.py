@@ -0,0 +1,131 @@
+import re
+import hashlib
+import logging
+from collections import Counter, defaultdict
+from typing import List, Dict, Any, Tuple
+from tracing import span, count_items
+from lazy import lazy_import
+
+get_tokenizer = lazy_import("llama_index.core.utils", "get_tokenizer")
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Dòng chỉ gồm số trang: "12", "- 12 -", "Trang 3/10", "Page 3 of 10"
+_PAGE_NUMBER_RE = re.compile(r"^\W*(trang|page)?\s*\d+\s*((/|of|trên)\s*\d+)?\W*$", re.IGNORECASE)
+_DIGITS_RE = re.compile(r"\d+")
+_SPACES_RE = re.compile(r"\s+")
+
+def _count_tokens(text: str) -> int:
+    return len(get_tokenizer()(text)) if text else 0
+
+def _normalize_line(line: str) -> str:
+    return _SPACES_RE.sub(" ", line.strip().lower())
+
+def _edge_key(line: str) -> str:
+    """Header/footer chỉ khác số trang/ngày vẫn được coi là giống nhau"""
+    return _DIGITS_RE.sub("#", _normalize_line(line))
+
+def _edge_indices(non_empty: List[int], edge_lines: int) -> set:
+    """Chỉ số các dòng header/footer; trang ngắn thì thu hẹp vùng này để không ăn vào nội dung"""
+    n = max(1, min(edge_lines, len(non_empty) // 4))
+    return set(non_empty[:n] + non_empty[-n:])
+
+# ----------- Clean -----------
+def strip_repeated_lines(
+    pages: List[Dict[str, Any]],
+    edge_lines: int = 3,
+    min_edge_fraction: float = 0.5,
+    min_body_fraction: float = 0.8,
+    min_pages: int = 3,
+) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """
+    Bỏ header/footer/disclaimer lặp lại giữa các trang của cùng một tài liệu (theo source_file).
+    Một dòng bị bỏ nếu:
+      - nằm trong `edge_lines` dòng đầu/cuối trang và xuất hiện ở >= min_edge_fraction số trang, hoặc
+      - xuất hiện ở bất kỳ đâu trong >= min_body_fraction số trang, hoặc
+      - là dòng số trang nằm ở đầu/cuối trang.
+    Args:
+        pages: Danh sách trang (output của extract), text được thay bằng bản đã làm sạch
+        edge_lines: Số dòng đầu/cuối trang coi là vùng header/footer
+        min_edge_fraction: Tỉ lệ trang tối thiểu để coi dòng ở header/footer là lặp lại
+        min_body_fraction: Tỉ lệ trang tối thiểu để coi dòng ở thân trang là lặp lại
+        min_pages: Tài liệu ít trang hơn thì chỉ bỏ dòng số trang
+    Returns:
+        (pages đã làm sạch, report: lines_removed, tokens_removed)
+    """
+    report = {"lines_removed": 0, "tokens_removed": 0}
+    by_document: Dict[Any, List[Dict[str, Any]]] = defaultdict(list)
+    for page in pages:
+        by_document[page.get("source_file")].append(page)
+
+    with span("clean_repeated_lines", pages=len(pages)):
+        for doc_pages in by_document.values():
+            page_lines = [page.get("text", "").splitlines() for page in doc_pages]
+            edge_counts: Counter = Counter()
+            body_counts: Counter = Counter()
+            for lines in page_lines:
+                non_empty = [i for i, line in enumerate(lines) if line.strip()]
+                edge_idx = _edge_indices(non_empty, edge_lines)
+                edge_counts.update({_edge_key(lines[i]) for i in edge_idx})
+                body_counts.update({_normalize_line(lines[i]) for i in non_empty})
+
+            n_pages = len(doc_pages)
+            repeated_edge, repeated_body = set(), set()
+            if n_pages >= min_pages:
+                repeated_edge = {k for k, v in edge_counts.items() if v >= max(2, min_edge_fraction * n_pages)}
+                repeated_body = {k for k, v in body_counts.items() if v >= max(2, min_body_fraction * n_pages)}
+
+            for page, lines in zip(doc_pages, page_lines):
+                non_empty = [i for i, line in enumerate(lines) if line.strip()]
+                edge_idx = _edge_indices(non_empty, edge_lines)
+                kept, removed = [], []
+                for i, line in enumerate(lines):
+                    is_edge = i in edge_idx
+                    if line.strip() and (
+                        _normalize_line(line) in repeated_body
+                        or (is_edge and _edge_key(line) in repeated_edge)
+                        or (is_edge and _PAGE_NUMBER_RE.match(line))
+                    ):
+                        removed.append(line)
+                    else:
+                        kept.append(line)
+                if removed:
+                    page["text"] = "\n".join(kept)
+                    report["lines_removed"] += len(removed)
+                    report["tokens_removed"] += _count_tokens("\n".join(removed))
+
+    count_items("clean_lines_removed", report["lines_removed"])
+    logger.info(
+        f"🧹 Đã bỏ {report['lines_removed']} dòng header/footer lặp lại "
+        f"(~{report['tokens_removed']} tokens) trên {len(pages)} trang"
+    )
+    return pages, report
+
+def chunk_hash(text: str) -> str:
+    """Hash nội dung chunk (bỏ khác biệt khoảng trắng/hoa thường)"""
+    return hashlib.sha1(_SPACES_RE.sub(" ", text.strip().lower()).encode("utf-8")).hexdigest()
+
+def dedupe_chunks(chunks: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """
+    Bỏ chunk trùng nội dung trên toàn corpus (giữ chunk xuất hiện đầu tiên)
+    Returns:
+        (chunks duy nhất, report: duplicate_chunks, duplicate_tokens)
+    """
+    seen = set()
+    unique = []
+    report = {"duplicate_chunks": 0, "duplicate_tokens": 0}
+    for chunk in chunks:
+        h = chunk_hash(chunk["text"])
+        if h in seen:
+            report["duplicate_chunks"] += 1
+            report["duplicate_tokens"] += _count_tokens(chunk["text"])
+            continue
+        seen.add(h)
+        unique.append(chunk)
+    count_items("dedupe_chunks_removed", report["duplicate_chunks"])
+    logger.info(
+        f"🧹 Đã bỏ {report['duplicate_chunks']} chunk trùng lặp "
+        f"(~{report['duplicate_tokens']} tokens), còn {len(unique)} chunks"
+    )
+    return unique, report
@@ -0,0 +1,103 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+from typing import List, Dict, Any, Iterable
+from tracing import span, count_items
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] - %(message)s")
+logger = logging.getLogger(__name__)
+
+DOCSTORE_PATH = os.getenv("DOCSTORE_PATH", os.path.join("output", "docstore.sqlite"))
+
+# SQLite giới hạn số tham số mỗi câu lệnh (mặc định 999 ở bản cũ)
+_MAX_PARAMS = 900
+
+class ChunkDocStore:
+    """
+    Lưu text của chunk ở local (SQLite) để vector trong Pinecone chỉ cần metadata gọn.
+    Khóa là vector ID; retriever lấy text theo lô bằng get_texts(ids).
+    """
+
+    def __init__(self, path: str = DOCSTORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS chunks (
+                    id TEXT PRIMARY KEY,
+                    namespace TEXT,
+                    source_file TEXT,
+                    page INTEGER,
+                    text TEXT NOT NULL,
+                    metadata TEXT
+                )
+                """
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3.Connection không dùng chung giữa các thread → mỗi thread một connection
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+        return conn
+
+    def put_many(self, records: Iterable[Dict[str, Any]], namespace: str = ""):
+        """records: dict có id, text, source_file, page, metadata (tùy chọn)"""
+        rows = [
+            (
+                r["id"],
+                namespace,
+                r.get("source_file"),
+                r.get("page"),
+                r["text"],
+                json.dumps(r.get("metadata") or {}, ensure_ascii=False),
+            )
+            for r in records
+        ]
+        with span("docstore_put", rows=len(rows)), self._conn() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks (id, namespace, source_file, page, text, metadata) VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        count_items("docstore_put", len(rows))
+
+    def get_texts(self, ids: List[str]) -> Dict[str, str]:
+        """Lấy text theo lô cho danh sách vector ID"""
+        texts: Dict[str, str] = {}
+        conn = self._conn()
+        with span("docstore_get", ids=len(ids)):
+            for start in range(0, len(ids), _MAX_PARAMS):
+                batch = ids[start:start + _MAX_PARAMS]
+                placeholders = ",".join("?" * len(batch))
+                for chunk_id, text in conn.execute(
+                    f"SELECT id, text FROM chunks WHERE id IN ({placeholders})", batch
+                ):
+                    texts[chunk_id] = text
+        count_items("docstore_get", len(texts))
+        return texts
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+def hydrate_nodes(nodes: list, docstore: ChunkDocStore = None) -> list:
+    """
+    Điền text cho các NodeWithScore trả về từ vector có metadata gọn (không có "text").
+    Node đã có text được giữ nguyên.
+    """
+    missing = [n for n in nodes if not n.node.get_content()]
+    if not missing:
+        return nodes
+    docstore = docstore or ChunkDocStore()
+    texts = docstore.get_texts([n.node.node_id for n in missing])
+    for n in missing:
+        text = texts.get(n.node.node_id)
+        if text is None:
+            logger.warning(f"⚠️ Không tìm thấy chunk {n.node.node_id} trong docstore {docstore.path}")
+            continue
+        n.node.set_content(text)
+    return nodes
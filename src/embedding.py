@@ -0,0 +1,73 @@
+import os
+import logging
+from typing import Any, List, Optional
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.embeddings import BaseEmbedding
+from llama_index.embeddings.openai import OpenAIEmbedding
+from ratelimit import rate_limited_call, estimate_tokens
+from tracing import record_tokens
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] - %(message)s")
+logger = logging.getLogger(__name__)
+
+EMBED_MODEL_NAME = "text-embedding-3-small"
+# Kích thước đầy đủ của text-embedding-3-small
+EMBED_FULL_DIM = 1536
+# text-embedding-3-* hỗ trợ trả về vector rút gọn (dimensions); PINECONE_DIM điều khiển cho toàn pipeline
+EMBED_DIM = int(os.getenv("PINECONE_DIM", str(EMBED_FULL_DIM)))
+
+class RateLimitedEmbedding(BaseEmbedding):
+    """
+    Bọc một embed model: mỗi request (một batch) đi qua limiter dùng chung ("openai", "embed")
+    để transform, load và query không vượt requests/min, tokens/min của cùng API key.
+    Số token (ước lượng) được cộng vào rag_llm_tokens_total{stage="embed"|"embed_query"}.
+    """
+
+    _inner: Any = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, **kwargs: Any):
+        super().__init__(model_name=inner.model_name, embed_batch_size=inner.embed_batch_size, **kwargs)
+        self._inner = inner
+
+    @property
+    def inner(self) -> BaseEmbedding:
+        return self._inner
+
+    def _call(self, stage: str, fn, arg, tokens: int):
+        result = rate_limited_call("openai", "embed", fn, arg, tokens=tokens)
+        record_tokens(stage, "prompt", tokens)
+        return result
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._call("embed_query", self._inner._get_query_embedding, query, estimate_tokens(query))
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._call("embed", self._inner._get_text_embedding, text, estimate_tokens(text))
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._call("embed", self._inner._get_text_embeddings, texts, estimate_tokens(texts))
+
+# ----------- Embedding model -----------
+def get_embed_model(
+    api_key: Optional[str] = None,
+    embed_batch_size: int = 100,
+    dimensions: Optional[int] = EMBED_DIM,
+) -> BaseEmbedding:
+    """
+    Embed model dùng chung cho transform, load và query → cùng model, cùng số chiều
+    Args:
+        api_key: OpenAI API key (None = đọc OPENAI_API_KEY)
+        embed_batch_size: Số text mỗi request
+        dimensions: Số chiều vector (None hoặc EMBED_FULL_DIM = đầy đủ)
+    """
+    kwargs = {}
+    if dimensions and dimensions != EMBED_FULL_DIM:
+        kwargs["dimensions"] = dimensions
+    # Retry 429/5xx do limiter xử lý (để giảm concurrency), client không tự retry
+    inner = OpenAIEmbedding(
+        model=EMBED_MODEL_NAME, api_key=api_key, embed_batch_size=embed_batch_size, max_retries=0, **kwargs
+    )
+    return RateLimitedEmbedding(inner)
@@ -1,57 +1,445 @@
 import os
+import time
+import gzip
+import json
+import math
+import hashlib
 import logging
-import pdfplumber
-import pandas as pd
-import fitz  # PyMuPDF
-import pytesseract
-from PIL import Image
-from typing import List, Dict, Any
+from datetime import datetime
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import List, Dict, Any, Optional
+from tracing import span, count_items, record_duration
+from lazy import lazy_import
+
+# Thư viện PDF/OCR/pandas nạp khi dùng lần đầu (OCR và pdfplumber chỉ cần cho một số trang)
+pdfplumber = lazy_import("pdfplumber")
+pd = lazy_import("pandas")
+fitz = lazy_import("fitz")  # PyMuPDF
+pytesseract = lazy_import("pytesseract")
+Image = lazy_import("PIL.Image")
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] - %(message)s")
 logger = logging.getLogger(__name__)
 
+# "pymupdf" = text layer bằng PyMuPDF, pdfplumber chỉ cho trang có dấu hiệu bảng; "pdfplumber" = pdfplumber mọi trang
+EXTRACT_ENGINES = ("pymupdf", "pdfplumber")
+EXTRACT_ENGINE = os.getenv("EXTRACT_ENGINE", "pymupdf")
+# Đổi version khi logic extract thay đổi → cache cũ tự động bị bỏ qua
+EXTRACTOR_VERSIONS = {"pdfplumber": "plumber-ocr-2", "pymupdf": "pymupdf-ocr-2"}
+EXTRACT_CACHE_DIR = os.path.join("output", "cache", "extract")
+# PDF nhiều hơn EXTRACT_SHARD_PAGES trang được chia dải trang cho EXTRACT_WORKERS process
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+EXTRACT_SHARD_PAGES = int(os.getenv("EXTRACT_SHARD_PAGES", "50"))
+# OCR: render grayscale, DPI giảm dần với trang khổ lớn để ảnh không vượt OCR_MAX_MEGAPIXELS
+OCR_LANG = "vie+eng"
+OCR_MAX_DPI = int(os.getenv("OCR_MAX_DPI", "300"))
+OCR_MIN_DPI = int(os.getenv("OCR_MIN_DPI", "150"))
+OCR_MAX_MEGAPIXELS = float(os.getenv("OCR_MAX_MEGAPIXELS", "10"))
+# Trang có text layer: chỉ OCR vùng ảnh chiếm ít nhất tỉ lệ này của trang (bỏ qua logo, icon)
+OCR_MIN_REGION_FRACTION = float(os.getenv("OCR_MIN_REGION_FRACTION", "0.05"))
+# Cache text OCR theo hash ảnh đã render (vd. trang bìa scan giống nhau giữa các hợp đồng); rỗng = tắt
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", os.path.join("output", "cache", "ocr"))
+OCR_VERSION = "tesseract-gray-1"
+
+# ----------- Extraction cache -----------
+_hash_memo: Dict[tuple, str] = {}
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """Hash nội dung file (đọc theo block, không load cả file vào RAM; nhớ kết quả theo size + mtime)"""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if key not in _hash_memo:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                h.update(block)
+        _hash_memo[key] = h.hexdigest()
+    return _hash_memo[key]
+
+def _check_engine(engine: str):
+    if engine not in EXTRACT_ENGINES:
+        raise ValueError(f"Extract engine không hỗ trợ: {engine} (chọn một trong {EXTRACT_ENGINES})")
+
+def extraction_cache_path(
+    pdf_path: str, cache_dir: str = EXTRACT_CACHE_DIR, suffix: str = "jsonl.gz", engine: str = EXTRACT_ENGINE
+) -> str:
+    """Đường dẫn cache: <cache_dir>/<sha256>_<version của engine>.<suffix>"""
+    _check_engine(engine)
+    return os.path.join(cache_dir, f"{file_sha256(pdf_path)}_{EXTRACTOR_VERSIONS[engine]}.{suffix}")
+
+def _page_doc(page_num: int, text: str) -> Dict[str, Any]:
+    return {
+        "title": f"Page {page_num}",
+        "text": text,
+        "page_labels": [page_num],
+        "tables": [],
+    }
+
+def load_extraction_cache(cache_path: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Đọc cache extract (dòng đầu là header, mỗi dòng sau là một trang)
+    Returns:
+        List[Dict] giống output của extract_text_with_fallback, hoặc None nếu không có / hỏng
+    """
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with gzip.open(cache_path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            docs = [_page_doc(rec["page"], rec["text"]) for rec in map(json.loads, f)]
+        if header.get("pages") != len(docs):
+            logger.warning(f"⚠️ Cache {cache_path} thiếu trang ({len(docs)}/{header.get('pages')}) → extract lại")
+            return None
+        return docs
+    except Exception as e:
+        logger.warning(f"⚠️ Không đọc được cache {cache_path}: {e} → extract lại")
+        return None
+
+# ----------- Table detection (rẻ, chỉ dùng PyMuPDF) -----------
+def _ruling_lines(page: "fitz.Page") -> tuple:
+    """Đếm đường kẻ ngang/dọc (line hoặc rect mảnh) trong vector drawings của trang"""
+    horizontal = vertical = 0
+    for drawing in page.get_drawings():
+        for item in drawing["items"]:
+            if item[0] == "l":
+                p1, p2 = item[1], item[2]
+                width, height = abs(p2.x - p1.x), abs(p2.y - p1.y)
+            elif item[0] == "re":
+                width, height = item[1].width, item[1].height
+                if width > 2 and height > 2:
+                    # Ô bảng vẽ bằng rect: tính như 2 cạnh ngang + 2 cạnh dọc
+                    horizontal += 2
+                    vertical += 2
+                    continue
+            else:
+                continue
+            if height <= 2 and width >= 20:
+                horizontal += 1
+            elif width <= 2 and height >= 10:
+                vertical += 1
+    return horizontal, vertical
+
+def _text_grid_rows(page: "fitz.Page", min_cells: int = 3, gap: float = 12.0) -> int:
+    """Số dòng text có >= min_cells cụm từ cách nhau xa, và các cụm thẳng cột với dòng khác"""
+    rows: Dict[int, list] = {}
+    for x0, y0, x1, y1, *_ in page.get_text("words"):
+        rows.setdefault(round(y0 / 3), []).append((x0, x1))
+    cell_starts = []
+    for words in rows.values():
+        words.sort()
+        starts = [words[0][0]]
+        for (_, prev_x1), (x0, _) in zip(words, words[1:]):
+            if x0 - prev_x1 > gap:
+                starts.append(x0)
+        if len(starts) >= min_cells:
+            cell_starts.append({round(x / 5) for x in starts})
+    if len(cell_starts) < 3:
+        return 0
+    # Cột "thẳng hàng": vị trí bắt đầu cụm xuất hiện ở >= 3 dòng
+    column_hits: Dict[int, int] = {}
+    for starts in cell_starts:
+        for x in starts:
+            column_hits[x] = column_hits.get(x, 0) + 1
+    columns = {x for x, hits in column_hits.items() if hits >= 3}
+    return sum(1 for starts in cell_starts if len(starts & columns) >= min_cells)
+
+def looks_like_table(page: "fitz.Page") -> bool:
+    """
+    Kiểm tra rẻ xem trang có thể chứa bảng: có lưới đường kẻ, hoặc >= 3 dòng text xếp thành cột.
+    Chỉ những trang này mới cần layout analysis (chậm) của pdfplumber.
+    """
+    horizontal, vertical = _ruling_lines(page)
+    if horizontal >= 3 and vertical >= 2:
+        return True
+    return _text_grid_rows(page) >= 3
+
 # ----------- Extract -----------
-def extract_tables_from_pdf(pdf_path: str, output_csv: str = None):
+TABLE_COLUMNS = ["page", "table_index", "row_index", "col_index", "column", "value"]
+
+def _tables_from_long(long_df: "pd.DataFrame") -> List["pd.DataFrame"]:
+    """Dựng lại danh sách bảng từ dạng long (ngược với extract_tables_from_pdf)"""
+    tables = []
+    for (page_num, table_num), group in long_df.groupby(["page", "table_index"], sort=True):
+        header = group.drop_duplicates("col_index").sort_values("col_index")["column"].tolist()
+        wide = group.pivot(index="row_index", columns="col_index", values="value").sort_index()
+        df = pd.DataFrame(wide.values.tolist(), columns=header)
+        df.attrs["page"] = int(page_num)
+        df.attrs["table_index"] = int(table_num)
+        tables.append(df)
+    return tables
+
+def extract_tables_from_pdf(
+    pdf_path: str,
+    output_parquet: str = None,
+    cache_dir: Optional[str] = EXTRACT_CACHE_DIR,
+    engine: str = EXTRACT_ENGINE,
+    output_csv: str = None,
+):
+    """
+    Extract bảng bằng pdfplumber, ghi tất cả bảng của PDF vào MỘT file Parquet dạng long
+    (page, table_index, row_index, col_index, column, value)
+    Args:
+        pdf_path: Đường dẫn file PDF
+        output_parquet: Đường dẫn file .parquet (optional, None = không ghi file)
+        cache_dir: Thư mục extraction cache, None = tắt cache
+        engine: "pymupdf" = chỉ chạy pdfplumber trên trang looks_like_table, "pdfplumber" = mọi trang
+        output_csv: Deprecated, prefix CSV cũ → ghi ra "<output_csv>.parquet"
+    Returns:
+        List[pd.DataFrame]: Các bảng, df.attrs chứa "page" và "table_index"
+    """
+    _check_engine(engine)
+    if output_csv is not None:
+        logger.warning("⚠️ extract_tables_from_pdf(output_csv=...) đã deprecated, dùng output_parquet")
+        output_parquet = output_parquet or f"{output_csv}.parquet"
+    cache_path = extraction_cache_path(pdf_path, cache_dir, suffix="tables.parquet", engine=engine) if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            long_df = pd.read_parquet(cache_path)
+            tables = _tables_from_long(long_df)
+            logger.info(f"♻️ Dùng lại table cache cho {os.path.basename(pdf_path)}: {len(tables)} bảng")
+            if output_parquet and tables:
+                os.makedirs(os.path.dirname(output_parquet) or ".", exist_ok=True)
+                long_df.to_parquet(output_parquet, index=False)
+            return tables
+        except Exception as e:
+            logger.warning(f"⚠️ Không đọc được table cache {cache_path}: {e} → extract lại")
+
     tables = []
+    rows = []
+    candidate_pages = None
+    if engine == "pymupdf":
+        with span("detect_tables"), fitz.open(pdf_path) as doc:
+            candidate_pages = [page.number + 1 for page in doc if looks_like_table(page)]
+        logger.info(f"🔍 {os.path.basename(pdf_path)}: {len(candidate_pages)} trang có dấu hiệu bảng")
     with pdfplumber.open(pdf_path) as pdf:
-        for page_num, page in enumerate(pdf.pages, start=1):
-            page_tables = page.extract_tables()
+        if candidate_pages is None:
+            candidate_pages = range(1, len(pdf.pages) + 1)
+        for page_num in candidate_pages:
+            page = pdf.pages[page_num - 1]
+            with span("extract_tables_page", page=page_num):
+                page_tables = page.extract_tables()
             if not page_tables or all([not t for t in page_tables]):
-                logger.info(f"❌ Trang {page_num} không có bảng nào.")
-                if output_csv:
-                    pd.DataFrame().to_csv(
-                        f"{output_csv}_page{page_num}_table0.csv",
-                        index=False,
-                        encoding="utf-8-sig",
-                    )
+                logger.debug(f"❌ Trang {page_num} không có bảng nào.")
                 continue
             for table_num, table in enumerate(page_tables, start=1):
                 if table:
-                    df = pd.DataFrame(table[1:], columns=table[0])
+                    header = [str(h) if h else f"col_{i}" for i, h in enumerate(table[0])]
+                    df = pd.DataFrame(table[1:], columns=header)
+                    df.attrs["page"] = page_num
+                    df.attrs["table_index"] = table_num
                     tables.append(df)
                     logger.info(
                         f"✅ Trang {page_num} - Bảng {table_num}: "
                         f"{df.shape[0]} hàng, {df.shape[1]} cột"
                     )
-                    if output_csv:
-                        df.to_csv(
-                            f"{output_csv}_page{page_num}_table{table_num}.csv",
-                            index=False,
-                            encoding="utf-8-sig",
-                        )
+                    for row_idx, row in enumerate(table[1:]):
+                        for col_idx, value in enumerate(row):
+                            rows.append({
+                                "page": page_num,
+                                "table_index": table_num,
+                                "row_index": row_idx,
+                                "col_index": col_idx,
+                                "column": header[col_idx] if col_idx < len(header) else f"col_{col_idx}",
+                                "value": value,
+                            })
+    count_items("extract_tables", len(tables))
+    long_df = pd.DataFrame(rows, columns=TABLE_COLUMNS)
+    if cache_path:
+        # Ghi cả khi không có bảng để lần sau không phải quét lại
+        os.makedirs(cache_dir, exist_ok=True)
+        long_df.to_parquet(cache_path, index=False)
+    if output_parquet and rows:
+        os.makedirs(os.path.dirname(output_parquet) or ".", exist_ok=True)
+        long_df.to_parquet(output_parquet, index=False)
+        logger.info(f"✅ Đã lưu {len(tables)} bảng vào: {output_parquet}")
+    elif output_parquet:
+        logger.info(f"ℹ️ Không tìm thấy bảng nào trong {os.path.basename(pdf_path)}")
     return tables
 
-def extract_text_with_fallback(pdf_path: str, output_txt: str = None) -> List[Dict[str, Any]]:
+# ----------- OCR -----------
+def _ocr_dpi(rect: "fitz.Rect") -> int:
+    """DPI render cho vùng `rect` (point): OCR_MAX_DPI, giảm để ảnh không vượt OCR_MAX_MEGAPIXELS"""
+    area_in2 = max(rect.width * rect.height / 72.0 ** 2, 1e-6)
+    dpi = min(OCR_MAX_DPI, math.sqrt(OCR_MAX_MEGAPIXELS * 1e6 / area_in2))
+    return int(max(OCR_MIN_DPI, dpi))
+
+def _ocr_cache_key(pix: "fitz.Pixmap") -> str:
+    h = hashlib.sha256(f"{OCR_VERSION}|{OCR_LANG}|{pix.width}x{pix.height}|".encode())
+    h.update(pix.samples_mv)
+    return h.hexdigest()
+
+def ocr_image(page: "fitz.Page", clip: Optional["fitz.Rect"] = None, cache_dir: Optional[str] = OCR_CACHE_DIR) -> tuple:
+    """
+    OCR một trang (hoặc vùng `clip` của trang).
+    Render grayscale 8-bit thẳng từ PyMuPDF và đưa buffer cho PIL không qua bản sao RGB
+    (~1/3 bộ nhớ so với RGB + copy), kết quả cache theo hash ảnh đã render.
+    Returns:
+        (text, cache_hit)
+    """
+    rect = clip or page.rect
+    pix = page.get_pixmap(dpi=_ocr_dpi(rect), colorspace=fitz.csGRAY, clip=clip, alpha=False)
+    cache_path = os.path.join(cache_dir, f"{_ocr_cache_key(pix)}.txt") if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, encoding="utf-8") as f:
+            return f.read(), True
+    img = Image.frombuffer("L", (pix.width, pix.height), pix.samples_mv, "raw", "L", pix.stride, 1)
+    text = pytesseract.image_to_string(img, lang=OCR_LANG)
+    del img, pix
+    if cache_path:
+        # Worker process khác có thể ghi cùng key → ghi file tạm rồi rename
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, cache_path)
+    return text, False
+
+def image_regions(page: "fitz.Page") -> List["fitz.Rect"]:
+    """
+    Vùng ảnh đáng OCR trên trang đã có text layer: đủ lớn (OCR_MIN_REGION_FRACTION diện tích trang),
+    chưa có text layer bên trong (PDF đã OCR sẵn), các vùng chồng nhau được gộp lại
+    """
+    page_area = abs(page.rect)
+    regions: List["fitz.Rect"] = []
+    for info in page.get_image_info():
+        rect = fitz.Rect(info["bbox"]) & page.rect
+        if rect.is_empty or abs(rect) < OCR_MIN_REGION_FRACTION * page_area:
+            continue
+        for i, other in enumerate(regions):
+            if rect.intersects(other):
+                regions[i] = other | rect
+                break
+        else:
+            regions.append(rect)
+    return [rect for rect in regions if not page.get_text("words", clip=rect)]
+
+def _extract_page_range(
+    pdf_path: str,
+    first_page: int,
+    last_page: int,
+    engine: str = EXTRACT_ENGINE,
+    ocr_cache_dir: Optional[str] = OCR_CACHE_DIR,
+) -> List[Dict[str, Any]]:
+    """
+    Extract text cho các trang [first_page, last_page] (đánh số từ 1).
+    Chạy được trong worker process: mở PDF một lần cho cả dải trang, không ghi log/metric ở đây
+    (parent ghi lại từ "extract_s"/"ocr_s").
+    Engine "pymupdf": text layer bằng PyMuPDF, pdfplumber chỉ cho trang looks_like_table;
+    OCR cả trang khi không có text layer; với engine "pymupdf", trang có text layer OCR thêm các vùng ảnh
+    (image_regions).
+    Returns:
+        List[Dict]: {"page", "text", "engine", "extract_s", "ocr_s", "ocr_regions", "ocr_cache_hits"}
+        theo thứ tự trang
+    """
+    results = []
+    with ExitStack() as stack:
+        fitz_doc = plumber_pdf = None
+        for page_num in range(first_page, last_page + 1):
+            start = time.perf_counter()
+            used = engine
+            text = ""
+            if engine == "pymupdf":
+                if fitz_doc is None:
+                    fitz_doc = stack.enter_context(fitz.open(pdf_path))
+                page = fitz_doc[page_num - 1]
+                text = page.get_text("text", sort=True)
+                if text.strip() and looks_like_table(page):
+                    used = "pdfplumber"
+            if used == "pdfplumber":
+                if plumber_pdf is None:
+                    plumber_pdf = stack.enter_context(pdfplumber.open(pdf_path))
+                text = plumber_pdf.pages[page_num - 1].extract_text() or ""
+            extract_s = time.perf_counter() - start
+            ocr_s = None
+            ocr_regions = cache_hits = 0
+            full_page = not text.strip()
+            # OCR vùng ảnh chỉ ở engine "pymupdf" (page đã mở sẵn); engine "pdfplumber" giữ hành vi cũ:
+            # chỉ mở PyMuPDF khi phải OCR cả trang
+            if full_page:
+                if fitz_doc is None:
+                    fitz_doc = stack.enter_context(fitz.open(pdf_path))
+                page = fitz_doc[page_num - 1]
+                regions = [None]
+            else:
+                regions = image_regions(page) if engine == "pymupdf" else []
+            if regions:
+                start = time.perf_counter()
+                ocr_texts = []
+                for clip in regions:
+                    ocr_text, hit = ocr_image(page, clip, ocr_cache_dir)
+                    ocr_texts.append(ocr_text)
+                    cache_hits += hit
+                if full_page:
+                    text, used = ocr_texts[0], "ocr"
+                else:
+                    ocr_regions = len(regions)
+                    text = "\n".join([text.rstrip()] + [t.strip() for t in ocr_texts if t.strip()]) + "\n"
+                ocr_s = time.perf_counter() - start
+            results.append({"page": page_num, "text": text, "engine": used,
+                            "extract_s": extract_s, "ocr_s": ocr_s,
+                            "ocr_regions": ocr_regions, "ocr_cache_hits": cache_hits})
+    return results
+
+def _page_ranges(total_pages: int, shard_pages: int) -> List[tuple]:
+    return [(first, min(first + shard_pages - 1, total_pages)) for first in range(1, total_pages + 1, shard_pages)]
+
+def _iter_page_results(
+    pdf_path: str, total_pages: int, workers: int, shard_pages: int, engine: str, ocr_cache_dir: Optional[str]
+):
+    """
+    Sinh kết quả từng trang theo đúng thứ tự trang.
+    PDF lớn (> shard_pages trang) được chia thành các dải trang extract song song bằng process pool.
+    """
+    ranges = _page_ranges(total_pages, shard_pages)
+    if workers <= 1 or len(ranges) <= 1:
+        for first, last in ranges:
+            yield from _extract_page_range(pdf_path, first, last, engine, ocr_cache_dir)
+        return
+    workers = min(workers, len(ranges))
+    logger.info(f"⚡ Extract song song {total_pages} trang: {len(ranges)} dải x {shard_pages} trang, {workers} workers")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map giữ thứ tự dải trang → ghi file/cache tuần tự ngay khi dải kế tiếp xong
+        for shard in executor.map(
+            _extract_page_range, repeat(pdf_path), *zip(*ranges), repeat(engine), repeat(ocr_cache_dir)
+        ):
+            yield from shard
+
+def extract_text_with_fallback(
+    pdf_path: str,
+    output_txt: str = None,
+    cache_dir: Optional[str] = EXTRACT_CACHE_DIR,
+    workers: Optional[int] = None,
+    shard_pages: int = EXTRACT_SHARD_PAGES,
+    engine: str = EXTRACT_ENGINE,
+    ocr_cache_dir: Optional[str] = OCR_CACHE_DIR,
+) -> List[Dict[str, Any]]:
     """
     Extract text từ PDF với fallback OCR và tạo output file text
     Args:
         pdf_path: Đường dẫn file PDF
         output_txt: Đường dẫn output file text (optional)
+        cache_dir: Thư mục extraction cache (key = hash nội dung PDF + version của engine), None = tắt cache
+        workers: Số process extract song song cho PDF lớn (None = EXTRACT_WORKERS, 1 = tuần tự)
+        shard_pages: Số trang mỗi dải giao cho một worker
+        engine: "pymupdf" (nhanh, pdfplumber chỉ cho trang có bảng) hoặc "pdfplumber" (mọi trang)
+        ocr_cache_dir: Thư mục cache text OCR (key = hash ảnh đã render), None = tắt
     Returns:
         List[Dict]: Danh sách documents với text đã extract
     """
+    _check_engine(engine)
+    # Dùng lại kết quả extract cũ nếu PDF và extractor không đổi
+    cache_path = None
+    if cache_dir:
+        cache_path = extraction_cache_path(pdf_path, cache_dir, engine=engine)
+        cached = load_extraction_cache(cache_path)
+        if cached is not None:
+            logger.info(f"♻️ Dùng lại extraction cache cho {os.path.basename(pdf_path)}: {len(cached)} trang")
+            return cached
+        os.makedirs(cache_dir, exist_ok=True)
+    
     docs = []
-    all_text = []  # Lưu toàn bộ text để ghi file
     
     # Tạo output path nếu không được cung cấp
     if output_txt is None:
@@ -62,46 +450,69 @@ def extract_text_with_fallback(pdf_path: str, output_txt: str = None) -> List[Di
     os.makedirs(os.path.dirname(output_txt), exist_ok=True)
     
     logger.info(f"📝 Bắt đầu extract text từ: {pdf_path}")
+    with fitz.open(pdf_path) as pdf:
+        total_pages = pdf.page_count
     
-    with pdfplumber.open(pdf_path) as pdf:
-        for page_num, page in enumerate(pdf.pages, start=1):
-            text = page.extract_text() or ""
-            if not text.strip():
+    # Text file và cache được ghi dần theo từng trang; cache ghi ra file tạm, rename khi xong
+    tmp_cache_path = f"{cache_path}.tmp" if cache_path else None
+    with ExitStack() as stack:
+        txt_file = None
+        try:
+            txt_file = stack.enter_context(open(output_txt, 'w', encoding='utf-8'))
+            txt_file.write(f"EXTRACTED TEXT FROM: {os.path.basename(pdf_path)}\n")
+            txt_file.write(f"Extraction Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+            txt_file.write(f"Total Pages: {total_pages}\n")
+            txt_file.write("="*80 + "\n")
+        except Exception as e:
+            logger.error(f"❌ Lỗi ghi file text: {e}")
+            txt_file = None
+        
+        cache_file = None
+        if tmp_cache_path:
+            cache_file = stack.enter_context(gzip.open(tmp_cache_path, "wt", encoding="utf-8"))
+            cache_file.write(json.dumps({
+                "source_file": os.path.basename(pdf_path),
+                "extractor_version": EXTRACTOR_VERSIONS[engine],
+                "pages": total_pages,
+            }) + "\n")
+        
+        workers = EXTRACT_WORKERS if workers is None else workers
+        engine_counts: Dict[str, int] = {}
+        for result in _iter_page_results(pdf_path, total_pages, workers, shard_pages, engine, ocr_cache_dir):
+            page_num, text = result["page"], result["text"]
+            record_duration("extract_page", result["extract_s"])
+            count_items("extract_page")
+            count_items(f"extract_page_{result['engine']}")
+            engine_counts[result["engine"]] = engine_counts.get(result["engine"], 0) + 1
+            if result["engine"] == "ocr":
                 logger.info(f"⚠️ Trang {page_num} không có text → fallback OCR")
-                doc = fitz.open(pdf_path)
-                pix = doc[page_num - 1].get_pixmap(dpi=300)
-                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                text = pytesseract.image_to_string(img, lang="vie+eng")
-            
-            # Thêm header cho mỗi trang
-            page_header = f"\n{'='*50}\nTRANG {page_num}\n{'='*50}\n"
-            page_text = page_header + text.strip() + "\n"
+                record_duration("ocr_page", result["ocr_s"])
+                count_items("ocr_page")
+            elif result["ocr_regions"]:
+                logger.info(f"🖼️ Trang {page_num}: OCR {result['ocr_regions']} vùng ảnh")
+                record_duration("ocr_region", result["ocr_s"])
+                count_items("ocr_region", result["ocr_regions"])
+            if result["ocr_cache_hits"]:
+                count_items("ocr_cache_hit", result["ocr_cache_hits"])
             
-            docs.append({
-                "title": f"Page {page_num}",
-                "text": text,
-                "page_labels": [page_num],
-                "tables": [],
-            })
+            docs.append(_page_doc(page_num, text))
             
-            all_text.append(page_text)
+            if txt_file:
+                # Thêm header cho mỗi trang
+                page_header = f"\n{'='*50}\nTRANG {page_num}\n{'='*50}\n"
+                txt_file.write(page_header + text.strip() + "\n")
+            if cache_file:
+                cache_file.write(json.dumps({"page": page_num, "text": text}, ensure_ascii=False) + "\n")
             logger.info(f"📄 Page {page_num} length={len(text)} chars")
     
-    # Ghi toàn bộ text ra file
-    try:
-        with open(output_txt, 'w', encoding='utf-8') as f:
-            f.write(f"EXTRACTED TEXT FROM: {os.path.basename(pdf_path)}\n")
-            f.write(f"Extraction Date: {pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write(f"Total Pages: {len(docs)}\n")
-            f.write("="*80 + "\n")
-            
-            for page_text in all_text:
-                f.write(page_text)
-        
+    if tmp_cache_path:
+        os.replace(tmp_cache_path, cache_path)
+        logger.info(f"💾 Đã lưu extraction cache: {cache_path}")
+    if txt_file:
         logger.info(f"✅ Đã lưu extracted text vào: {output_txt}")
-        logger.info(f"📊 Tổng cộng: {len(docs)} trang, {sum(len(doc['text']) for doc in docs)} ký tự")
-        
-    except Exception as e:
-        logger.error(f"❌ Lỗi ghi file text: {e}")
+    logger.info(
+        f"📊 Tổng cộng: {len(docs)} trang, {sum(len(doc['text']) for doc in docs)} ký tự "
+        f"(engine {engine}: {', '.join(f'{k}={v}' for k, v in sorted(engine_counts.items()))})"
+    )
     
     return docs
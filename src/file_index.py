@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import base64
+import bisect
+import logging
+import threading
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] - %(message)s")
+logger = logging.getLogger(__name__)
+
+DATA_DIR = "data"
+MANIFEST_PATH = os.path.join("output", "ingest_manifest.json")
+
+# ----------- Ingestion manifest -----------
+def load_manifest(manifest_path: str = MANIFEST_PATH) -> Dict[str, Any]:
+    """Đọc manifest trạng thái ingest (source_file → chunks, namespace, indexed_at)"""
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f).get("files", {})
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"⚠️ Không đọc được manifest {manifest_path}: {e}")
+        return {}
+
+def update_manifest(file_chunk_counts: Dict[str, int], namespace: str, manifest_path: str = MANIFEST_PATH):
+    """
+    Ghi nhận các file vừa được upsert thành công vào manifest
+    Args:
+        file_chunk_counts: {source_file: số chunks}
+        namespace: Namespace trong Pinecone
+        manifest_path: Đường dẫn file manifest
+    """
+    files = load_manifest(manifest_path)
+    now = datetime.now().isoformat()
+    for source_file, chunk_count in file_chunk_counts.items():
+        files[source_file] = {
+            "chunks": chunk_count,
+            "namespace": namespace,
+            "indexed_at": now,
+        }
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    # Ghi ra file tạm rồi rename để reader không bao giờ thấy file ghi dở
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"files": files}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+    logger.info(f"📝 Đã cập nhật manifest: {len(file_chunk_counts)} file")
+
+# ----------- Cached directory index -----------
+def _encode_cursor(key: Tuple[int, str]) -> str:
+    raw = json.dumps([key[0], key[1]], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def _decode_cursor(cursor: str) -> Tuple[int, str]:
+    raw = base64.urlsafe_b64decode(cursor.encode("ascii"))
+    neg_mtime, name = json.loads(raw.decode("utf-8"))
+    return int(neg_mtime), str(name)
+
+class DataDirIndex:
+    """
+    Cache danh sách file trong thư mục data/, sắp xếp theo thời gian modified (mới nhất trước).
+    - Chỉ quét lại khi mtime của thư mục thay đổi (thêm/xóa/đổi tên file)
+      hoặc khi quá `revalidate_seconds` (bắt các file bị ghi đè tại chỗ).
+    - Khi quét lại, các entry có (size, mtime) không đổi được giữ nguyên.
+    - Trạng thái ingest được đọc từ manifest và cũng chỉ đọc lại khi manifest thay đổi.
+    """
+
+    def __init__(self, data_dir: str = DATA_DIR, manifest_path: str = MANIFEST_PATH, revalidate_seconds: float = 30.0):
+        self.data_dir = data_dir
+        self.manifest_path = manifest_path
+        self.revalidate_seconds = revalidate_seconds
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._sorted: List[Dict[str, Any]] = []
+        self._keys: List[Tuple[int, str]] = []
+        self._pdf_count = 0
+        self._dir_mtime_ns: Optional[int] = None
+        self._last_scan = 0.0
+        self._manifest: Dict[str, Any] = {}
+        self._manifest_mtime_ns: Optional[int] = None
+
+    def exists(self) -> bool:
+        return os.path.isdir(self.data_dir)
+
+    def _scan(self):
+        entries = {}
+        with os.scandir(self.data_dir) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                st = entry.stat()
+                cached = self._entries.get(entry.name)
+                if cached and cached["mtime_ns"] == st.st_mtime_ns and cached["size"] == st.st_size:
+                    entries[entry.name] = cached
+                    continue
+                entries[entry.name] = {
+                    "name": entry.name,
+                    "size": st.st_size,
+                    "mtime_ns": st.st_mtime_ns,
+                    "size_mb": round(st.st_size / (1024 * 1024), 2),
+                    "modified_time": datetime.fromtimestamp(st.st_mtime).isoformat(),
+                    "is_pdf": entry.name.lower().endswith(".pdf"),
+                }
+        self._entries = entries
+        self._sorted = sorted(entries.values(), key=lambda e: (-e["mtime_ns"], e["name"]))
+        self._keys = [(-e["mtime_ns"], e["name"]) for e in self._sorted]
+        self._pdf_count = sum(1 for e in self._sorted if e["is_pdf"])
+        logger.info(f"📂 Đã quét lại {self.data_dir}: {len(entries)} file")
+
+    def _refresh_manifest(self):
+        try:
+            mtime_ns = os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            self._manifest, self._manifest_mtime_ns = {}, None
+            return
+        if mtime_ns != self._manifest_mtime_ns:
+            self._manifest = load_manifest(self.manifest_path)
+            self._manifest_mtime_ns = mtime_ns
+
+    def refresh(self, force: bool = False):
+        """Cập nhật cache nếu thư mục data/ hoặc manifest đã thay đổi"""
+        with self._lock:
+            try:
+                dir_mtime_ns = os.stat(self.data_dir).st_mtime_ns
+            except FileNotFoundError:
+                self._entries, self._sorted, self._keys = {}, [], []
+                self._pdf_count = 0
+                self._dir_mtime_ns = None
+                return
+            now = time.monotonic()
+            if force or dir_mtime_ns != self._dir_mtime_ns or now - self._last_scan > self.revalidate_seconds:
+                self._scan()
+                self._dir_mtime_ns = dir_mtime_ns
+                self._last_scan = now
+            self._refresh_manifest()
+
+    def _with_status(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        status = self._manifest.get(entry["name"])
+        return {
+            "name": entry["name"],
+            "size_mb": entry["size_mb"],
+            "modified_time": entry["modified_time"],
+            "is_pdf": entry["is_pdf"],
+            "indexed": status is not None,
+            "chunk_count": status["chunks"] if status else 0,
+            "namespace": status.get("namespace") if status else None,
+            "indexed_at": status.get("indexed_at") if status else None,
+        }
+
+    def list_files(
+        self,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        pdf_only: bool = False,
+        name_contains: Optional[str] = None,
+        indexed: Optional[bool] = None,
+    ) -> Dict[str, Any]:
+        """
+        Trả về một trang file theo cursor
+        Args:
+            limit: Số file tối đa mỗi trang
+            cursor: Cursor trả về từ trang trước (None = trang đầu)
+            pdf_only: Chỉ lấy file PDF
+            name_contains: Lọc theo chuỗi con trong tên file (không phân biệt hoa thường)
+            indexed: True/False để lọc theo trạng thái ingest, None = không lọc
+        Returns:
+            Dict: files, next_cursor, matched (số file khớp filter), total, pdf_count
+        """
+        self.refresh()
+        needle = name_contains.lower() if name_contains else None
+        filtered = pdf_only or needle is not None or indexed is not None
+
+        def matches(entry: Dict[str, Any]) -> bool:
+            if pdf_only and not entry["is_pdf"]:
+                return False
+            if needle and needle not in entry["name"].lower():
+                return False
+            if indexed is not None and (entry["name"] in self._manifest) != indexed:
+                return False
+            return True
+
+        with self._lock:
+            start = 0
+            if cursor:
+                start = bisect.bisect_right(self._keys, _decode_cursor(cursor))
+            page = []
+            next_cursor = None
+            for i in range(start, len(self._sorted)):
+                entry = self._sorted[i]
+                if not matches(entry):
+                    continue
+                if len(page) == limit:
+                    # Còn file khớp filter → cursor trỏ vào file cuối của trang hiện tại
+                    next_cursor = _encode_cursor((-page[-1]["mtime_ns"], page[-1]["name"]))
+                    break
+                page.append(entry)
+            # Số file khớp filter trên toàn bộ thư mục (không chỉ từ cursor); không filter thì = total
+            matched = sum(1 for e in self._sorted if matches(e)) if filtered else len(self._sorted)
+            return {
+                "files": [self._with_status(e) for e in page],
+                "next_cursor": next_cursor,
+                "matched": matched,
+                "total": len(self._sorted),
+                "pdf_count": self._pdf_count,
+            }
@@ -0,0 +1,62 @@
+import importlib
+import logging
+import threading
+from typing import Any, Optional
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] - %(message)s")
+logger = logging.getLogger(__name__)
+
+class LazyImport:
+    """
+    Proxy cho module (hoặc class/hàm trong module) nặng: chỉ import ở lần dùng đầu tiên.
+    Dùng được như đối tượng thật khi truy cập thuộc tính và khi gọi (khởi tạo class);
+    không dùng cho isinstance/kế thừa - những chỗ đó import trực tiếp trong hàm.
+    Vẫn là thuộc tính module bình thường → benchmark/fake có thể gán đè.
+    """
+
+    def __init__(self, module: str, attr: Optional[str] = None):
+        self._module = module
+        self._attr = attr
+        self._target = None
+
+    def _load(self) -> Any:
+        target = self._target
+        if target is None:
+            # importlib tự khóa theo module → an toàn khi nhiều thread cùng dùng lần đầu
+            target = importlib.import_module(self._module)
+            if self._attr:
+                target = getattr(target, self._attr)
+            self._target = target
+        return target
+
+    def __getattr__(self, name: str) -> Any:
+        # typing/inspect dò các thuộc tính dunder (vd. khi proxy nằm trong annotation) → không import vì chúng
+        if name.startswith("__") and name.endswith("__"):
+            raise AttributeError(name)
+        return getattr(self._load(), name)
+
+    def __call__(self, *args, **kwargs) -> Any:
+        return self._load()(*args, **kwargs)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._target is not None else "not loaded"
+        name = f"{self._module}.{self._attr}" if self._attr else self._module
+        return f"<LazyImport {name} ({state})>"
+
+def lazy_import(module: str, attr: Optional[str] = None) -> Any:
+    """pd = lazy_import("pandas"); OpenAI = lazy_import("llama_index.llms.openai", "OpenAI")"""
+    return LazyImport(module, attr)
+
+def warm_up(*targets: Any) -> threading.Thread:
+    """Nạp trước các LazyImport trong thread nền (vd. trong lúc chờ người dùng nhập câu hỏi)"""
+    def load_all():
+        for target in targets:
+            if isinstance(target, LazyImport):
+                try:
+                    target._load()
+                except Exception as e:
+                    logger.debug(f"Warm-up {target!r} lỗi: {e}")
+
+    thread = threading.Thread(target=load_all, name="lazy-warm-up", daemon=True)
+    thread.start()
+    return thread
@@ -1,11 +1,45 @@
+import os
+import hashlib
 from typing import List, Dict, Any
-from llama_index.embeddings.openai import OpenAIEmbedding
-from pinecone import Pinecone
 import logging
+from tracing import span, count_items
+from clean import chunk_hash
+from docstore import ChunkDocStore, DOCSTORE_PATH
+from ratelimit import RateLimitedIndex
+from lazy import lazy_import
+
+Pinecone = lazy_import("pinecone", "Pinecone")
+embedding = lazy_import("embedding")
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] - %(message)s")
 logger = logging.getLogger(__name__)
 
+# "full" = text nằm trong metadata của vector, "slim" = text nằm trong docstore local
+VECTOR_METADATA_MODE = os.getenv("VECTOR_METADATA_MODE", "full")
+
+def chunk_vector_id(chunk: Dict[str, Any]) -> str:
+    """ID ổn định theo (source_file, trang, nội dung) → không ghi đè chunk khác cùng trang"""
+    if "id" in chunk:
+        return chunk["id"]
+    key = f"{chunk.get('source_file', '')}|{chunk['page_labels'][0]}|{chunk['text']}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+def chunk_metadata(chunk: Dict[str, Any], metadata_mode: str = VECTOR_METADATA_MODE) -> Dict[str, Any]:
+    metadata = {
+        "source_file": chunk.get("source_file", ""),
+        "page": chunk.get("page_start", chunk["page_labels"][0]),
+        "page_end": chunk.get("page_end", chunk["page_labels"][-1]),
+        "chunk_type": chunk.get("chunk_type", "text"),
+        "hash": chunk_hash(chunk["text"]),
+    }
+    if metadata_mode == "slim":
+        # PineconeVectorStore luôn đọc metadata["text"] → giữ key nhưng để rỗng
+        metadata["text"] = ""
+    else:
+        metadata["title"] = chunk["title"]
+        metadata["text"] = chunk["text"]
+    return metadata
+
 # ----------- Load -----------
 def upsert_chunks_to_pinecone(
     chunks: List[Dict[str, Any]],
@@ -13,32 +47,83 @@ def upsert_chunks_to_pinecone(
     openai_api_key: str,
     pinecone_api_key: str,
     namespace: str = "",
+    embed_batch_size: int = 100,
+    upsert_batch_size: int = 100,
+    metadata_mode: str = VECTOR_METADATA_MODE,
+    docstore_path: str = DOCSTORE_PATH,
+    checkpoint=None,
 ):
-    embed_model = OpenAIEmbedding(
-        model="text-embedding-3-small", api_key=openai_api_key
-    )
+    """
+    Embed chunks theo batch và upsert vào Pinecone
+    Args:
+        metadata_mode: "full" = lưu text trong metadata vector,
+                       "slim" = metadata gọn (source_file, page, hash), text lưu ở docstore SQLite local
+        docstore_path: Đường dẫn docstore khi metadata_mode="slim"
+        checkpoint: IngestCheckpoint (optional) - bỏ qua chunk đã upsert, dùng lại vector đã embed,
+                    ghi lại từng lô embed/upsert ngay khi xong
+    """
+    embed_model = embedding.get_embed_model(api_key=openai_api_key, embed_batch_size=embed_batch_size)
+    embed_dim = embedding.EMBED_DIM
     pc = Pinecone(api_key=pinecone_api_key)
     if index_name not in pc.list_indexes().names():
-        logger.info(f"ℹ️ Index '{index_name}' chưa tồn tại. Đang tạo mới...")
+        logger.info(f"ℹ️ Index '{index_name}' chưa tồn tại. Đang tạo mới (dimension={embed_dim})...")
         pc.create_index(
             name=index_name,
-            dimension=1536,
+            dimension=embed_dim,
             metric="cosine"
         )
         logger.info(f"✅ Đã tạo index '{index_name}'.")
-    index = pc.Index(index_name)
+    else:
+        index_dim = pc.describe_index(index_name).dimension
+        if index_dim != embed_dim:
+            raise ValueError(
+                f"Index '{index_name}' có dimension={index_dim} nhưng PINECONE_DIM={embed_dim}. "
+                f"Tạo index mới hoặc đặt PINECONE_DIM={index_dim}."
+            )
+    index = RateLimitedIndex(pc.Index(index_name))
+    docstore = ChunkDocStore(docstore_path) if metadata_mode == "slim" else None
+    if checkpoint:
+        pending = [c for c in chunks if not checkpoint.is_upserted(chunk_vector_id(c))]
+        if len(pending) < len(chunks):
+            logger.info(f"♻️ Bỏ qua {len(chunks) - len(pending)} chunks đã upsert ở lần chạy trước")
+        chunks = pending
     vectors = []
-    for chunk in chunks:
-        emb = embed_model.get_text_embedding(chunk["text"])
-        vectors.append({
-            "id": chunk.get("id", f"{chunk['title']}_{chunk['page_labels'][0]}"),
-            "values": emb,
-            "metadata": {
-                "title": chunk["title"],
-                "page": chunk["page_labels"][0],
-                "text": chunk["text"],
-            },
-        })
+    reused = 0
+    for start in range(0, len(chunks), embed_batch_size):
+        batch = chunks[start:start + embed_batch_size]
+        ids = [chunk_vector_id(chunk) for chunk in batch]
+        embeddings = checkpoint.embeddings_for(ids) if checkpoint else None
+        if embeddings is None:
+            with span("embed_batch", batch_size=len(batch)):
+                embeddings = embed_model.get_text_embedding_batch([c["text"] for c in batch])
+            count_items("embed_batch", len(batch))
+            if checkpoint:
+                checkpoint.record_embeddings(ids, embeddings)
+        else:
+            reused += len(batch)
+        batch_vectors = [
+            {"id": vid, "values": emb, "metadata": chunk_metadata(chunk, metadata_mode)}
+            for vid, chunk, emb in zip(ids, batch, embeddings)
+        ]
+        if docstore:
+            # Ghi text vào docstore trước khi upsert để retriever luôn tìm thấy text của vector
+            docstore.put_many(
+                (
+                    {"id": v["id"], "text": chunk["text"], "source_file": v["metadata"]["source_file"],
+                     "page": v["metadata"]["page"], "metadata": {"title": chunk["title"]}}
+                    for chunk, v in zip(batch, batch_vectors)
+                ),
+                namespace=namespace,
+            )
+        vectors.extend(batch_vectors)
+    if reused:
+        logger.info(f"♻️ Dùng lại {reused} vectors đã embed từ checkpoint")
     logger.info(f"🔼 Upserting {len(vectors)} vectors vào Pinecone index={index_name}")
-    index.upsert(vectors=vectors, namespace=namespace)
+    for start in range(0, len(vectors), upsert_batch_size):
+        batch = vectors[start:start + upsert_batch_size]
+        with span("upsert_batch", batch_size=len(batch)):
+            index.upsert(vectors=batch, namespace=namespace)
+        count_items("upsert_batch", len(batch))
+        if checkpoint:
+            checkpoint.record_upserted([v["id"] for v in batch])
     logger.info("✅ Upsert hoàn tất.")
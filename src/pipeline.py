@@ -1,10 +1,16 @@
 import os
 import logging
 import glob
+import argparse
 from dotenv import load_dotenv
-from extract import extract_text_with_fallback, extract_tables_from_pdf
-from transform import split_chunk_semantic_sentence
-from load import upsert_chunks_to_pinecone
+from extract import extract_text_with_fallback, extract_tables_from_pdf, EXTRACT_ENGINE
+from transform import split_chunk_semantic_sentence, split_chunk_document_level, tables_to_chunks
+from load import upsert_chunks_to_pinecone, VECTOR_METADATA_MODE
+from clean import strip_repeated_lines, dedupe_chunks
+from file_index import update_manifest
+from tracing import trace_context, write_metrics_textfile
+from ratelimit import request_priority, set_process_role, BULK
+from checkpoint import IngestCheckpoint, CHECKPOINT_DIR, latest_unfinished_run
 
 load_dotenv()
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
@@ -22,15 +28,28 @@ def get_all_pdf_files_in_data():
 	return pdf_files
 
 # ----------- ETL Pipeline -----------
-def pipeline_etl(pdf_paths: list = None, output_csv: str = "./output/tables", max_tokens: int = 1024, namespace: str = "default"):
+def pipeline_etl(pdf_paths: list = None, output_tables: str = "./output/tables", max_tokens: int = 1024, namespace: str = "default", chunk_mode: str = "page", clean: bool = True, metadata_mode: str = VECTOR_METADATA_MODE, extract_engine: str = EXTRACT_ENGINE, checkpoint_dir: str = CHECKPOINT_DIR, run_id: str = None, output_csv: str = None):
 	"""
 	ETL Pipeline xử lý nhiều PDF files
 	Args:
 		pdf_paths: Danh sách đường dẫn PDF files. Nếu None, sẽ lấy tất cả PDF trong data/
-		output_csv: Đường dẫn output CSV
+		output_tables: Prefix output cho file Parquet chứa bảng (mỗi PDF một file)
 		max_tokens: Số token tối đa cho mỗi chunk
 		namespace: Namespace trong Pinecone
+		chunk_mode: "page" = chia từng trang, "document" = chia trên toàn văn bản PDF (chunk có page_start/page_end)
+		clean: Bỏ header/footer lặp lại trước khi split và bỏ chunk trùng lặp trước khi embed
+		metadata_mode: "full" = text trong metadata Pinecone, "slim" = text trong docstore local
+		extract_engine: "pymupdf" = PyMuPDF, pdfplumber chỉ cho trang có bảng; "pdfplumber" = pdfplumber mọi trang
+		checkpoint_dir: Thư mục WAL checkpoint của các lần chạy (None = tắt checkpoint)
+		run_id: Tiếp tục run đã bị ngắt (resume_pipeline_etl), None = run mới
+		output_csv: Deprecated, tên cũ của output_tables (bảng giờ ghi ra Parquet)
+	Returns:
+		run_id của lần chạy (None nếu tắt checkpoint)
 	"""
+	if output_csv is not None:
+		logger.warning("⚠️ pipeline_etl(output_csv=...) đã deprecated, dùng output_tables (bảng ghi ra Parquet)")
+		output_tables = output_csv
+	
 	# Nếu không có pdf_paths, lấy tất cả PDF trong data/
 	if pdf_paths is None:
 		pdf_paths = get_all_pdf_files_in_data()
@@ -39,49 +58,172 @@ def pipeline_etl(pdf_paths: list = None, output_csv: str = "./output/tables", ma
 		logger.warning("⚠️ Không tìm thấy file PDF nào để xử lý!")
 		return
 	
-	all_chunks = []
+	checkpoint = None
+	if checkpoint_dir and run_id:
+		checkpoint = IngestCheckpoint.open(run_id, checkpoint_dir)
+	elif checkpoint_dir:
+		checkpoint = IngestCheckpoint.create({
+			"pdf_paths": [os.path.abspath(p) for p in pdf_paths],
+			"output_tables": output_tables,
+			"max_tokens": max_tokens,
+			"namespace": namespace,
+			"chunk_mode": chunk_mode,
+			"clean": clean,
+			"metadata_mode": metadata_mode,
+			"extract_engine": extract_engine,
+		}, checkpoint_dir)
+	try:
+		_run_etl(pdf_paths, output_tables, max_tokens, namespace, chunk_mode, clean, metadata_mode, extract_engine, checkpoint)
+	finally:
+		if checkpoint:
+			checkpoint.close()
+	return checkpoint.run_id if checkpoint else None
+
+def _extract_files(pdf_paths, output_tables, max_tokens, extract_engine, checkpoint):
+	"""Extract text + bảng của từng PDF (file đã có trong checkpoint thì dùng lại), trả về (docs, table_chunks)"""
+	all_docs = []
+	table_chunks = []
 	
 	for pdf_path in pdf_paths:
+		source_file = os.path.basename(pdf_path)
+		if checkpoint and source_file in checkpoint.extracted:
+			# Đã extract ở lần chạy trước → không extract/OCR lại
+			record = checkpoint.extracted[source_file]
+			all_docs.extend(record["docs"])
+			table_chunks.extend(record["table_chunks"])
+			logger.info(f"♻️ {source_file}: dùng lại {len(record['docs'])} trang từ checkpoint")
+			continue
 		logger.info(f"🔄 Xử lý file: {pdf_path}")
 		try:
 			# Extract text với output file
 			pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
 			text_output = f"./output/{pdf_name}_extracted_text.txt"
-			docs = extract_text_with_fallback(pdf_path, output_txt=text_output)
+			docs = extract_text_with_fallback(pdf_path, output_txt=text_output, engine=extract_engine)
 			
-			# Extract tables
-			tables = extract_tables_from_pdf(pdf_path, output_csv=f"{output_csv}_{os.path.basename(pdf_path)}")
-			if tables:
-				docs[0]["tables"] = [tables[0].head().to_dict()]
+			# Extract tables → một file Parquet cho mỗi PDF, mỗi bảng thành chunk riêng
+			tables = extract_tables_from_pdf(pdf_path, output_parquet=f"{output_tables}_{pdf_name}.parquet", engine=extract_engine)
+			file_table_chunks = tables_to_chunks(tables, max_tokens=max_tokens)
 			
-			# Transform
-			chunks = split_chunk_semantic_sentence(docs, max_tokens=max_tokens, openai_api_key=OPENAI_API_KEY)
+			# Thêm metadata file cho mỗi trang/chunk
+			for item in docs + file_table_chunks:
+				item["source_file"] = source_file
+			if checkpoint:
+				checkpoint.record_extracted(source_file, docs, file_table_chunks)
 			
-			# Thêm metadata file cho mỗi chunk
-			for chunk in chunks:
-				chunk["source_file"] = os.path.basename(pdf_path)
-			
-			all_chunks.extend(chunks)
-			logger.info(f"✅ Xử lý xong {pdf_path}: {len(chunks)} chunks")
+			all_docs.extend(docs)
+			table_chunks.extend(file_table_chunks)
+			logger.info(f"✅ Extract xong {pdf_path}: {len(docs)} trang, {len(tables)} bảng")
 			
 		except Exception as e:
 			logger.error(f"❌ Lỗi xử lý file {pdf_path}: {e}")
+			if checkpoint:
+				checkpoint.record_error("extract", str(e), source_file=source_file)
+	return all_docs, table_chunks
+
+def _transform(all_docs, table_chunks, max_tokens, chunk_mode, clean):
+	"""Clean + split trang của tất cả PDF, thêm table chunks, bỏ chunk trùng"""
+	if clean:
+		all_docs, clean_report = strip_repeated_lines(all_docs)
 	
-	# Load tất cả chunks vào Pinecone
-	if all_chunks:
-		logger.info(f"🔼 Đang upload {len(all_chunks)} chunks vào Pinecone...")
-		upsert_chunks_to_pinecone(
-			all_chunks,
-			index_name=INDEX_NAME,
-			openai_api_key=OPENAI_API_KEY,
-			pinecone_api_key=PINECONE_API_KEY,
-			namespace=namespace,
+	# Transform: split trang của tất cả PDF cùng lúc để gom embedding thành batch lớn
+	if chunk_mode == "document":
+		all_chunks = split_chunk_document_level(all_docs, max_tokens=max_tokens, openai_api_key=OPENAI_API_KEY)
+	else:
+		all_chunks = split_chunk_semantic_sentence(all_docs, max_tokens=max_tokens, openai_api_key=OPENAI_API_KEY)
+	all_chunks.extend(table_chunks)
+	if clean:
+		all_chunks, dedupe_report = dedupe_chunks(all_chunks)
+		logger.info(
+			f"🧹 Cleaning: bỏ ~{clean_report['tokens_removed'] + dedupe_report['duplicate_tokens']} tokens "
+			f"({clean_report['lines_removed']} dòng lặp, {dedupe_report['duplicate_chunks']} chunk trùng)"
 		)
-		logger.info("✅ Pipeline ETL hoàn tất.")
+	return all_chunks
+
+def _run_etl(pdf_paths, output_tables, max_tokens, namespace, chunk_mode, clean, metadata_mode, extract_engine, checkpoint):
+	if checkpoint and checkpoint.chunks is not None:
+		# Split đã xong ở lần chạy trước → danh sách chunk đã chốt, không extract/OCR lại file nào
+		# (kể cả file lỗi ở lần trước: muốn thêm file đó thì chạy một run mới)
+		all_chunks = checkpoint.chunks
+		logger.info(f"♻️ Dùng lại {len(all_chunks)} chunks từ checkpoint")
 	else:
-		logger.warning("⚠️ Không có chunks nào để upload!")
+		all_docs, table_chunks = _extract_files(pdf_paths, output_tables, max_tokens, extract_engine, checkpoint)
+		all_chunks = None
+	
+	# Gọi API ở mức ưu tiên BULK → query tương tác (cùng process) được phục vụ trước
+	with request_priority(BULK):
+		if all_chunks is None:
+			try:
+				all_chunks = _transform(all_docs, table_chunks, max_tokens, chunk_mode, clean)
+			except Exception as e:
+				# Lỗi split dừng cả run (không có chunk để upload); phần extract đã nằm trong checkpoint
+				# → sửa lỗi rồi --resume chỉ chạy lại từ bước split
+				logger.error(f"❌ Lỗi transform: {e}")
+				if checkpoint:
+					checkpoint.record_error("transform", str(e))
+				raise
+			if checkpoint:
+				checkpoint.record_chunks(all_chunks)
+	
+		file_chunk_counts = {}
+		for chunk in all_chunks:
+			file_chunk_counts[chunk["source_file"]] = file_chunk_counts.get(chunk["source_file"], 0) + 1
+		for source_file, count in file_chunk_counts.items():
+			logger.info(f"✅ {source_file}: {count} chunks")
+	
+		# Load tất cả chunks vào Pinecone
+		if all_chunks:
+			logger.info(f"🔼 Đang upload {len(all_chunks)} chunks vào Pinecone...")
+			upsert_chunks_to_pinecone(
+				all_chunks,
+				index_name=INDEX_NAME,
+				openai_api_key=OPENAI_API_KEY,
+				pinecone_api_key=PINECONE_API_KEY,
+				namespace=namespace,
+				metadata_mode=metadata_mode,
+				checkpoint=checkpoint,
+			)
+			# Ghi trạng thái ingest cho GET /files
+			update_manifest(file_chunk_counts, namespace=namespace)
+			logger.info("✅ Pipeline ETL hoàn tất.")
+		else:
+			logger.warning("⚠️ Không có chunks nào để upload!")
+		if checkpoint:
+			checkpoint.mark_done()
+
+def resume_pipeline_etl(run_id: str = None, checkpoint_dir: str = CHECKPOINT_DIR):
+	"""
+	Tiếp tục một lần chạy pipeline_etl bị ngắt với đúng tham số ban đầu
+	Args:
+		run_id: Run cần tiếp tục (None = run mới nhất chưa xong)
+	"""
+	run_id = run_id or latest_unfinished_run(checkpoint_dir)
+	if not run_id:
+		logger.info("ℹ️ Không có run nào cần resume")
+		return None
+	checkpoint = IngestCheckpoint.open(run_id, checkpoint_dir)
+	params, done = checkpoint.params, checkpoint.done
+	checkpoint.close()
+	if done:
+		logger.info(f"ℹ️ Run {run_id} đã hoàn tất, không cần resume")
+		return run_id
+	return pipeline_etl(checkpoint_dir=checkpoint_dir, run_id=run_id, **params)
 
 if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="ETL pipeline cho các PDF trong data/")
+	parser.add_argument("--resume", nargs="?", const="latest", default=None, metavar="RUN_ID",
+						help="Tiếp tục run bị ngắt (mặc định run mới nhất chưa xong)")
+	args = parser.parse_args()
+	# Process ingestion: chỉ dùng phần ngân sách BULK, phần còn lại dành cho process query
+	set_process_role(BULK)
+	if args.resume:
+		try:
+			with trace_context() as trace_id:
+				logger.info(f"🔎 Trace {trace_id}")
+				resume_pipeline_etl(None if args.resume == "latest" else args.resume)
+		finally:
+			write_metrics_textfile("pipeline")
+		raise SystemExit(0)
+	
 	# Chạy ETL với tất cả PDF có trong thư mục data/
 	logger.info("🚀 Bắt đầu ETL Pipeline với tất cả PDF trong data/")
 	
@@ -93,7 +235,13 @@ if __name__ == "__main__":
 		for pdf_file in pdf_files:
 			logger.info(f"   - {os.path.basename(pdf_file)}")
 		
-		pipeline_etl(pdf_paths=pdf_files, output_csv="./output/tables", max_tokens=512)
+		# Process CLI không có /metrics → ghi metrics ra textfile (kể cả khi ETL lỗi giữa chừng)
+		try:
+			with trace_context() as trace_id:
+				logger.info(f"🔎 Trace {trace_id}")
+				pipeline_etl(pdf_paths=pdf_files, output_tables="./output/tables", max_tokens=512)
+		finally:
+			write_metrics_textfile("pipeline")
 	else:
 		logger.warning("⚠️ Không tìm thấy file PDF nào trong thư mục data/")
 		logger.info("💡 Hãy đặt file PDF vào thư mục data/ để bắt đầu xử lý")
\ No newline at end of file
@@ -0,0 +1,154 @@
+import os
+import json
+import logging
+import argparse
+from typing import List, Dict, Any, Tuple, Optional
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] - %(message)s")
+logger = logging.getLogger(__name__)
+
+STORAGE_DTYPES = ("float32", "float16", "int8")
+
+# ----------- Rút gọn & lượng tử hóa -----------
+def truncate_embeddings(vectors: np.ndarray, dim: int) -> np.ndarray:
+    """
+    Rút gọn vector text-embedding-3-* về `dim` chiều đầu rồi chuẩn hóa L2
+    (tương đương tham số `dimensions` của OpenAI API)
+    """
+    short = np.asarray(vectors, dtype=np.float32)[:, :dim]
+    norms = np.linalg.norm(short, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return short / norms
+
+def quantize(vectors: np.ndarray, dtype: str = "int8") -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Lượng tử hóa vector để lưu local
+    Args:
+        vectors: Ma trận (n, dim) float
+        dtype: "float32" | "float16" | "int8" (int8 = symmetric, scale riêng cho từng vector)
+    Returns:
+        (codes, scales) - scales là None với float32/float16
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype == "float32":
+        return vectors, None
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1, keepdims=True) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"dtype không hỗ trợ: {dtype} (chọn một trong {STORAGE_DTYPES})")
+
+def dequantize(codes: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    codes = codes.astype(np.float32)
+    return codes * scales if scales is not None else codes
+
+def bytes_per_vector(dim: int, dtype: str) -> int:
+    # int8 lưu thêm một scale float32 cho mỗi vector
+    return dim * np.dtype(dtype).itemsize + (4 if dtype == "int8" else 0)
+
+def _top_k(queries: np.ndarray, corpus: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ corpus.T
+    k = min(k, corpus.shape[0])
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return idx
+
+# ----------- Recall vs size report -----------
+def recall_size_report(
+    vectors: np.ndarray,
+    dims: List[int] = (1536, 1024, 768, 512, 256),
+    dtypes: List[str] = STORAGE_DTYPES,
+    k: int = 10,
+    n_queries: int = 200,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """
+    Đo recall@k của từng cấu hình (số chiều × kiểu lưu) so với vector float32 đầy đủ.
+    Query lấy ngẫu nhiên từ chính corpus (doc-as-query), loại chính nó khỏi kết quả.
+    Args:
+        vectors: Ma trận embedding đầy đủ (n, full_dim), đã chuẩn hóa hoặc chưa
+    Returns:
+        Dict: baseline + danh sách {dim, dtype, bytes_per_vector, size_ratio, recall_at_k}
+    """
+    full = truncate_embeddings(vectors, vectors.shape[1])
+    n, full_dim = full.shape
+    rng = np.random.default_rng(seed)
+    q_idx = rng.choice(n, size=min(n_queries, n), replace=False)
+
+    def neighbours(queries, corpus):
+        # Lấy k+1 rồi bỏ chính query
+        idx = _top_k(queries, corpus, k + 1)
+        return [set(row) - {qi} for row, qi in zip(idx.tolist(), q_idx.tolist())]
+
+    truth = neighbours(full[q_idx], full)
+    baseline_bytes = bytes_per_vector(full_dim, "float32")
+    results = []
+    for dim in dims:
+        if dim > full_dim:
+            continue
+        short = truncate_embeddings(full, dim)
+        for dtype in dtypes:
+            codes, scales = quantize(short, dtype)
+            approx = dequantize(codes, scales)
+            found = neighbours(short[q_idx], approx)
+            recall = float(np.mean([len(f & t) / max(len(t), 1) for f, t in zip(found, truth)]))
+            size = bytes_per_vector(dim, dtype)
+            results.append({
+                "dim": dim,
+                "dtype": dtype,
+                "bytes_per_vector": size,
+                "size_ratio": round(baseline_bytes / size, 2),
+                f"recall_at_{k}": round(recall, 4),
+            })
+            logger.info(f"📏 dim={dim:5d} dtype={dtype:8s} {size:6d} B/vector (x{baseline_bytes / size:.1f}) recall@{k}={recall:.4f}")
+    return {
+        "vectors": n,
+        "full_dim": full_dim,
+        "queries": len(q_idx),
+        "k": k,
+        "baseline_bytes_per_vector": baseline_bytes,
+        "results": results,
+    }
+
+def _load_vectors_from_docstore(docstore_path: str, sample: int, api_key: Optional[str]) -> np.ndarray:
+    """Embed mẫu text trong docstore bằng model đầy đủ chiều (chỉ dùng cho report)"""
+    import sqlite3
+    from embedding import get_embed_model, EMBED_FULL_DIM
+
+    conn = sqlite3.connect(docstore_path)
+    texts = [row[0] for row in conn.execute("SELECT text FROM chunks ORDER BY RANDOM() LIMIT ?", (sample,))]
+    conn.close()
+    if not texts:
+        raise ValueError(f"Docstore {docstore_path} rỗng")
+    embed_model = get_embed_model(api_key=api_key, dimensions=EMBED_FULL_DIM)
+    logger.info(f"🔄 Embedding {len(texts)} chunks mẫu từ {docstore_path}...")
+    return np.asarray(embed_model.get_text_embedding_batch(texts), dtype=np.float32)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report recall vs kích thước cho embedding rút gọn/lượng tử hóa")
+    parser.add_argument("--npy", help="File .npy chứa ma trận embedding đầy đủ (n, dim)")
+    parser.add_argument("--docstore", help="Docstore SQLite để lấy mẫu text và embed")
+    parser.add_argument("--sample", type=int, default=2000)
+    parser.add_argument("--dims", default="1536,1024,768,512,256")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--output", default=os.path.join("output", "embedding_size_report.json"))
+    args = parser.parse_args()
+
+    if args.npy:
+        vectors = np.load(args.npy)
+    elif args.docstore:
+        vectors = _load_vectors_from_docstore(args.docstore, args.sample, os.getenv("OPENAI_API_KEY"))
+    else:
+        parser.error("Cần --npy hoặc --docstore")
+
+    report = recall_size_report(
+        vectors, dims=[int(d) for d in args.dims.split(",")], k=args.k, n_queries=args.queries
+    )
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"✅ Đã ghi report vào: {args.output}")
@@ -0,0 +1,272 @@
+import os
+import time
+import heapq
+import random
+import logging
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Tuple, Iterator
+from tracing import registry
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] - %(message)s")
+logger = logging.getLogger(__name__)
+
+# ----------- Priority -----------
+# Số nhỏ hơn được phục vụ trước: query của người dùng đi trước ingestion hàng loạt
+INTERACTIVE = 0
+BULK = 10
+
+_priority: contextvars.ContextVar = contextvars.ContextVar("rate_limit_priority", default=INTERACTIVE)
+
+@contextmanager
+def request_priority(priority: int) -> Iterator[int]:
+    """Mọi lời gọi API trong phạm vi `with` dùng priority này (vd. pipeline_etl dùng BULK)"""
+    token = _priority.set(priority)
+    try:
+        yield priority
+    finally:
+        _priority.reset(token)
+
+# ----------- Cấu hình limit -----------
+# Mặc định theo tier thấp của từng provider; ghi đè bằng env RATE_LIMIT_<PROVIDER>_<KIND>_<RPM|TPM|CONCURRENCY>
+DEFAULT_LIMITS: Dict[Tuple[str, str], Dict[str, float]] = {
+    ("openai", "embed"): {"rpm": 3000, "tpm": 1_000_000, "concurrency": 8},
+    ("openai", "chat"): {"rpm": 500, "tpm": 200_000, "concurrency": 8},
+    ("cohere", "rerank"): {"rpm": 1000, "tpm": 0, "concurrency": 8},
+    ("pinecone", "query"): {"rpm": 6000, "tpm": 0, "concurrency": 16},
+    ("pinecone", "upsert"): {"rpm": 6000, "tpm": 0, "concurrency": 8},
+}
+# Bucket cho phép burst tối đa lượng tương ứng BURST_SECONDS giây
+BURST_SECONDS = float(os.getenv("RATE_LIMIT_BURST_SECONDS", "10"))
+MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "8"))
+
+# ----------- Chia ngân sách giữa các process -----------
+# Limiter và hàng đợi priority chỉ có hiệu lực trong MỘT process. Ingestion (pipeline.py, snapshot restore)
+# và query (main.py, app.py, batch_query.py) chạy ở process riêng, nên INTERACTIVE không chen trước BULK
+# giữa hai bên. Vì vậy mỗi process chỉ dùng một phần RPM/TPM của API key theo vai trò
+# (tổng các phần nên <= 1.0); ghi đè bằng env RATE_LIMIT_SHARE_INTERACTIVE / RATE_LIMIT_SHARE_BULK.
+PROCESS_SHARES: Dict[int, float] = {
+    INTERACTIVE: float(os.getenv("RATE_LIMIT_SHARE_INTERACTIVE", "0.4")),
+    BULK: float(os.getenv("RATE_LIMIT_SHARE_BULK", "0.6")),
+}
+_process_role = INTERACTIVE
+
+registry.describe("rag_rate_limit_wait_seconds", "Thời gian chờ rate limiter phía client trước mỗi request")
+registry.describe("rag_rate_limit_throttled_total", "Số response 429/rate limit nhận từ provider")
+registry.describe("rag_rate_limit_retries_total", "Số lần gọi lại sau lỗi rate limit/tạm thời")
+
+def _env_limit(provider: str, kind: str, name: str, default: float) -> float:
+    value = os.getenv(f"RATE_LIMIT_{provider.upper()}_{kind.upper()}_{name.upper()}")
+    return float(value) if value else float(default)
+
+def estimate_tokens(texts) -> int:
+    """Ước lượng số token (~4 ký tự / token) để trừ vào bucket tokens/min trước khi gọi"""
+    if isinstance(texts, str):
+        texts = [texts]
+    return sum(len(t) for t in texts) // 4 + 1
+
+def is_rate_limit_error(error: Exception) -> bool:
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if status == 429:
+        return True
+    name = type(error).__name__.lower()
+    return "ratelimit" in name or "toomanyrequests" in name or "429" in str(error)
+
+def _is_transient_error(error: Exception) -> bool:
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if isinstance(status, int) and status >= 500:
+        return True
+    name = type(error).__name__.lower()
+    return "timeout" in name or "connection" in name or "serviceunavailable" in name
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Đọc header Retry-After nếu SDK đính kèm response"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None)
+    if not headers:
+        return None
+    try:
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        return float(value) if value is not None else None
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+# ----------- Token bucket -----------
+class TokenBucket:
+    """Bucket nạp đều `rate_per_min` đơn vị mỗi phút, chứa tối đa `capacity`. Không thread-safe (khóa ở limiter)."""
+
+    def __init__(self, rate_per_min: float, capacity: Optional[float] = None):
+        self.rate_per_min = rate_per_min
+        self.capacity = capacity or max(rate_per_min * BURST_SECONDS / 60.0, 1.0)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float, scale: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate_per_min * scale / 60.0)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float, scale: float = 1.0) -> float:
+        """Số giây cần chờ để lấy được `amount` (request lớn hơn capacity chỉ cần bucket đầy)"""
+        self._refill(now, scale)
+        need = min(amount, self.capacity) - self.level
+        return 0.0 if need <= 0 else need * 60.0 / (self.rate_per_min * scale)
+
+    def take(self, amount: float):
+        # Có thể âm (nợ) với request lớn hơn capacity → các request sau chờ bù lại
+        self.level -= amount
+
+# ----------- Adaptive limiter -----------
+class AdaptiveLimiter:
+    """
+    Rate limiter cho một (provider, loại request):
+      - token bucket requests/min và tokens/min,
+      - concurrency thích nghi AIMD: +1/limit mỗi lần thành công, x0.5 khi bị 429 (kèm giảm tốc độ nạp bucket),
+      - hàng đợi theo priority: request priority thấp hơn (INTERACTIVE) được cấp slot/token trước.
+    """
+
+    def __init__(self, provider: str, kind: str, rpm: float, tpm: float = 0, max_concurrency: int = 8):
+        self.provider = provider
+        self.kind = kind
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.concurrency = float(min(2, self.max_concurrency))
+        # Hệ số tốc độ nạp bucket (0.1-1.0): giảm khi bị 429, hồi dần khi thành công
+        self.rate_scale = 1.0
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self._cond = threading.Condition()
+        self._waiters: list = []
+        self._seq = itertools.count()
+
+    def acquire(self, tokens: int = 0, priority: Optional[int] = None):
+        """Chờ tới lượt (theo priority), có slot concurrency và đủ request/token trong bucket"""
+        priority = _priority.get() if priority is None else priority
+        entry = (priority, next(self._seq))
+        start = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    if self._waiters[0] == entry and self.in_flight < int(self.concurrency):
+                        wait = max(
+                            self.blocked_until - now,
+                            self.requests.wait_time(1, now, self.rate_scale) if self.requests else 0.0,
+                            self.tokens.wait_time(tokens, now, self.rate_scale) if self.tokens and tokens else 0.0,
+                        )
+                        if wait <= 0:
+                            break
+                    self._cond.wait(timeout=wait)
+            finally:
+                heapq.heappop(self._waiters) if self._waiters[0] == entry else self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens and tokens:
+                self.tokens.take(tokens)
+            self.in_flight += 1
+        registry.observe(
+            "rag_rate_limit_wait_seconds", time.monotonic() - start, provider=self.provider, kind=self.kind
+        )
+
+    def release(self, throttled: bool = False, retry_after: Optional[float] = None):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.concurrency = max(1.0, self.concurrency * 0.5)
+                self.rate_scale = max(0.1, self.rate_scale * 0.7)
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            else:
+                self.concurrency = min(float(self.max_concurrency), self.concurrency + 1.0 / self.concurrency)
+                self.rate_scale = min(1.0, self.rate_scale + 0.02)
+            self._cond.notify_all()
+
+    def call(self, fn: Callable, *args, tokens: int = 0, max_retries: int = MAX_RETRIES, **kwargs) -> Any:
+        """
+        Gọi fn(*args, **kwargs) qua limiter; lỗi 429/tạm thời được gọi lại với backoff + jitter
+        Args:
+            tokens: Số token ước lượng của request (trừ vào bucket tokens/min)
+            max_retries: Số lần gọi lại tối đa trước khi ném lỗi
+        """
+        for attempt in range(max_retries + 1):
+            self.acquire(tokens)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                throttled = is_rate_limit_error(e)
+                retry_after = _retry_after(e) if throttled else None
+                self.release(throttled=throttled, retry_after=retry_after)
+                if throttled:
+                    registry.inc("rag_rate_limit_throttled_total", provider=self.provider, kind=self.kind)
+                if attempt >= max_retries or not (throttled or _is_transient_error(e)):
+                    raise
+                delay = retry_after or min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random())
+                registry.inc("rag_rate_limit_retries_total", provider=self.provider, kind=self.kind)
+                logger.warning(
+                    f"⏳ {self.provider}/{self.kind} {'rate limited' if throttled else 'lỗi tạm thời'} "
+                    f"({type(e).__name__}), thử lại sau {delay:.1f}s "
+                    f"(lần {attempt + 1}/{max_retries}, concurrency={int(self.concurrency)})"
+                )
+                time.sleep(delay)
+                continue
+            self.release()
+            return result
+
+_limiters: Dict[Tuple[str, str], AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def set_process_role(role: int):
+    """
+    Khai báo vai trò của process (INTERACTIVE / BULK) → phần RPM/TPM mà limiter của process được dùng.
+    Gọi ở entry point trước lời gọi API đầu tiên; limiter đã tạo được tạo lại theo phần mới.
+    """
+    global _process_role
+    with _limiters_lock:
+        _process_role = role
+        _limiters.clear()
+
+def get_limiter(provider: str, kind: str) -> AdaptiveLimiter:
+    """
+    Limiter dùng chung trong process cho (provider, kind), cấu hình từ DEFAULT_LIMITS + env;
+    RPM/TPM nhân với PROCESS_SHARES của vai trò process (concurrency giữ nguyên)
+    """
+    key = (provider, kind)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                defaults = DEFAULT_LIMITS.get(key, {"rpm": 0, "tpm": 0, "concurrency": 8})
+                share = PROCESS_SHARES[_process_role]
+                limiter = _limiters[key] = AdaptiveLimiter(
+                    provider,
+                    kind,
+                    rpm=_env_limit(provider, kind, "rpm", defaults["rpm"]) * share,
+                    tpm=_env_limit(provider, kind, "tpm", defaults["tpm"]) * share,
+                    max_concurrency=int(_env_limit(provider, kind, "concurrency", defaults["concurrency"])),
+                )
+    return limiter
+
+def rate_limited_call(provider: str, kind: str, fn: Callable, *args, tokens: int = 0, **kwargs) -> Any:
+    return get_limiter(provider, kind).call(fn, *args, tokens=tokens, **kwargs)
+
+class RateLimitedIndex:
+    """Bọc Pinecone Index: query/upsert đi qua limiter, các method khác giữ nguyên"""
+
+    def __init__(self, index: Any):
+        self._index = index
+
+    def query(self, *args, **kwargs):
+        return rate_limited_call("pinecone", "query", self._index.query, *args, **kwargs)
+
+    def upsert(self, *args, **kwargs):
+        return rate_limited_call("pinecone", "upsert", self._index.upsert, *args, **kwargs)
+
+    def __getattr__(self, name: str):
+        return getattr(self._index, name)
@@ -0,0 +1,109 @@
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+import numpy as np
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.retrievers import BaseRetriever, VectorIndexRetriever
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Key tạm trong metadata để mang vector của match qua đường legacy của PineconeVectorStore
+_VALUES_KEY = "_match_values"
+
+class MultiNamespaceRetriever(BaseRetriever):
+    """Query nhiều namespace song song (embed query một lần), gộp kết quả theo score"""
+
+    def __init__(self, retrievers: Dict[str, VectorIndexRetriever], similarity_top_k: int = 10):
+        super().__init__()
+        self._retrievers = retrievers
+        self._similarity_top_k = similarity_top_k
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        if query_bundle.embedding is None:
+            embed_model = next(iter(self._retrievers.values()))._embed_model
+            query_bundle.embedding = embed_model.get_agg_embedding_from_queries(query_bundle.embedding_strs)
+
+        def search(item):
+            namespace, retriever = item
+            nodes = retriever.retrieve(query_bundle)
+            for n in nodes:
+                n.node.metadata["namespace"] = namespace
+            return nodes
+
+        # Context (trace ID, priority) chụp ở thread gọi, mỗi namespace một bản
+        items = list(self._retrievers.items())
+        contexts = [contextvars.copy_context() for _ in items]
+        with ThreadPoolExecutor(max_workers=len(items)) as executor:
+            results = list(executor.map(lambda ctx, item: ctx.run(search, item), contexts, items))
+        # Cùng index, cùng metric → score giữa các namespace so sánh trực tiếp được
+        merged = sorted((n for nodes in results for n in nodes), key=lambda n: n.score or 0.0, reverse=True)
+        return merged[:self._similarity_top_k]
+
+# ----------- Vector của candidate -----------
+class MatchValuesIndex:
+    """
+    Bọc Pinecone Index: gắn vector của từng match (include_values) vào bản sao metadata.
+    PineconeVectorStore chỉ đặt node.embedding khi metadata có "_node_content"; vector upsert từ load.py
+    đi đường legacy và bị bỏ mất vector → attach_embeddings() chuyển key này về node.embedding.
+    """
+
+    def __init__(self, index: Any):
+        self._index = index
+
+    def query(self, *args, **kwargs):
+        response = self._index.query(*args, **kwargs)
+        for match in response.matches:
+            if match.values and match.metadata is not None:
+                match.metadata = {**match.metadata, _VALUES_KEY: match.values}
+        return response
+
+    def __getattr__(self, name: str):
+        return getattr(self._index, name)
+
+def attach_embeddings(nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+    """Đưa vector do MatchValuesIndex gắn trong metadata về node.embedding (và xóa khỏi metadata)"""
+    for n in nodes:
+        values = n.node.metadata.pop(_VALUES_KEY, None)
+        if n.node.embedding is None and values:
+            n.node.embedding = values
+    return nodes
+
+# ----------- MMR -----------
+def mmr_select(nodes: List[NodeWithScore], top_k: int, lambda_mult: float = 0.7) -> List[NodeWithScore]:
+    """
+    Maximal marginal relevance trên vector của candidate: giữ top_k node vừa liên quan vừa khác nhau
+    (loại bớt chunk gần trùng từ các đoạn overlap) trước khi gửi rerank.
+    Độ liên quan = score từ vector store (cosine với query), độ trùng = cosine giữa các candidate.
+    Args:
+        top_k: Số node giữ lại
+        lambda_mult: 1.0 = chỉ theo độ liên quan, 0.0 = chỉ theo độ đa dạng
+    Returns:
+        List[NodeWithScore] theo thứ tự được chọn; trả nguyên nodes nếu thiếu vector hoặc đã <= top_k
+    """
+    if top_k <= 0 or len(nodes) <= top_k:
+        return nodes
+    if any(n.node.embedding is None for n in nodes):
+        logger.warning("⚠️ Một số candidate không có vector → bỏ qua MMR")
+        return nodes
+
+    vectors = np.asarray([n.node.embedding for n in nodes], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors /= norms
+    similarity = vectors @ vectors.T
+    relevance = np.asarray([n.score or 0.0 for n in nodes], dtype=np.float32)
+
+    # Độ trùng lớn nhất của mỗi candidate với các node đã chọn, cập nhật dần sau mỗi lần chọn
+    redundancy = np.zeros(len(nodes), dtype=np.float32)
+    available = np.ones(len(nodes), dtype=bool)
+    selected = []
+    for _ in range(top_k):
+        mmr = lambda_mult * relevance - (1.0 - lambda_mult) * redundancy
+        mmr[~available] = -np.inf
+        best = int(np.argmax(mmr))
+        selected.append(best)
+        available[best] = False
+        redundancy = similarity[:, best] if len(selected) == 1 else np.maximum(redundancy, similarity[:, best])
+    return [nodes[i] for i in selected]
@@ -0,0 +1,253 @@
+import os
+import json
+import gzip
+import time
+import logging
+import argparse
+import contextvars
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator, Optional
+import numpy as np
+from dotenv import load_dotenv
+from tracing import span, count_items
+from ratelimit import RateLimitedIndex, request_priority, set_process_role, BULK
+from quantize import quantize, dequantize, STORAGE_DTYPES
+from lazy import lazy_import
+
+Pinecone = lazy_import("pinecone", "Pinecone")
+
+load_dotenv()
+PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] - %(message)s")
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = "rag-vector-snapshot-1"
+MANIFEST_NAME = "manifest.json"
+# Pinecone list() trả tối đa 100 ID mỗi trang; fetch theo lô cùng cỡ
+LIST_PAGE_SIZE = 100
+
+# Cấu trúc snapshot (một thư mục):
+#   manifest.json              - index, namespace, dimension, metric, dtype, số vector, danh sách part
+#   part-00000.npy             - ma trận vector (n, dim) theo dtype (float32 / float16 / int8)
+#   part-00000.scales.npy      - scale từng vector (chỉ với int8)
+#   part-00000.jsonl.gz        - {"id", "metadata"} theo đúng thứ tự hàng của .npy
+# Text của chunk ở chế độ slim nằm trong docstore SQLite local, không nằm trong snapshot.
+
+def _part_name(part: int) -> str:
+    return f"part-{part:05d}"
+
+def _namespace_count(index: Any, namespace: str) -> int:
+    stats = index.describe_index_stats()
+    summary = stats["namespaces"].get(namespace)
+    return summary["vector_count"] if summary else 0
+
+def _page_ids(page: Any) -> List[str]:
+    """ID của một trang list(): SDK mới trả ListResponse (vectors = [ListItem]), SDK cũ trả list[str]"""
+    ids = (getattr(item, "id", item) for item in getattr(page, "vectors", page))
+    return [vid for vid in ids if vid]
+
+def _iter_vectors(index: Any, namespace: str) -> Iterator[List[tuple]]:
+    """Sinh từng trang [(id, values, metadata)]: list() lấy ID theo trang, fetch() lấy vector + metadata"""
+    for page in index.list(namespace=namespace, limit=LIST_PAGE_SIZE):
+        ids = _page_ids(page)
+        if not ids:
+            continue
+        with span("snapshot_fetch", ids=len(ids)):
+            fetched = index.fetch(ids=ids, namespace=namespace).vectors
+        count_items("snapshot_fetch", len(fetched))
+        # Giữ thứ tự của list(); ID bị xóa giữa list() và fetch() thì bỏ qua
+        yield [(vid, fetched[vid].values, fetched[vid].metadata or {}) for vid in ids if vid in fetched]
+
+def _write_part(output_dir: str, part: int, rows: List[tuple], dtype: str) -> Dict[str, Any]:
+    name = _part_name(part)
+    codes, scales = quantize(np.asarray([values for _, values, _ in rows], dtype=np.float32), dtype)
+    np.save(os.path.join(output_dir, f"{name}.npy"), codes)
+    if scales is not None:
+        np.save(os.path.join(output_dir, f"{name}.scales.npy"), scales)
+    with gzip.open(os.path.join(output_dir, f"{name}.jsonl.gz"), "wt", encoding="utf-8") as f:
+        for vid, _, metadata in rows:
+            f.write(json.dumps({"id": vid, "metadata": metadata}, ensure_ascii=False) + "\n")
+    return {"name": name, "count": len(rows)}
+
+# ----------- Export -----------
+def export_snapshot(
+    index_name: str,
+    output_dir: str,
+    namespace: str = "default",
+    part_size: int = 10_000,
+    dtype: str = "float32",
+    pinecone_api_key: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Export ID, vector và metadata của một namespace ra thư mục snapshot (đọc theo trang, ghi theo part
+    → bộ nhớ chỉ giữ tối đa part_size vector)
+    Args:
+        dtype: Kiểu lưu vector ("float32" = nguyên vẹn; "float16"/"int8" nhỏ hơn nhưng có sai số)
+        part_size: Số vector mỗi part
+    Returns:
+        Dict: manifest của snapshot
+    """
+    if dtype not in STORAGE_DTYPES:
+        raise ValueError(f"dtype không hỗ trợ: {dtype} (chọn một trong {STORAGE_DTYPES})")
+    pc = Pinecone(api_key=pinecone_api_key or PINECONE_API_KEY)
+    description = pc.describe_index(index_name)
+    index = pc.Index(index_name)
+    expected = _namespace_count(index, namespace)
+    os.makedirs(output_dir, exist_ok=True)
+    logger.info(f"📤 Export {expected} vectors từ {index_name}/{namespace} → {output_dir}")
+
+    parts: List[Dict[str, Any]] = []
+    rows: List[tuple] = []
+    dimension = None
+    start = time.perf_counter()
+    for page in _iter_vectors(index, namespace):
+        rows.extend(page)
+        while len(rows) >= part_size:
+            parts.append(_write_part(output_dir, len(parts), rows[:part_size], dtype))
+            rows = rows[part_size:]
+            logger.info(f"💾 {sum(p['count'] for p in parts)}/{expected} vectors")
+        if dimension is None and page:
+            dimension = len(page[0][1])
+    if rows:
+        parts.append(_write_part(output_dir, len(parts), rows, dtype))
+
+    total = sum(p["count"] for p in parts)
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "created_at": datetime.now().isoformat(),
+        "index_name": index_name,
+        "namespace": namespace,
+        "dimension": dimension or description.dimension,
+        "metric": getattr(description, "metric", "cosine"),
+        "dtype": dtype,
+        "count": total,
+        "parts": parts,
+    }
+    # Manifest ghi sau cùng → thư mục không có manifest là snapshot dở dang
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    if total != expected:
+        logger.warning(f"⚠️ Export {total} vectors nhưng namespace báo {expected} (index thay đổi trong lúc export?)")
+    logger.info(f"✅ Đã export {total} vectors trong {time.perf_counter() - start:.1f}s ({len(parts)} part)")
+    return manifest
+
+# ----------- Restore -----------
+def load_manifest(snapshot_dir: str) -> Dict[str, Any]:
+    path = os.path.join(snapshot_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Không có {MANIFEST_NAME} trong {snapshot_dir} (snapshot chưa export xong?)")
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"Định dạng snapshot không hỗ trợ: {manifest.get('format')}")
+    return manifest
+
+def iter_snapshot(snapshot_dir: str, manifest: Dict[str, Any] = None) -> Iterator[tuple]:
+    """
+    Sinh từng part dưới dạng (records, vectors): records = [{"id", "metadata"}], vectors = ma trận float32
+    cùng thứ tự hàng. Giữ dạng numpy → chỉ đổi sang list float khi dựng từng lô upsert (to_upsert_batch).
+    """
+    manifest = manifest or load_manifest(snapshot_dir)
+    for part in manifest["parts"]:
+        base = os.path.join(snapshot_dir, part["name"])
+        codes = np.load(f"{base}.npy", mmap_mode="r")
+        scales = np.load(f"{base}.scales.npy") if manifest["dtype"] == "int8" else None
+        vectors = dequantize(np.asarray(codes), scales)
+        with gzip.open(f"{base}.jsonl.gz", "rt", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        if len(records) != len(vectors):
+            raise ValueError(f"Part {part['name']} hỏng: {len(records)} records nhưng {len(vectors)} vectors")
+        yield records, vectors
+
+def to_upsert_batch(records: List[Dict[str, Any]], vectors: np.ndarray) -> List[Dict[str, Any]]:
+    return [{"id": r["id"], "values": v.tolist(), "metadata": r["metadata"]} for r, v in zip(records, vectors)]
+
+def restore_snapshot(
+    snapshot_dir: str,
+    index_name: str,
+    namespace: Optional[str] = None,
+    batch_size: int = 100,
+    concurrency: int = 4,
+    pinecone_api_key: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Ghi snapshot vào Pinecone index (tạo index nếu chưa có): upsert theo lô song song qua rate limiter,
+    không cần extract/embed lại
+    Args:
+        namespace: Namespace đích (None = namespace gốc trong manifest)
+        concurrency: Số lô upsert chạy song song (limiter pinecone/upsert vẫn giới hạn tổng)
+    Returns:
+        Dict: {"vectors", "seconds", "vectors_per_s", "namespace_count"}
+    """
+    manifest = load_manifest(snapshot_dir)
+    namespace = manifest["namespace"] if namespace is None else namespace
+    pc = Pinecone(api_key=pinecone_api_key or PINECONE_API_KEY)
+    if index_name not in pc.list_indexes().names():
+        logger.info(f"ℹ️ Index '{index_name}' chưa tồn tại. Đang tạo mới (dimension={manifest['dimension']})...")
+        pc.create_index(name=index_name, dimension=manifest["dimension"], metric=manifest["metric"])
+    else:
+        index_dim = pc.describe_index(index_name).dimension
+        if index_dim != manifest["dimension"]:
+            raise ValueError(
+                f"Index '{index_name}' có dimension={index_dim} nhưng snapshot có dimension={manifest['dimension']}"
+            )
+    index = RateLimitedIndex(pc.Index(index_name))
+    logger.info(f"📥 Restore {manifest['count']} vectors từ {snapshot_dir} → {index_name}/{namespace}")
+
+    def upsert(records: List[Dict[str, Any]], vectors: np.ndarray) -> int:
+        batch = to_upsert_batch(records, vectors)
+        with span("snapshot_upsert", batch_size=len(batch)):
+            index.upsert(vectors=batch, namespace=namespace)
+        count_items("snapshot_upsert", len(batch))
+        return len(batch)
+
+    restored = 0
+    start = time.perf_counter()
+    with request_priority(BULK), ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # Đọc từng part một → bộ nhớ chỉ giữ một part; các lô trong part upsert song song
+        for records, vectors in iter_snapshot(snapshot_dir, manifest):
+            starts = range(0, len(records), batch_size)
+            # Context (priority BULK, trace ID) chụp ở thread gọi, không phải trong worker
+            contexts = [contextvars.copy_context() for _ in starts]
+            restored += sum(executor.map(
+                lambda ctx, i: ctx.run(upsert, records[i:i + batch_size], vectors[i:i + batch_size]),
+                contexts, starts,
+            ))
+            logger.info(f"🔼 {restored}/{manifest['count']} vectors")
+    elapsed = time.perf_counter() - start
+
+    summary = {
+        "vectors": restored,
+        "seconds": round(elapsed, 2),
+        "vectors_per_s": round(restored / elapsed, 1) if elapsed else 0.0,
+        "namespace_count": _namespace_count(index, namespace),
+    }
+    logger.info(f"✅ Restore xong: {json.dumps(summary)}")
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export / restore snapshot vector của một namespace Pinecone")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_parser = sub.add_parser("export", help="Export namespace ra thư mục snapshot")
+    export_parser.add_argument("--index", required=True)
+    export_parser.add_argument("--namespace", default="default")
+    export_parser.add_argument("--output", required=True, help="Thư mục snapshot")
+    export_parser.add_argument("--part-size", type=int, default=10_000)
+    export_parser.add_argument("--dtype", default="float32", choices=STORAGE_DTYPES)
+    restore_parser = sub.add_parser("restore", help="Ghi snapshot vào index")
+    restore_parser.add_argument("--input", required=True, help="Thư mục snapshot")
+    restore_parser.add_argument("--index", required=True)
+    restore_parser.add_argument("--namespace", default=None, help="Mặc định = namespace trong snapshot")
+    restore_parser.add_argument("--batch-size", type=int, default=100)
+    restore_parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_snapshot(args.index, args.output, args.namespace, part_size=args.part_size, dtype=args.dtype)
+    else:
+        set_process_role(BULK)
+        restore_snapshot(
+            args.input, args.index, args.namespace, batch_size=args.batch_size, concurrency=args.concurrency
+        )
@@ -0,0 +1,221 @@
+import os
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Tuple, Optional, Iterator
+
+# ----------- Trace ID -----------
+_trace_id: contextvars.ContextVar = contextvars.ContextVar("trace_id", default="-")
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] [%(trace_id)s] - %(message)s"
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+def get_trace_id() -> str:
+    return _trace_id.get()
+
+def set_trace_id(trace_id: Optional[str] = None) -> contextvars.Token:
+    """Đặt trace ID cho context hiện tại; trả về token để reset_trace_id"""
+    return _trace_id.set(trace_id or new_trace_id())
+
+def reset_trace_id(token: contextvars.Token):
+    _trace_id.reset(token)
+
+@contextmanager
+def trace_context(trace_id: Optional[str] = None) -> Iterator[str]:
+    """Gắn trace ID cho mọi log/span trong phạm vi `with` (mặc định sinh ID mới)"""
+    token = set_trace_id(trace_id)
+    try:
+        yield _trace_id.get()
+    finally:
+        _trace_id.reset(token)
+
+def _install_trace_logging():
+    """Thêm trường trace_id vào mọi LogRecord và đưa nó vào format log"""
+    old_factory = logging.getLogRecordFactory()
+    if getattr(old_factory, "_with_trace_id", False):
+        return
+
+    def record_factory(*args, **kwargs):
+        record = old_factory(*args, **kwargs)
+        record.trace_id = _trace_id.get()
+        return record
+
+    record_factory._with_trace_id = True
+    logging.setLogRecordFactory(record_factory)
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    # Handler đã được tạo trước khi import module này → đổi format luôn
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+_install_trace_logging()
+logger = logging.getLogger(__name__)
+
+# ----------- Metrics registry (Prometheus text format) -----------
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += value
+        self.count += 1
+
+class MetricsRegistry:
+    """Registry counter/histogram tối giản, thread-safe, xuất ra định dạng Prometheus"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Tuple, float]] = {}
+        self._histograms: Dict[str, Dict[Tuple, _Histogram]] = {}
+        self._help: Dict[str, str] = {}
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = _Histogram(buckets)
+            hist.observe(value)
+
+    @staticmethod
+    def _fmt_labels(key: Tuple, extra: Tuple = ()) -> str:
+        items = list(key) + list(extra)
+        if not items:
+            return ""
+        escaped = []
+        for k, v in items:
+            v = str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+            escaped.append(f'{k}="{v}"')
+        return "{" + ",".join(escaped) + "}"
+
+    def render(self, const_labels: Tuple = ()) -> str:
+        """Xuất toàn bộ series; const_labels (vd. (("process", "pipeline"),)) được gắn thêm vào mọi series"""
+        const_labels = tuple(const_labels)
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{self._fmt_labels(key, const_labels)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, hist in series.items():
+                    cumulative = 0
+                    for bound, count in zip(hist.buckets, hist.counts):
+                        cumulative += count
+                        bucket_labels = self._fmt_labels(key, const_labels + (('le', bound),))
+                        lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                    cumulative += hist.counts[-1]
+                    bucket_labels = self._fmt_labels(key, const_labels + (('le', '+Inf'),))
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                    lines.append(f"{name}_sum{self._fmt_labels(key, const_labels)} {hist.total}")
+                    lines.append(f"{name}_count{self._fmt_labels(key, const_labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+registry.describe("rag_stage_duration_seconds", "Thời gian chạy của từng stage ETL/query")
+registry.describe("rag_stage_errors_total", "Số lần stage bị lỗi")
+registry.describe("rag_stage_items_total", "Số item (trang, chunk, vector, node) đã xử lý theo stage")
+registry.describe(
+    "rag_llm_tokens_total",
+    "Số token LLM/embedding theo stage và loại (embedding: ước lượng ~4 ký tự/token, client không trả usage)",
+)
+
+# ----------- Spans -----------
+@contextmanager
+def span(stage: str, **attrs):
+    """
+    Đo thời gian một stage, ghi vào histogram rag_stage_duration_seconds{stage=...}
+    Args:
+        stage: Tên stage (extract_page, ocr_page, split, embed_batch, upsert_batch, retrieve_fused, rerank, completion, ...)
+        attrs: Thuộc tính thêm vào log debug (page, batch_size, ...)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        registry.inc("rag_stage_errors_total", stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe("rag_stage_duration_seconds", elapsed, stage=stage)
+        if logger.isEnabledFor(logging.DEBUG):
+            details = " ".join(f"{k}={v}" for k, v in attrs.items())
+            logger.debug(f"⏱️ span={stage} duration_ms={elapsed * 1000:.1f} {details}".rstrip())
+
+def record_duration(stage: str, seconds: float):
+    """Ghi thời gian đo ở nơi khác (vd. worker process) vào cùng histogram với span()"""
+    registry.observe("rag_stage_duration_seconds", seconds, stage=stage)
+
+def count_items(stage: str, n: int = 1):
+    registry.inc("rag_stage_items_total", n, stage=stage)
+
+def record_tokens(stage: str, kind: str, n: int):
+    if n:
+        registry.inc("rag_llm_tokens_total", n, stage=stage, kind=kind)
+
+def record_token_usage(stage: str, response) -> None:
+    """Đọc usage (prompt/completion tokens) từ response.raw của LlamaIndex/OpenAI nếu có"""
+    raw = getattr(response, "raw", None)
+    usage = getattr(raw, "usage", None) if raw is not None else None
+    if usage is None and isinstance(raw, dict):
+        usage = raw.get("usage")
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = usage.get(kind) if isinstance(usage, dict) else getattr(usage, kind, None)
+        record_tokens(stage, kind.replace("_tokens", ""), value)
+
+def render_metrics() -> str:
+    return registry.render()
+
+# ----------- Textfile export -----------
+# /metrics của app.py chỉ thấy registry của process Flask; ETL, query CLI và batch query chạy ở process riêng
+# → ghi registry ra <METRICS_TEXTFILE_DIR>/<process>.prom cho textfile collector của node_exporter (rỗng = tắt)
+METRICS_TEXTFILE_DIR = os.getenv("METRICS_TEXTFILE_DIR", os.path.join("output", "metrics"))
+
+def write_metrics_textfile(process: str, directory: Optional[str] = METRICS_TEXTFILE_DIR) -> Optional[str]:
+    """
+    Ghi registry của process hiện tại ra <directory>/<process>.prom, mọi series có thêm label process.
+    Ghi file tạm rồi os.replace → collector không bao giờ đọc phải file ghi dở.
+    Returns:
+        str: đường dẫn file đã ghi (None nếu tắt)
+    """
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{process}.prom")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(registry.render(const_labels=(("process", process),)))
+    os.replace(tmp_path, path)
+    return path
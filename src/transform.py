@@ -1,57 +1,282 @@
+import bisect
 from typing import List, Dict, Any, Optional
-from llama_index.core import Document as LlamaDocument
-from llama_index.core.node_parser import SentenceSplitter, SemanticSplitterNodeParser
-from llama_index.embeddings.openai import OpenAIEmbedding
 import logging
+from tracing import span, count_items
+from lazy import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+SentenceSplitter = lazy_import("llama_index.core.node_parser", "SentenceSplitter")
+SemanticSplitterNodeParser = lazy_import("llama_index.core.node_parser", "SemanticSplitterNodeParser")
+embedding = lazy_import("embedding")
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] - %(message)s")
 logger = logging.getLogger(__name__)
 
 # ----------- Transform -----------
+# Một splitter (và một embed model) dùng chung cho mọi trang/tài liệu, theo API key
+_semantic_splitters: Dict[str, "SemanticSplitterNodeParser"] = {}
+
+def get_semantic_splitter(openai_api_key: str, embed_batch_size: int = 512) -> "SemanticSplitterNodeParser":
+    splitter = _semantic_splitters.get(openai_api_key)
+    if splitter is None:
+        embed_model = embedding.get_embed_model(api_key=openai_api_key, embed_batch_size=embed_batch_size)
+        splitter = SemanticSplitterNodeParser(
+            buffer_size=1,
+            breakpoint_percentile_threshold=95,
+            embed_model=embed_model,
+        )
+        _semantic_splitters[openai_api_key] = splitter
+    return splitter
+
+def _cosine_distances(embeddings: List[List[float]]) -> List[float]:
+    """1 - cosine similarity giữa các sentence group liên tiếp (vectorized)"""
+    emb = np.asarray(embeddings, dtype=np.float64)
+    if len(emb) < 2:
+        return []
+    norms = np.linalg.norm(emb, axis=1)
+    dots = np.einsum("ij,ij->i", emb[:-1], emb[1:])
+    return (1.0 - dots / (norms[:-1] * norms[1:])).tolist()
+
+def _semantic_split_group(splitter: "SemanticSplitterNodeParser", sentence_groups: List[list]) -> List[List[str]]:
+    """
+    Embed sentence windows của nhiều trang trong một lần gọi, rồi tính breakpoint cho từng trang.
+    Kết quả giống SemanticSplitterNodeParser.get_nodes_from_documents chạy riêng từng trang.
+    """
+    windows = [s["combined_sentence"] for sentences in sentence_groups for s in sentences]
+    with span("embed_batch_split", batch_size=len(windows)):
+        embeddings = splitter.embed_model.get_text_embedding_batch(windows)
+    count_items("embed_batch_split", len(windows))
+    page_parts = []
+    offset = 0
+    for sentences in sentence_groups:
+        distances = _cosine_distances(embeddings[offset:offset + len(sentences)])
+        offset += len(sentences)
+        page_parts.append(splitter._build_node_chunks(sentences, distances))
+    return page_parts
+
+def _make_chunk(c: Dict[str, Any], text: str) -> Dict[str, Any]:
+    chunk = {
+        "title": c.get("title"),
+        "text": text,
+        "page_labels": c.get("page_labels"),
+        "tables": c.get("tables"),
+    }
+    if "source_file" in c:
+        chunk["source_file"] = c["source_file"]
+    return chunk
+
+def _split_texts(
+    items: List[Dict[str, Any]],
+    sentence_splitter: "SentenceSplitter",
+    semantic_splitter: Optional["SemanticSplitterNodeParser"],
+    sentence_batch_size: int,
+) -> List[List[str]]:
+    """
+    Chia text của từng item (trang hoặc tài liệu) thành các phần, giữ nguyên thứ tự item.
+    Semantic split nếu có splitter, fallback SentenceSplitter theo nhóm khi embedding lỗi.
+    """
+    results: List[List[str]] = [[] for _ in items]
+
+    def split_by_sentence(i):
+        with span("split_sentence", page=items[i].get("page_labels")):
+            results[i] = sentence_splitter.split_text(items[i]["text"])
+
+    if not semantic_splitter:
+        for i in range(len(items)):
+            split_by_sentence(i)
+        return results
+
+    pending, pending_groups, pending_windows = [], [], 0
+
+    def flush():
+        try:
+            with span("split_semantic", pages=len(pending)):
+                parts_per_item = _semantic_split_group(semantic_splitter, pending_groups)
+            for i, parts in zip(pending, parts_per_item):
+                results[i] = parts
+        except Exception as e:
+            logger.warning(f"⚠️ SemanticSplitter error: {e}, fallback to SentenceSplitter ({len(pending)} trang)")
+            for i in pending:
+                split_by_sentence(i)
+
+    # Gom các item liên tiếp cho tới khi đủ sentence_batch_size window → một lần embed
+    for i, c in enumerate(items):
+        sentences = semantic_splitter._build_sentence_groups(semantic_splitter.sentence_splitter(c["text"]))
+        pending.append(i)
+        pending_groups.append(sentences)
+        pending_windows += len(sentences)
+        if pending_windows >= sentence_batch_size:
+            flush()
+            pending, pending_groups, pending_windows = [], [], 0
+    if pending:
+        flush()
+    return results
+
 def split_chunk_semantic_sentence(
     chunks: List[Dict[str, Any]],
     max_tokens: int = 1024,
     openai_api_key: Optional[str] = None,
+    sentence_batch_size: int = 512,
 ):
-    final_chunks = []
-    embed_model = None
-    if openai_api_key:
-        embed_model = OpenAIEmbedding(
-            model="text-embedding-3-small", api_key=openai_api_key
-        )
-    for c in chunks:
+    """
+    Chia trang thành chunk: semantic split (nếu có API key), fallback SentenceSplitter
+    Args:
+        chunks: Danh sách trang (có thể từ nhiều PDF, giữ nguyên thứ tự)
+        max_tokens: Chunk size cho SentenceSplitter
+        openai_api_key: OpenAI key cho semantic split
+        sentence_batch_size: Số sentence window tối thiểu gom lại trước mỗi lần gọi embedding
+    """
+    sentence_splitter = SentenceSplitter(
+        chunk_size=max_tokens, chunk_overlap=int(max_tokens * 0.1)
+    )
+    semantic_splitter = get_semantic_splitter(openai_api_key) if openai_api_key else None
+
+    pages = [c for c in chunks if c.get("text", "").strip()]
+    parts_per_page = _split_texts(pages, sentence_splitter, semantic_splitter, sentence_batch_size)
+    final_chunks = [_make_chunk(c, p) for c, parts in zip(pages, parts_per_page) for p in parts]
+
+    count_items("split", len(final_chunks))
+    logger.info(f"After splitting: {len(final_chunks)} chunks")
+    return final_chunks
+
+def merge_pages_into_documents(pages: List[Dict[str, Any]], separator: str = "\n\n") -> List[Dict[str, Any]]:
+    """
+    Nối các trang liên tiếp cùng source_file thành một tài liệu,
+    kèm page_offsets: [(vị trí ký tự bắt đầu, số trang), ...] để map chunk → trang
+    """
+    documents = []
+    for c in pages:
         text = c.get("text", "")
         if not text.strip():
             continue
-        if embed_model:
-            try:
-                ss = SemanticSplitterNodeParser(
-                    buffer_size=1,
-                    breakpoint_percentile_threshold=95,
-                    embed_model=embed_model,
-                )
-                doc = LlamaDocument(text=text, metadata=c)
-                nodes = ss.get_nodes_from_documents([doc])
-                for n in nodes:
-                    final_chunks.append({
-                        "title": c.get("title"),
-                        "text": n.get_content(),
-                        "page_labels": c.get("page_labels"),
-                        "tables": c.get("tables"),
-                    })
-                continue
-            except Exception as e:
-                logger.warning(f"⚠️ SemanticSplitter error: {e}, fallback to SentenceSplitter")
-        splitter = SentenceSplitter(
-            chunk_size=max_tokens, chunk_overlap=int(max_tokens * 0.1)
-        )
-        parts = splitter.split_text(text)
-        for p in parts:
-            final_chunks.append({
-                "title": c.get("title"),
-                "text": p,
-                "page_labels": c.get("page_labels"),
-                "tables": c.get("tables"),
+        page_num = c["page_labels"][0]
+        source_file = c.get("source_file")
+        if not documents or documents[-1]["source_file"] != source_file:
+            documents.append({
+                "title": source_file or "Document",
+                "text": "",
+                "source_file": source_file,
+                "page_offsets": [],
             })
-    logger.info(f"After splitting: {len(final_chunks)} chunks")
+        doc = documents[-1]
+        if doc["text"]:
+            doc["text"] += separator
+        doc["page_offsets"].append((len(doc["text"]), page_num))
+        doc["text"] += text
+    return documents
+
+def _page_span(page_offsets: List[tuple], start: int, end: int) -> tuple:
+    starts = [offset for offset, _ in page_offsets]
+    first = page_offsets[max(bisect.bisect_right(starts, start) - 1, 0)][1]
+    last = page_offsets[max(bisect.bisect_right(starts, max(end - 1, start)) - 1, 0)][1]
+    return first, last
+
+def _locate_chunk(text: str, part: str, search_from: int) -> int:
+    """
+    Vị trí bắt đầu của chunk trong text gốc (tìm từ search_from), -1 nếu không tìm thấy.
+    Thử cả chunk trước (tránh khớp nhầm đoạn mở đầu lặp lại, vd. "Điều 1."), rồi 64 ký tự đầu,
+    rồi 32 ký tự đầu sau khi bỏ khoảng trắng (splitter có thể strip/ghép lại whitespace).
+    """
+    for probe in (part, part[:64], part.strip()[:32]):
+        if probe:
+            start = text.find(probe, search_from)
+            if start >= 0:
+                return start
+    return -1
+
+def split_chunk_document_level(
+    pages: List[Dict[str, Any]],
+    max_tokens: int = 1024,
+    openai_api_key: Optional[str] = None,
+    sentence_batch_size: int = 512,
+):
+    """
+    Chia chunk trên toàn bộ text của mỗi PDF (không cắt tại ranh giới trang).
+    Mỗi chunk có page_start/page_end; phần semantic dài hơn max_tokens được cắt tiếp bằng SentenceSplitter.
+    Args:
+        pages: Danh sách trang (output của extract, có source_file)
+        max_tokens: Kích thước tối đa mỗi chunk
+        openai_api_key: OpenAI key cho semantic split
+        sentence_batch_size: Số sentence window tối thiểu gom lại trước mỗi lần gọi embedding
+    """
+    sentence_splitter = SentenceSplitter(
+        chunk_size=max_tokens, chunk_overlap=int(max_tokens * 0.1)
+    )
+    semantic_splitter = get_semantic_splitter(openai_api_key) if openai_api_key else None
+
+    documents = merge_pages_into_documents(pages)
+    parts_per_doc = _split_texts(documents, sentence_splitter, semantic_splitter, sentence_batch_size)
+
+    final_chunks = []
+    for doc, parts in zip(documents, parts_per_doc):
+        if semantic_splitter:
+            parts = [p for part in parts for p in sentence_splitter.split_text(part)]
+        text = doc["text"]
+        search_from = 0
+        not_found = 0
+        for part in parts:
+            # Định vị chunk trong text gốc (chunk sau có thể overlap chunk trước)
+            start = _locate_chunk(text, part, search_from)
+            if start < 0:
+                # Không tìm thấy → coi như chunk bắt đầu ngay sau chunk trước (page span có thể lệch sớm),
+                # giữ nguyên search_from để chunk kế tiếp vẫn tìm được
+                start = search_from
+                not_found += 1
+            else:
+                search_from = start + 1
+            end = min(start + len(part), len(text))
+            page_start, page_end = _page_span(doc["page_offsets"], start, end)
+            chunk = {
+                "title": f"Page {page_start}" if page_start == page_end else f"Page {page_start}-{page_end}",
+                "text": part,
+                "page_labels": list(range(page_start, page_end + 1)),
+                "page_start": page_start,
+                "page_end": page_end,
+                "tables": [],
+            }
+            if doc["source_file"] is not None:
+                chunk["source_file"] = doc["source_file"]
+            final_chunks.append(chunk)
+        if not_found:
+            logger.warning(
+                f"⚠️ {doc['title']}: {not_found}/{len(parts)} chunk không định vị được trong text gốc, "
+                f"page_start/page_end ước lượng theo chunk trước"
+            )
+
+    count_items("split", len(final_chunks))
+    logger.info(f"After document-level splitting: {len(final_chunks)} chunks từ {len(documents)} tài liệu")
     return final_chunks
+
+def tables_to_chunks(tables: List["pd.DataFrame"], max_tokens: int = 1024) -> List[Dict[str, Any]]:
+    """
+    Biến mỗi bảng thành chunk text riêng (dòng header + các hàng, cột ngăn cách bởi " | ").
+    Bảng dài được cắt theo nhóm hàng, mỗi chunk lặp lại header.
+    """
+    max_chars = max_tokens * 4  # ước lượng ~4 ký tự / token
+    table_chunks = []
+    for df in tables:
+        page = df.attrs.get("page")
+        table_index = df.attrs.get("table_index")
+        title = f"Page {page} - Table {table_index}"
+        header = " | ".join("" if pd.isna(c) else str(c) for c in df.columns)
+        # Ô trống/merge: pdfplumber trả None, DataFrame (và Parquet cache) đổi thành NaN → không embed chữ "nan"
+        lines = [" | ".join("" if pd.isna(v) else str(v) for v in row) for row in df.itertuples(index=False)]
+        current, current_len = [], len(header)
+        for line in lines + [None]:
+            if line is None or (current and current_len + len(line) + 1 > max_chars):
+                if current:
+                    table_chunks.append({
+                        "title": title,
+                        "text": f"{title}\n{header}\n" + "\n".join(current),
+                        "page_labels": [page],
+                        "tables": [],
+                        "chunk_type": "table",
+                    })
+                current, current_len = [], len(header)
+                if line is None:
+                    break
+            current.append(line)
+            current_len += len(line) + 1
+    logger.info(f"Table chunks: {len(table_chunks)} chunks từ {len(tables)} bảng")
+    return table_chunks